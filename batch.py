@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Filename      : batch.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Run a plugin on a list of hosts with a pool of workers.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# Hosts are read from a file (or stdin with '-'), one per line:
+#
+#   <host_name> [<address>]
+#
+# The address defaults to the host name. Blank lines and lines starting with
+# '#' are ignored. Each host is checked by a worker process of the pool with
+# the plugin arguments given on the command line and '-H <address>', the
+# plugin being imported once per worker (see pollerd.py).
+#
+# Results are printed one line per host as '<host_name>;<return code>;<output>'
+# with newlines of the output escaped as in external commands, or written to
+# the external command file as passive check results for a service. The exit
+# status is the worst state of the hosts, CRITICAL being worse than WARNING,
+# worse than UNKNOWN, worse than OK.
+#
+#   $ ./check_cisco_cpu.py --batch access-switches.txt --workers 32 -C public -w 80 -c 90
+#
+
+import sys
+import time
+import argparse
+import multiprocessing
+from functools import partial
+
+from pollerd import SEVERITY, Job, CommandFile, escape_output, load_plugins, run_check
+
+
+def load_hosts(hosts_file):
+    """Return the list of (host_name, address) read from ``hosts_file``."""
+    hosts = []
+    for line in hosts_file:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split()
+        hosts.append((fields[0], fields[1] if len(fields) > 1 else fields[0]))
+    return hosts
+
+
+def _check_host(plugin, arguments, timeout, host):
+    host_name, address = host
+    return host_name, run_check(plugin, ['-H', address] + arguments, timeout)
+
+
+def run_batch(plugin, hosts, arguments, workers, timeout, command_file=None, service=None):
+    """
+    Check ``hosts`` with ``plugin`` and report each result as it completes.
+
+    Return the tuple (worst return code, number of hosts, number of workers,
+    elapsed seconds).
+    """
+    workers = min(workers, len(hosts)) or 1
+    worst = 0
+    pool = multiprocessing.Pool(workers, initializer=load_plugins, initargs=((plugin,),))
+    start = time.time()
+    try:
+        for host_name, (return_code, output) in pool.imap_unordered(partial(_check_host, plugin, arguments, timeout),
+                                                                     hosts):
+            worst = max(worst, return_code, key=SEVERITY.index)
+            if command_file:
+                command_file.submit(Job(host_name, service, 0, plugin, arguments), return_code, output)
+            else:
+                print '%s;%d;%s' % (host_name, return_code, escape_output(output))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return worst, len(hosts), workers, time.time() - start
+
+
+def batch_main(plugin, argv=None):
+    """
+    Run ``plugin`` in batch mode if ``--batch`` is on the command line.
+
+    Return False when not in batch mode so that the plugin runs normally,
+    exit with the worst return code of the hosts otherwise.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if '--batch' not in argv:
+        return False
+
+    parser = argparse.ArgumentParser(prog=plugin, description='Batch mode: check a list of hosts. Other arguments '
+                                                              'are given to the plugin for each host.')
+    parser.add_argument('--batch', dest='hosts', type=argparse.FileType('r'), required=True,
+                        help='File listing hosts to check, - for stdin.')
+    parser.add_argument('--workers', dest='workers', type=int, default=multiprocessing.cpu_count() * 4,
+                        help='Number of worker processes (default: %(default)s).')
+    parser.add_argument('--timeout', dest='timeout', type=int, default=60,
+                        help='Timeout of a single check in seconds (default: %(default)s).')
+    parser.add_argument('--command-file', dest='command_file',
+                        help='Submit passive check results to this external command file instead of printing them.')
+    parser.add_argument('--service', dest='service',
+                        help='Service description of the passive check results.')
+    options, arguments = parser.parse_known_args(argv)
+
+    if options.command_file and not options.service:
+        parser.error('--service is required with --command-file.')
+
+    hosts = load_hosts(options.hosts)
+    command_file = CommandFile(options.command_file) if options.command_file else None
+    return_code, number, workers, elapsed = run_batch(plugin, hosts, arguments, options.workers, options.timeout,
+                                                      command_file, options.service)
+
+    sys.stderr.write('Checked %d hosts in %.2fs (%.1f hosts/s) with %d workers.\n' % (
+        number, elapsed, number / elapsed if elapsed else 0, workers))
+    sys.exit(return_code)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Name          : bench_imports.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Check import time of the plugins against a budget.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# Each plugin module is imported in a new interpreter, after the modules it
+# cannot avoid (monitoring.nagios and the SNMP stack). The time left is the
+# cost of the plugin and of the modules of this collection it imports, it must
+# stay within the budget. Modules only needed by debug output or optional
+# modes must not be imported at all.
+#
+#   $ ./bench_imports.py
+#   $ ./bench_imports.py --bundle ../netplugins.pyz
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+PLUGINS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Modules imported before timing the import of a plugin
+PRELOADED = ('monitoring.nagios.plugin', 'pysnmp.proto.api', 'pyasn1.codec.ber.decoder')
+
+# Import time budget in milliseconds, once PRELOADED modules are imported
+BUDGETS = {
+    'check_cisco_config': 10,
+    'check_cisco_cpu': 10,
+    'check_cisco_hard': 10,
+    'check_cisco_health': 10,
+    'check_cisco_hsrp': 10,
+    'check_cisco_temp': 10,
+    'check_ibm_san_directors_crcs': 10,
+    'check_oftp': 5,
+    'check_snmpnetstat': 10,
+}
+
+# Modules that must not be imported when loading a plugin
+DEFERRED = ('pprint', 'multiprocessing', 'cPickle', 'hashlib', 'batch', 'pollerd', 'snmpcache',
+            'statestore', 'circuit')
+
+MEASURE = '''
+import sys, json
+from timeit import default_timer
+for name in %(preloaded)r:
+    try:
+        __import__(name)
+    except ImportError:
+        pass
+before = set(sys.modules)
+start = default_timer()
+__import__(%(plugin)r)
+elapsed = default_timer() - start
+print(json.dumps([elapsed, sorted(name for name in set(sys.modules) - before if sys.modules[name])]))
+'''
+
+
+def measure(plugin, path):
+    """Return the tuple (seconds, modules imported) of the import of ``plugin`` in a new interpreter."""
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, [path, environment.get('PYTHONPATH')]))
+    process = subprocess.Popen([sys.executable, '-c', MEASURE % {'preloaded': PRELOADED, 'plugin': plugin}],
+                               stdout=subprocess.PIPE, env=environment, cwd='/')
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError('Cannot import %s.' % plugin)
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check import time of the plugins against a budget.')
+    parser.add_argument('-n', '--repeat', type=int, default=10, help='Imports per plugin (default: %(default)s).')
+    parser.add_argument('--bundle', help='Import plugins from this bundle (see bundle.py) instead of sources.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiply budgets by this factor on slow hosts (default: %(default)s).')
+    options = parser.parse_args()
+
+    path = os.path.abspath(options.bundle) if options.bundle else os.path.abspath(PLUGINS_DIR)
+    failures = []
+    print('%-30s %10s %10s %8s' % ('plugin', 'import (ms)', 'budget', 'modules'))
+    for plugin, budget in sorted(BUDGETS.iteritems()):
+        runs = [measure(plugin, path) for i in xrange(options.repeat)]
+        elapsed = min(run[0] for run in runs) * 1000
+        modules = runs[-1][1]
+        budget *= options.scale
+        print('%-30s %10.1f %10.1f %8d' % (plugin, elapsed, budget, len(modules)))
+
+        if elapsed > budget:
+            failures.append('%s: import took %.1f ms (budget %.1f ms)' % (plugin, elapsed, budget))
+        for module in DEFERRED:
+            if module in modules:
+                failures.append('%s: imports %s' % (plugin, module))
+
+    for failure in failures:
+        print('OVER BUDGET %s' % failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Name          : bench_join.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Micro-benchmark of column joins used to resolve entity names.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# Compare the list scan join formerly used by plugins with a join on the rows
+# indexed by their SNMP index in a dict. Scan timings are measured on a sample of rows and
+# extrapolated as a full scan join of 50k rows would take hours.
+#
+
+from __future__ import print_function
+
+import random
+from timeit import default_timer
+
+SIZES = (1000, 10000, 50000)
+SCAN_SAMPLE = 200
+
+
+class Row(object):
+    """Mimic a result object returned by plugin.snmp.getnext()."""
+    def __init__(self, index, value):
+        self.oid = '1.3.6.1.2.1.47.1.1.1.1.7.%d' % index
+        self.index = index
+        self.value = value
+
+    def pretty(self):
+        return str(self.value)
+
+
+def make_tables(size):
+    names = [Row(i, 'Entity %d' % i) for i in range(1, size + 1)]
+    values = [Row(i, i % 100) for i in range(1, size + 1)]
+    random.shuffle(values)
+    return names, values
+
+
+def scan_join(names, values):
+    return [[e.pretty() for e in names if e.index == v.index][0] for v in values]
+
+
+def index_column(column):
+    """Index the rows of a walked column by their SNMP index."""
+    return dict((row.index, row) for row in column)
+
+
+def indexed_join(names, values):
+    names = index_column(names)
+    return [names[v.index].pretty() for v in values]
+
+
+def main():
+    random.seed(0)
+    print('%8s %14s %14s %10s' % ('rows', 'scan (s)', 'indexed (s)', 'speedup'))
+    for size in SIZES:
+        names, values = make_tables(size)
+
+        start = default_timer()
+        indexed_join(names, values)
+        indexed = default_timer() - start
+
+        sample = values[:SCAN_SAMPLE]
+        start = default_timer()
+        scan_join(names, sample)
+        scan = (default_timer() - start) * size / len(sample)
+
+        print('%8d %14.3f %14.4f %9.0fx' % (size, scan, indexed, scan / indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Name          : bench_load.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Load test of the plugins against a simulated fleet of devices.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# A fleet of --agents SNMP agents is simulated on consecutive loopback
+# addresses (127.1.0.1, 127.1.0.2...) sharing one port, served by --responders
+# processes of snmpsim.py answering after --latency ms (+/- --jitter) and
+# dropping --loss percent of the requests. Agents have the tables of a fixture
+# (--device nexus...) or of a generated switch sized with --ports, --sensors,
+# --cpus and --vlans. A plugin then checks all the agents in one of the modes:
+#
+#   single   a plugin process per check as run by Nagios, --concurrency at once
+#   batch    a --batch run of the plugin with --concurrency workers
+#   audit    a --audit run of check_cisco_config
+#   pollerd  pollerd.py with --concurrency workers checking each agent every
+#            --interval seconds during --duration seconds
+#
+# Checks/s, latency percentiles and CPU time per check (plugin processes and
+# workers) are reported with the load of the responders: they must stay below
+# one core each for the results to be about the plugins. Latency is the wall
+# time of the plugin process in single mode, its check_time (--timings) in
+# batch and pollerd modes. Save a run with --json and compare later runs to it
+# to catch throughput regressions:
+#
+#   $ ./bench_load.py --agents 2000 --latency 20 --loss 1 --concurrency 64 check_cisco_cpu
+#   $ ./bench_load.py --agents 2000 --mode pollerd --interval 60 --duration 120 check_cisco_temp --json load.json
+#   $ ./bench_load.py --agents 2000 --mode pollerd --interval 60 --duration 120 check_cisco_temp --compare load.json
+#
+# Other arguments are given to the plugin, eg. --max-repetitions 10.
+#
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import json
+import time
+import pipes
+import random
+import shutil
+import signal
+import socket
+import resource
+import tempfile
+import argparse
+import subprocess
+import multiprocessing
+from collections import deque
+from timeit import default_timer
+
+from snmpsim import Responder, Dataset, load_walk, agent_addresses
+from fixtures import FIXTURES_DIR, fixture_paths, device
+
+PLUGINS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Community of the simulated agents
+COMMUNITY = 'load'
+
+# Arguments of the plugins
+PLUGINS = {
+    'check_cisco_config': [],
+    'check_cisco_cpu': ['-w', '80', '-c', '90'],
+    'check_cisco_hard': [],
+    'check_cisco_health': [],
+    'check_cisco_hsrp': ['-r', 'active'],
+    'check_cisco_temp': ['-w', '60', '60', '60', '-c', '70', '70', '70'],
+}
+
+# Services checked by check_cisco_health
+HEALTH_SERVICES = '''CPU check_cisco_cpu -w 80 -c 90
+Temperature check_cisco_temp -w 60 60 60 -c 70 70 70
+Hardware check_cisco_hard
+Config check_cisco_config
+'''
+
+# Plugins of each mode, None for all
+MODES = {
+    'single': None,
+    'batch': ('check_cisco_cpu',),
+    'audit': ('check_cisco_config',),
+    'pollerd': None,
+}
+
+# check_time perfdata of --timings
+CHECK_TIME = re.compile(r'check_time=([0-9.]+)s')
+
+
+def serve(datasets, addresses, options, seed, queue, stop):
+    """Responder process: serve the agents of ``addresses`` until ``stop`` is set, then report its load."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        responder = Responder(datasets, latency=options.latency / 1000.0, jitter=options.jitter / 1000.0,
+                              loss=options.loss / 100.0, addresses=addresses, seed=seed)
+    except socket.error as e:
+        queue.put('Cannot bind agents: %s' % e)
+        return
+
+    responder.start()
+    queue.put(None)
+    stop.wait()
+    responder.stop()
+    queue.put((sum(responder.pdus.itervalues()), responder.lost, sum(os.times()[:2])))
+
+
+class Fleet(object):
+    """Processes of responders sharing the agents of ``addresses``."""
+    def __init__(self, datasets, addresses, options):
+        self.queue = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+        number = max(min(options.responders, len(addresses)), 1)
+        self.processes = [multiprocessing.Process(target=serve, args=(datasets, addresses[start::number], options,
+                                                                      start, self.queue, self.stop_event))
+                          for start in xrange(number)]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        errors = filter(None, [self.queue.get() for process in self.processes])
+        if errors:
+            self.stop()
+            raise RuntimeError(errors[0])
+
+    def stop(self):
+        """Stop the responders, return their total (PDUs, dropped requests, CPU seconds)."""
+        self.stop_event.set()
+        loads = []
+        for process in self.processes:
+            process.join(10)
+        while not self.queue.empty():
+            loads.append(self.queue.get())
+        return tuple(sum(load[i] for load in loads) for i in xrange(3))
+
+
+def plugin_command(plugin, options, arguments):
+    return [sys.executable, os.path.join(PLUGINS_DIR, '%s.py' % plugin), '--snmp-port', str(options.port),
+            '-C', COMMUNITY] + arguments
+
+
+def run_single(plugin, options, arguments, addresses):
+    """Run a plugin process per check. Return the (status, latency) of checks and their CPU seconds."""
+    results = []
+    cpu = 0.0
+    waiting = deque(address for number in xrange(options.rounds) for address in addresses)
+    running = {}
+    with open(os.devnull, 'w') as devnull:
+        while waiting or running:
+            while waiting and len(running) < options.concurrency:
+                command = plugin_command(plugin, options, ['-H', waiting.popleft()] + arguments)
+                process = subprocess.Popen(command, stdout=devnull, stderr=devnull)
+                running[process.pid] = (process, default_timer())
+
+            pid, status, usage = os.wait4(-1, 0)
+            if pid not in running:
+                continue
+            process, start = running.pop(pid)
+            process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 3
+            results.append((process.returncode, default_timer() - start))
+            cpu += usage.ru_utime + usage.ru_stime
+    return results, cpu
+
+
+def parse_results(lines, status_field):
+    """Return the (status, check_time) of results lines split on ';', status in field ``status_field``."""
+    results = []
+    for line in lines:
+        fields = line.rstrip('\n').split(';', status_field + 1)
+        if len(fields) <= status_field or not fields[status_field].isdigit():
+            continue
+        check_time = CHECK_TIME.search(fields[-1])
+        results.append((int(fields[status_field]), float(check_time.group(1)) if check_time else None))
+    return results
+
+
+def run_process(command):
+    """Run ``command``, return its output lines and CPU seconds (with its reaped workers)."""
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    lines = process.stdout.readlines()
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status)
+    return lines, usage.ru_utime + usage.ru_stime
+
+
+def run_batch(plugin, options, arguments, hosts_file):
+    """Check all agents with the batch mode of the plugin (see batch.py)."""
+    lines, cpu = run_process(plugin_command(plugin, options, ['--batch', hosts_file, '--workers',
+                                                              str(options.concurrency), '--timings'] + arguments))
+    return parse_results(lines, 1), cpu
+
+
+def run_audit(plugin, options, arguments, hosts_file):
+    """Check all agents with the audit mode of check_cisco_config."""
+    lines, cpu = run_process(plugin_command(plugin, options, ['--audit', hosts_file] + arguments))
+    return parse_results(lines, 1), cpu
+
+
+def run_pollerd(plugin, options, arguments, addresses, directory):
+    """Schedule a check of each agent in pollerd.py and collect the results submitted during --duration."""
+    jobs_file = os.path.join(directory, 'pollerd.jobs')
+    command_file = os.path.join(directory, 'nagios.cmd')
+    log_file = os.path.join(directory, 'pollerd.log')
+    with open(jobs_file, 'w') as jobs:
+        for address in addresses:
+            jobs.write('%s Load %d %s -H %s --snmp-port %d -C %s --timings %s\n' % (
+                address, options.interval, plugin, address, options.port, COMMUNITY,
+                ' '.join(pipes.quote(argument) for argument in arguments)))
+
+    with open(log_file, 'w') as log:
+        process = subprocess.Popen([sys.executable, os.path.join(PLUGINS_DIR, 'pollerd.py'), '-f', jobs_file,
+                                    '-e', command_file, '-w', str(options.concurrency)], stderr=log)
+        time.sleep(options.duration)
+        process.send_signal(signal.SIGTERM)
+        pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.WEXITSTATUS(status)
+
+    with open(log_file) as log:
+        skipped = sum(1 for line in log if 'still running, skipped' in line)
+    if skipped:
+        print('pollerd skipped %d checks still running at their next interval.' % skipped)
+
+    results = []
+    if os.path.exists(command_file):
+        with open(command_file) as commands:
+            results = parse_results(commands, 3)
+    return results, usage.ru_utime + usage.ru_stime
+
+
+def percentile(values, percent):
+    """Return the ``percent`` percentile of the sorted list ``values``, None if empty."""
+    if not values:
+        return None
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+
+def summarize(results, elapsed, cpu):
+    latencies = sorted(latency for status, latency in results if latency is not None)
+    return {
+        'checks': len(results),
+        'unknown': sum(1 for status, latency in results if status == 3),
+        'elapsed': elapsed,
+        'rate': len(results) / elapsed if elapsed else 0,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else None,
+        'cpu': cpu / len(results) if results else 0,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Return the list of regressions of ``result`` over ``baseline``."""
+    regressions = []
+    factor = 1 + tolerance / 100.0
+    if result['rate'] * factor < baseline['rate']:
+        regressions.append('checks/s %.1f < %.1f' % (result['rate'], baseline['rate']))
+    for metric in ('p50', 'p90', 'p99', 'cpu'):
+        if result[metric] is not None and baseline.get(metric) is not None \
+                and result[metric] > baseline[metric] * factor:
+            regressions.append('%s %.1f ms > %.1f ms' % (metric, result[metric] * 1000, baseline[metric] * 1000))
+    return regressions
+
+
+def load_dataset(options):
+    """Return the Dataset of the agents."""
+    if options.device != 'generated':
+        return Dataset(load_walk(fixture_paths(options.fixtures)[options.device]))
+    # Fixed seed so that the values are the same for every run
+    random.seed('load')
+    return Dataset(device(options.ports, options.sensors, options.cpus, options.vlans))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the plugins against a simulated fleet of devices.')
+    parser.add_argument('plugin', choices=sorted(PLUGINS), help='Plugin to run.')
+    parser.add_argument('--mode', choices=sorted(MODES), default='single', help='How the plugin is run '
+                                                                                 '(default: %(default)s).')
+    parser.add_argument('--agents', type=int, default=1000, help='Simulated devices (default: %(default)s).')
+    parser.add_argument('--address', default='127.1.0.1', help='Address of the first agent (default: %(default)s).')
+    parser.add_argument('--port', type=int, default=1161, help='UDP port of the agents (default: %(default)s).')
+    parser.add_argument('--responders', type=int, default=2,
+                        help='Processes serving the agents (default: %(default)s).')
+    parser.add_argument('--latency', type=float, default=0, help='Response delay in ms (default: %(default)s).')
+    parser.add_argument('--jitter', type=float, default=0, help='Random delay added or removed in ms '
+                                                                  '(default: %(default)s).')
+    parser.add_argument('--loss', type=float, default=0, help='Percent of requests dropped (default: %(default)s).')
+    parser.add_argument('--device', default='generated', help='Fixture served by the agents, or generated '
+                                                              '(default: %(default)s).')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='Directory of the walk fixtures.')
+    parser.add_argument('--ports', type=int, default=48, help='Ports of generated devices (default: %(default)s).')
+    parser.add_argument('--sensors', type=int, default=8,
+                        help='Temperature sensors of generated devices (default: %(default)s).')
+    parser.add_argument('--cpus', type=int, default=1, help='CPUs of generated devices (default: %(default)s).')
+    parser.add_argument('--vlans', type=int, default=0,
+                        help='HSRP SVIs of generated devices (default: %(default)s).')
+    parser.add_argument('--concurrency', type=int, default=multiprocessing.cpu_count() * 4,
+                        help='Plugin processes or workers running at once (default: %(default)s).')
+    parser.add_argument('--rounds', type=int, default=1,
+                        help='Checks of each agent in single, batch and audit modes (default: %(default)s).')
+    parser.add_argument('--interval', type=int, default=60,
+                        help='Check interval of pollerd mode in seconds (default: %(default)s).')
+    parser.add_argument('--duration', type=int, default=120,
+                        help='Run time of pollerd mode in seconds (default: %(default)s).')
+    parser.add_argument('--json', dest='json_file', help='Save results to this file.')
+    parser.add_argument('--compare', help='Compare results with a file saved by --json.')
+    parser.add_argument('--tolerance', type=float, default=20,
+                        help='Regression tolerance in percent for --compare (default: %(default)s).')
+    options, arguments = parser.parse_known_args()
+
+    if MODES[options.mode] and options.plugin not in MODES[options.mode]:
+        parser.error('%s mode only runs %s.' % (options.mode, ', '.join(MODES[options.mode])))
+    if options.device != 'generated' and options.device not in fixture_paths(options.fixtures):
+        parser.error('Unknown device %s.' % options.device)
+
+    # A socket per agent in the responders
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < options.agents + 1024 and soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    directory = tempfile.mkdtemp(prefix='bench_load')
+    addresses = agent_addresses(options.address, options.agents)
+    hosts_file = os.path.join(directory, 'hosts')
+    with open(hosts_file, 'w') as hosts:
+        hosts.write(''.join('%s\n' % address for address in addresses))
+
+    arguments = PLUGINS[options.plugin] + arguments
+    if options.plugin == 'check_cisco_health':
+        services_file = os.path.join(directory, 'health.services')
+        with open(services_file, 'w') as services:
+            services.write(HEALTH_SERVICES)
+        arguments += ['--services', services_file]
+
+    fleet = Fleet({COMMUNITY: load_dataset(options)}, [(address, options.port) for address in addresses], options)
+    fleet.start()
+    start = default_timer()
+    try:
+        if options.mode == 'single':
+            results, cpu = run_single(options.plugin, options, arguments, addresses)
+        elif options.mode == 'batch':
+            results, cpu = run_batch(options.plugin, options, arguments, hosts_file)
+        elif options.mode == 'audit':
+            results, cpu = run_audit(options.plugin, options, arguments, hosts_file)
+        else:
+            results, cpu = run_pollerd(options.plugin, options, arguments, addresses, directory)
+    finally:
+        elapsed = default_timer() - start
+        pdus, lost, responders_cpu = fleet.stop()
+        shutil.rmtree(directory)
+
+    result = summarize(results, elapsed, cpu)
+    print('%s (%s mode) on %d agents: %d checks in %.1fs, %.1f checks/s, %d UNKNOWN.' % (
+        options.plugin, options.mode, options.agents, result['checks'], elapsed, result['rate'], result['unknown']))
+    if result['p50'] is not None:
+        print('Latency (ms): p50 %.1f, p90 %.1f, p99 %.1f, max %.1f.' % tuple(
+            result[metric] * 1000 for metric in ('p50', 'p90', 'p99', 'max')))
+    print('CPU per check: %.1f ms.' % (result['cpu'] * 1000))
+    print('Responders: %d PDUs, %d dropped, %.1f%% of a core each.' % (
+        pdus, lost, 100 * responders_cpu / elapsed / len(fleet.processes) if elapsed else 0))
+
+    if options.json_file:
+        with open(options.json_file, 'w') as json_file:
+            json.dump(result, json_file, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            regressions = compare(result, json.load(baseline_file), options.tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Name          : bench_memory.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Memory used by the rows of large walks.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# A table of an entity name column (strings) and a status column (integers) is
+# served by the local agent of snmpsim.py and walked with getnext() in a new
+# interpreter. The growth of its resident memory while holding the result is
+# reported per row. Give the sources of another version with --source to
+# compare:
+#
+#   $ ./bench_memory.py
+#   $ git worktree add /tmp/previous HEAD~1 && ./bench_memory.py --source /tmp/previous
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+from pysnmp.proto import rfc1902
+
+from snmpsim import Responder, Dataset
+
+PLUGINS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+NAME_OID = '1.3.6.1.2.1.47.1.1.1.1.7'           # ENTITY-MIB::entPhysicalName
+STATUS_OID = '1.3.6.1.4.1.9.9.91.1.1.1.1.5'     # CISCO-ENTITY-SENSOR-MIB::entSensorStatus
+
+SIZES = (1000, 10000, 50000)
+
+MEASURE = '''
+import gc, os, json
+from timeit import default_timer
+from snmpclient import Session
+
+def resident():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+session = Session('127.0.0.1', community=%(community)r, port=%(port)d)
+gc.collect()
+before = resident()
+start = default_timer()
+query = session.getnext({'names': %(names)r, 'status': %(status)r})
+elapsed = default_timer() - start
+gc.collect()
+print(json.dumps([resident() - before, elapsed, sum(len(rows) for rows in query.values())]))
+'''
+
+
+def make_dataset(size):
+    rows = []
+    for index in xrange(1, size + 1):
+        rows.append(('%s.%d' % (NAME_OID, index), rfc1902.OctetString('Switch 1 - Module %d Sensor' % index)))
+        rows.append(('%s.%d' % (STATUS_OID, index), rfc1902.Integer(1)))
+    return Dataset(rows)
+
+
+def measure(responder, community, source):
+    """Return (bytes, seconds, rows) of the walk of the table of ``community`` with the sources in ``source``."""
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, [source, environment.get('PYTHONPATH')]))
+    script = MEASURE % {'community': community, 'port': responder.address[1], 'names': NAME_OID,
+                        'status': STATUS_OID}
+    process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, env=environment, cwd='/')
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError('Cannot walk table of %s rows.' % community)
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure memory used by the rows of large walks.')
+    parser.add_argument('--source', default=PLUGINS_DIR, help='Directory of snmpclient.py (default: this tree).')
+    parser.add_argument('sizes', nargs='*', type=int, default=SIZES, help='Rows of the walked tables.')
+    options = parser.parse_args()
+
+    responder = Responder(dict((str(size), make_dataset(size)) for size in options.sizes))
+    responder.start()
+    try:
+        print('%8s %12s %12s %10s' % ('rows', 'memory (KB)', 'bytes/row', 'walk (s)'))
+        for size in options.sizes:
+            memory, elapsed, rows = measure(responder, str(size), os.path.abspath(options.source))
+            print('%8d %12d %12d %10.2f' % (rows, memory / 1024, memory / rows, elapsed))
+    finally:
+        responder.stop()
+
+
+if __name__ == '__main__':
+    main()
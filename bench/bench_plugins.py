@@ -0,0 +1,158 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Name          : bench_plugins.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : End to end benchmark of the SNMP plugins on recorded walks.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# Each plugin is run as Nagios would run it, against the local SNMP agent of
+# snmpsim.py replaying the fixtures walks. Wall time, CPU time (user + system)
+# and peak memory are measured on the plugin process, PDUs are counted by the
+# agent. Save a run with --json and compare later runs to it to catch
+# regressions:
+#
+#   $ ./bench_plugins.py --json baseline.json
+#   $ ./bench_plugins.py --compare baseline.json
+#
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import subprocess
+from timeit import default_timer
+
+from snmpsim import Responder, load_datasets
+from fixtures import FIXTURES_DIR, fixture_paths
+
+PLUGINS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# (name, plugin, fixture, arguments)
+CASES = (
+    ('cpu-catalyst', 'check_cisco_cpu.py', 'catalyst', ['-w', '80', '-c', '90']),
+    ('cpu-nexus', 'check_cisco_cpu.py', 'nexus', ['-w', '80', '-c', '90']),
+    ('hard-catalyst', 'check_cisco_hard.py', 'catalyst', []),
+    ('hard-nexus', 'check_cisco_hard.py', 'nexus', []),
+    ('hard-envmon', 'check_cisco_hard.py', 'catalyst-envmon', []),
+    ('temp-catalyst', 'check_cisco_temp.py', 'catalyst', ['-w', '60', '60', '60', '-c', '70', '70', '70']),
+    ('temp-nexus', 'check_cisco_temp.py', 'nexus', ['-w', '60', '60', '60', '-c', '70', '70', '70']),
+    ('hsrp-router', 'check_cisco_hsrp.py', 'hsrp', ['-r', 'active']),
+    ('san-director', 'check_ibm_san_directors_crcs.py', 'san', ['-r', '2', '-w', '10', '-c', '20']),
+)
+
+
+def run_plugin(responder, community, plugin, arguments):
+    """Run ``plugin`` once, return its (status, output, wall, cpu, maxrss in KB, pdus)."""
+    command = [sys.executable, os.path.join(PLUGINS_DIR, plugin),
+               '-H', responder.address[0], '--snmp-port', str(responder.address[1]),
+               '-C', community] + arguments
+    pdus = responder.pdus[community]
+
+    start = default_timer()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.stdout.read()
+    pid, status, usage = os.wait4(process.pid, 0)
+    wall = default_timer() - start
+    process.returncode = os.WEXITSTATUS(status)
+
+    return process.returncode, output.strip(), wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss, \
+        responder.pdus[community] - pdus
+
+
+def bench(responder, repeat, cases):
+    """Return the results of ``cases``, keeping the best wall and CPU time of ``repeat`` runs."""
+    results = {}
+    for name, plugin, fixture, arguments in cases:
+        retention_dir = tempfile.mkdtemp(prefix='bench_plugins')
+        if plugin == 'check_ibm_san_directors_crcs.py':
+            # First run only creates the retention file
+            arguments = arguments + ['--retention-dir', retention_dir]
+            run_plugin(responder, fixture, plugin, arguments)
+
+        runs = [run_plugin(responder, fixture, plugin, arguments) for i in xrange(repeat)]
+        shutil.rmtree(retention_dir)
+
+        status, output = runs[-1][:2]
+        if status > 2:
+            sys.stderr.write('%s returned %d: %s\n' % (name, status, output))
+
+        results[name] = {
+            'status': status,
+            'wall': min(run[2] for run in runs),
+            'cpu': min(run[3] for run in runs),
+            'maxrss': max(run[4] for run in runs),
+            'pdus': runs[-1][5],
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the list of regressions of ``results`` over ``baseline``."""
+    regressions = []
+    for name, result in sorted(results.iteritems()):
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        for metric in ('wall', 'cpu', 'maxrss', 'pdus'):
+            if result[metric] > reference[metric] * (1 + tolerance / 100.0) and result[metric] > reference[metric]:
+                regressions.append('%s: %s %s > %s' % (name, metric, result[metric], reference[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SNMP plugins against recorded walks.')
+    parser.add_argument('cases', nargs='*', help='Cases to run (default: all).')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='Runs per case (default: %(default)s).')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='Directory of the walk fixtures.')
+    parser.add_argument('--json', dest='json_file', help='Save results to this file.')
+    parser.add_argument('--compare', help='Compare results with a file saved by --json.')
+    parser.add_argument('--tolerance', type=float, default=20,
+                        help='Regression tolerance in percent for --compare (default: %(default)s).')
+    options = parser.parse_args()
+
+    cases = [case for case in CASES if not options.cases or case[0] in options.cases]
+    paths = fixture_paths(options.fixtures)
+    responder = Responder(load_datasets(paths.values()))
+    responder.start()
+
+    results = bench(responder, options.repeat, cases)
+    responder.stop()
+
+    print('%-16s %6s %10s %10s %8s %10s' % ('case', 'status', 'wall (ms)', 'cpu (ms)', 'pdus', 'rss (KB)'))
+    for name, plugin, fixture, arguments in cases:
+        result = results[name]
+        print('%-16s %6d %10.1f %10.1f %8d %10d' % (name, result['status'], result['wall'] * 1000,
+                                                    result['cpu'] * 1000, result['pdus'], result['maxrss']))
+
+    if options.json_file:
+        with open(options.json_file, 'w') as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), options.tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Name          : fixtures.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Walk fixtures of the devices used by the plugin benchmarks.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# Walks are generated with the tables and sizes of the devices in production
+# (Catalyst chassis and stack, Nexus with 20 FEX, SAN director with 384 ports,
+# router with 500 HSRP SVIs). A recorded walk dropped in the fixtures directory
+# with the same name (eg. 'snmpwalk -On ... > fixtures/nexus.snmpwalk') is used
+# instead of the generated one.
+#
+
+import os
+import random
+
+from pysnmp.proto import rfc1902
+
+from snmpsim import save_walk
+
+SYS_DESCR = '1.3.6.1.2.1.1.1.0'
+SYS_UPTIME = '1.3.6.1.2.1.1.3.0'
+CCM_RUNNING_LAST_CHANGED = '1.3.6.1.4.1.9.9.43.1.1.1.0'
+CCM_RUNNING_LAST_SAVED = '1.3.6.1.4.1.9.9.43.1.1.2.0'
+ENTITY_NAME = '1.3.6.1.2.1.47.1.1.1.1.7'
+IF_DESCR = '1.3.6.1.2.1.2.2.1.2'
+CPU_PHYSICAL_INDEX = '1.3.6.1.4.1.9.9.109.1.1.1.1.2'
+CPU_TOTAL_5MIN = '1.3.6.1.4.1.9.9.109.1.1.1.1.8'
+SENSOR_TYPE = '1.3.6.1.4.1.9.9.91.1.1.1.1.1'
+SENSOR_VALUE = '1.3.6.1.4.1.9.9.91.1.1.1.1.4'
+SENSOR_STATUS = '1.3.6.1.4.1.9.9.91.1.1.1.1.5'
+ENVMON_FAN_STATE = '1.3.6.1.4.1.9.9.13.1.4.1.3'
+ENVMON_SUPPLY_STATE = '1.3.6.1.4.1.9.9.13.1.5.1.3'
+HSRP_STATE = '1.3.6.1.4.1.9.9.106.1.2.1.1.15'
+SW_PORT_CRC = '1.3.6.1.4.1.1588.2.1.1.1.6.2.1.22'
+SW_PORT_NAME = '1.3.6.1.4.1.1588.2.1.1.1.6.2.1.36'
+SW_PORT_ALIAS = '1.3.6.1.4.1.1588.2.1.1.1.6.2.1.37'
+
+CELSIUS = 8
+SENSOR_OK = 1
+ENVMON_NORMAL = 1
+HSRP_ACTIVE = 6
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def system_rows(description):
+    return [(SYS_DESCR, rfc1902.OctetString(description)), (SYS_UPTIME, rfc1902.TimeTicks(123456789))]
+
+
+def config_rows(last_changed, last_saved):
+    """Rows of CISCO-CONFIG-MAN-MIB, times being sysUpTime values."""
+    return [(CCM_RUNNING_LAST_CHANGED, rfc1902.TimeTicks(last_changed)),
+            (CCM_RUNNING_LAST_SAVED, rfc1902.TimeTicks(last_saved))]
+
+
+def entity_rows(entities):
+    """Rows of ENTITY-MIB and CISCO-ENTITY-SENSOR-MIB for ``entities`` ([(index, name, temperature)])."""
+    rows = []
+    for index, name, temperature in entities:
+        rows.append(('%s.%d' % (ENTITY_NAME, index), rfc1902.OctetString(name)))
+        if temperature is not None:
+            rows.append(('%s.%d' % (SENSOR_TYPE, index), rfc1902.Integer32(CELSIUS)))
+            rows.append(('%s.%d' % (SENSOR_VALUE, index), rfc1902.Integer32(temperature)))
+            rows.append(('%s.%d' % (SENSOR_STATUS, index), rfc1902.Integer32(SENSOR_OK)))
+    return rows
+
+
+def cpu_rows(physical_indexes):
+    rows = []
+    for cpu, index in enumerate(physical_indexes, 1):
+        rows.append(('%s.%d' % (CPU_PHYSICAL_INDEX, cpu), rfc1902.Integer32(index)))
+        rows.append(('%s.%d' % (CPU_TOTAL_5MIN, cpu), rfc1902.Gauge32(random.randint(1, 40))))
+    return rows
+
+
+def catalyst():
+    """Catalyst 6500 chassis: 9 line cards with their CPU and sensors."""
+    entities = [(1, 'WS-C6509-E', None)]
+    cpus = []
+    index = 1000
+    for slot in xrange(1, 10):
+        entities.append((index, 'module %d' % slot, None))
+        entities.append((index + 1, 'cpu %d/1' % slot, None))
+        entities.append((index + 2, 'module %d outlet temperature Sensor' % slot, random.randint(30, 45)))
+        entities.append((index + 3, 'module %d inlet temperature Sensor' % slot, random.randint(20, 30)))
+        for port in xrange(1, 49):
+            entities.append((index + 10 + port, 'GigabitEthernet%d/%d' % (slot, port), None))
+        cpus.append(index + 1)
+        index += 1000
+    return system_rows('Cisco IOS Software, s72033_rp') + config_rows(123000000, 123100000) + \
+        entity_rows(entities) + cpu_rows(cpus)
+
+
+def nexus():
+    """Nexus 5500 with 20 FEX of 48 ports."""
+    entities = [(10, 'Nexus5596 Chassis', None),
+                (21590, 'Module-1, Outlet-1', random.randint(30, 45)),
+                (21591, 'Module-1, Outlet-2', random.randint(30, 45)),
+                (21592, 'Module-1, Intake-1', random.randint(20, 30))]
+    for fex in xrange(101, 121):
+        base = fex * 100000
+        entities.append((base, 'Fex-%d Nexus2248 Chassis' % fex, None))
+        entities.append((base + 1, 'Fex-%d Module-1 Outlet-1' % fex, random.randint(30, 45)))
+        entities.append((base + 2, 'Fex-%d Module-1 Outlet-2' % fex, random.randint(30, 45)))
+        entities.append((base + 3, 'Fex-%d Module-1 Die-1' % fex, random.randint(40, 60)))
+        for port in xrange(1, 49):
+            entities.append((base + 100 + port, 'Ethernet%d/1/%d' % (fex, port), None))
+    # Running configuration changed and not saved
+    return system_rows('Cisco NX-OS(tm) n5000') + config_rows(123400000, 120000000) + \
+        entity_rows(entities) + cpu_rows([22])
+
+
+def catalyst_envmon():
+    """Catalyst 3750 stack of 4 switches only supporting CISCO-ENVMON-MIB."""
+    entities = [(1, 'Switch System', None)]
+    rows = []
+    for switch in xrange(1, 5):
+        entities.append((switch * 1000, 'Switch %d' % switch, None))
+        for port in xrange(1, 49):
+            entities.append((switch * 1000 + port, 'GigabitEthernet%d/0/%d' % (switch, port), None))
+        rows.append(('%s.%d' % (ENVMON_FAN_STATE, switch * 1000 + 4), rfc1902.Integer32(ENVMON_NORMAL)))
+        rows.append(('%s.%d' % (ENVMON_SUPPLY_STATE, switch * 1000 + 3), rfc1902.Integer32(ENVMON_NORMAL)))
+    return system_rows('Cisco IOS Software, C3750 Software') + entity_rows(entities) + rows + cpu_rows([1])
+
+
+def san():
+    """IBM / Brocade SAN director with 384 FC ports."""
+    rows = system_rows('Fibre Channel Switch.')
+    for port in xrange(1, 385):
+        rows.append(('%s.%d' % (SW_PORT_CRC, port), rfc1902.Counter32(random.randint(0, 100000))))
+        rows.append(('%s.%d' % (SW_PORT_NAME, port), rfc1902.OctetString('port%d' % (port - 1))))
+        rows.append(('%s.%d' % (SW_PORT_ALIAS, port), rfc1902.OctetString('%d/%d' % ((port - 1) / 48 + 1,
+                                                                                      (port - 1) % 48))))
+    return rows
+
+
+def hsrp():
+    """Router with 500 SVIs, each one active for its HSRP group."""
+    rows = system_rows('Cisco IOS Software, c7600s72033_rp')
+    for vlan in xrange(1, 501):
+        if_index = 100 + vlan
+        rows.append(('%s.%d' % (IF_DESCR, if_index), rfc1902.OctetString('Vlan%d' % vlan)))
+        rows.append(('%s.%d.%d' % (HSRP_STATE, if_index, vlan), rfc1902.Integer32(HSRP_ACTIVE)))
+    return rows
+
+
+def device(ports=48, sensors=8, cpus=1, vlans=0):
+    """Switch of ``ports`` ports, ``sensors`` temperature sensors, ``cpus`` CPUs and ``vlans`` HSRP SVIs."""
+    entities = [(1, 'Switch Chassis', None)]
+    entities.extend((100 + cpu, 'cpu %d' % cpu, None) for cpu in xrange(1, cpus + 1))
+    entities.extend((1000 + sensor, 'Module-1, Outlet-%d' % sensor, random.randint(30, 45))
+                    for sensor in xrange(1, sensors + 1))
+    entities.extend((10000 + port, 'GigabitEthernet1/0/%d' % port, None) for port in xrange(1, ports + 1))
+
+    rows = system_rows('Cisco IOS Software, generated') + config_rows(123000000, 123100000) + \
+        entity_rows(entities) + cpu_rows([100 + cpu for cpu in xrange(1, cpus + 1)])
+    for port in xrange(1, ports + 1):
+        rows.append(('%s.%d' % (IF_DESCR, port), rfc1902.OctetString('GigabitEthernet1/0/%d' % port)))
+    for vlan in xrange(1, vlans + 1):
+        rows.append(('%s.%d' % (IF_DESCR, 100000 + vlan), rfc1902.OctetString('Vlan%d' % vlan)))
+        rows.append(('%s.%d.%d' % (HSRP_STATE, 100000 + vlan, vlan), rfc1902.Integer32(HSRP_ACTIVE)))
+    return rows
+
+
+FIXTURES = (
+    ('catalyst', catalyst),
+    ('catalyst-envmon', catalyst_envmon),
+    ('nexus', nexus),
+    ('san', san),
+    ('hsrp', hsrp),
+)
+
+
+def fixture_paths(directory=FIXTURES_DIR):
+    """Return the walk file of each fixture, generated when missing."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    paths = {}
+    for name, generate in FIXTURES:
+        path = os.path.join(directory, '%s.snmpwalk' % name)
+        if not os.path.exists(path):
+            # Fixed seed so that generated walks are the same on every host
+            random.seed(name)
+            save_walk(path, generate())
+        paths[name] = path
+    return paths
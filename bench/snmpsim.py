@@ -0,0 +1,339 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Name          : snmpsim.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Local SNMP agent replaying recorded walks.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# Walks are text files as produced by 'snmpwalk -On -v2c -c <community> <host> .1'.
+# Each walk is served under the community named after its file name, eg.
+# nexus.snmpwalk is queried with '-C nexus'. GET, GETNEXT and GETBULK requests
+# are answered for SNMPv1 and SNMPv2c, PDUs received are counted per community.
+#
+#   $ ./snmpsim.py -p 1161 fixtures/*.snmpwalk
+#
+# A responder can serve several agents, one per address, and delay or drop
+# requests to simulate remote devices (see bench_load.py):
+#
+#   $ ./snmpsim.py -p 1161 --agents 100 --latency 20 --loss 1 fixtures/*.snmpwalk
+#
+
+from __future__ import print_function
+
+import os
+import re
+import time
+import heapq
+import random
+import select
+import socket
+import struct
+import bisect
+import argparse
+import threading
+
+from pyasn1.type import univ
+from pyasn1.codec.ber import encoder, decoder
+from pyasn1.error import PyAsn1Error
+from pysnmp.proto import api, rfc1902
+
+# snmpwalk value types
+WALK_LINE = re.compile(r'^(\.?[0-9.]+) = (?:([\w-]+): )?(.*)$')
+TYPES = {
+    'INTEGER': rfc1902.Integer32,
+    'Gauge32': rfc1902.Gauge32,
+    'Counter32': rfc1902.Counter32,
+    'Counter64': rfc1902.Counter64,
+    'Timeticks': rfc1902.TimeTicks,
+    'IpAddress': rfc1902.IpAddress,
+    'OID': rfc1902.ObjectName,
+}
+
+
+def parse_value(kind, text):
+    """Convert a value of snmpwalk output to an ASN.1 object."""
+    if kind in ('INTEGER', 'Gauge32', 'Counter32', 'Counter64', 'Timeticks'):
+        # Enumerations and timeticks show the raw value between parenthesis
+        number = re.search(r'\((-?\d+)\)', text) or re.search(r'-?\d+', text)
+        return TYPES[kind](int(number.group(1) if number.re.groups else number.group(0)))
+    elif kind in ('IpAddress', 'OID'):
+        return TYPES[kind](text.strip().lstrip('.'))
+    elif kind == 'Hex-STRING':
+        return rfc1902.OctetString(hexValue=text.replace(' ', ''))
+    elif text.startswith('"') and text.endswith('"'):
+        return rfc1902.OctetString(text[1:-1].replace('\\"', '"'))
+    return rfc1902.OctetString(text)
+
+
+def format_value(value):
+    """Format an ASN.1 object as snmpwalk does."""
+    for kind, klass in (('Counter64', rfc1902.Counter64), ('Counter32', rfc1902.Counter32),
+                        ('Gauge32', rfc1902.Gauge32), ('Timeticks', rfc1902.TimeTicks),
+                        ('IpAddress', rfc1902.IpAddress)):
+        if isinstance(value, klass):
+            return '%s: %s' % (kind, value.prettyPrint() if kind == 'IpAddress' else int(value))
+    if isinstance(value, univ.Integer):
+        return 'INTEGER: %d' % int(value)
+    elif isinstance(value, univ.ObjectIdentifier):
+        return 'OID: .%s' % value.prettyPrint()
+    return 'STRING: "%s"' % str(value).replace('"', '\\"')
+
+
+def load_walk(path):
+    """Return the list of (oid, value) of a walk file."""
+    rows = []
+    with open(path) as walk:
+        for line in walk:
+            match = WALK_LINE.match(line.rstrip('\n'))
+            if match:
+                oid, kind, text = match.groups()
+                rows.append((oid.lstrip('.'), parse_value(kind, text)))
+    return rows
+
+
+def save_walk(path, rows):
+    with open(path, 'w') as walk:
+        for oid, value in rows:
+            walk.write('.%s = %s\n' % (oid, format_value(value)))
+
+
+class Dataset(object):
+    """Sorted MIB view of a walk."""
+    def __init__(self, rows):
+        rows = sorted((tuple(int(i) for i in oid.split('.')), value) for oid, value in rows)
+        self.oids = [oid for oid, value in rows]
+        self.values = [value for oid, value in rows]
+        self.index = dict((oid, i) for i, oid in enumerate(self.oids))
+
+    def __len__(self):
+        return len(self.oids)
+
+    def get(self, oid):
+        i = self.index.get(tuple(oid))
+        return None if i is None else self.values[i]
+
+    def next(self, oid):
+        """Return (oid, value) following ``oid`` or None at the end of the MIB."""
+        i = bisect.bisect_right(self.oids, tuple(oid))
+        if i < len(self.oids):
+            return univ.ObjectIdentifier(self.oids[i]), self.values[i]
+        return None
+
+
+class Responder(threading.Thread):
+    """
+    SNMP agents answering requests from ``datasets`` ({community: Dataset}).
+
+    An agent is served on a UDP socket bound to each of ``addresses``, or to
+    ``address`` only. Responses are sent ``latency`` seconds (+/- ``jitter``)
+    after the request, requests are dropped with the probability ``loss``.
+    """
+    def __init__(self, datasets, address=('127.0.0.1', 0), latency=0.0, jitter=0.0, loss=0.0, addresses=None,
+                 seed=None):
+        super(Responder, self).__init__()
+        self.daemon = True
+        self.datasets = datasets
+        self.pdus = dict((community, 0) for community in datasets)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.lost = 0
+        self.random = random.Random(seed)
+        self.sockets = {}
+        for bind_address in addresses or [address]:
+            agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            agent.bind(bind_address)
+            self.sockets[agent.fileno()] = agent
+        self.addresses = [agent.getsockname() for fd, agent in sorted(self.sockets.iteritems())]
+        self.address = self.addresses[0]
+        self.running = True
+        # Delayed responses: (time to send, sequence, socket, response, address)
+        self._pending = []
+        self._sequence = 0
+
+    def stop(self):
+        self.running = False
+        for agent in self.sockets.itervalues():
+            agent.close()
+
+    def _delay(self):
+        return max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0)
+
+    def run(self):
+        poller = select.poll()
+        for fd in self.sockets:
+            poller.register(fd, select.POLLIN)
+
+        while self.running:
+            timeout = 200
+            if self._pending:
+                timeout = max(self._pending[0][0] - time.time(), 0) * 1000
+            try:
+                events = poller.poll(timeout)
+            except select.error:
+                break
+
+            for fd, event in events:
+                agent = self.sockets[fd]
+                try:
+                    request, address = agent.recvfrom(65535)
+                except socket.error:
+                    continue
+                if self.loss and self.random.random() < self.loss:
+                    self.lost += 1
+                    continue
+
+                response = self.respond(request)
+                if not response:
+                    continue
+                elif self.latency or self.jitter:
+                    self._sequence += 1
+                    heapq.heappush(self._pending, (time.time() + self._delay(), self._sequence, agent, response,
+                                                   address))
+                else:
+                    agent.sendto(response, address)
+
+            now = time.time()
+            while self._pending and self._pending[0][0] <= now:
+                agent, response, address = heapq.heappop(self._pending)[2:]
+                try:
+                    agent.sendto(response, address)
+                except socket.error:
+                    pass
+
+    def respond(self, request):
+        """Return the encoded response to ``request`` or None to ignore it."""
+        try:
+            version = int(api.decodeMessageVersion(request))
+            proto = api.protoModules[version]
+            message, _ = decoder.decode(request, asn1Spec=proto.Message())
+        except (PyAsn1Error, KeyError):
+            return None
+
+        community = str(proto.apiMessage.getCommunity(message))
+        dataset = self.datasets.get(community)
+        if dataset is None:
+            return None
+        self.pdus[community] += 1
+
+        pdu = proto.apiMessage.getPDU(message)
+        response = proto.apiPDU.getResponse(pdu)
+        proto.apiPDU.setErrorStatus(response, 0)
+        proto.apiPDU.setErrorIndex(response, 0)
+
+        varbinds = []
+        error = 0
+        if pdu.isSameTypeWith(proto.GetRequestPDU()):
+            for position, (oid, value) in enumerate(proto.apiPDU.getVarBinds(pdu), 1):
+                value = dataset.get(oid)
+                if value is None:
+                    if version == api.protoVersion1:
+                        error = error or position
+                        value = proto.Null('')
+                    else:
+                        value = proto.NoSuchInstance('')
+                varbinds.append((oid, value))
+        elif pdu.isSameTypeWith(proto.GetNextRequestPDU()):
+            for position, (oid, value) in enumerate(proto.apiPDU.getVarBinds(pdu), 1):
+                following = dataset.next(oid)
+                if following is None:
+                    if version == api.protoVersion1:
+                        error = error or position
+                        following = (oid, proto.Null(''))
+                    else:
+                        following = (oid, proto.EndOfMibView(''))
+                varbinds.append(following)
+        elif version != api.protoVersion1 and pdu.isSameTypeWith(proto.GetBulkRequestPDU()):
+            requested = [oid for oid, value in proto.apiBulkPDU.getVarBinds(pdu)]
+            non_repeaters = int(proto.apiBulkPDU.getNonRepeaters(pdu))
+            for oid in requested[:non_repeaters]:
+                varbinds.append(dataset.next(oid) or (oid, proto.EndOfMibView('')))
+
+            current = requested[non_repeaters:]
+            for repetition in xrange(int(proto.apiBulkPDU.getMaxRepetitions(pdu))):
+                if not current:
+                    break
+                following = [dataset.next(oid) or (oid, proto.EndOfMibView('')) for oid in current]
+                varbinds.extend(following)
+                if all(value.isSameTypeWith(proto.EndOfMibView('')) for oid, value in following):
+                    break
+                current = [oid for oid, value in following]
+        else:
+            return None
+
+        if error:
+            # SNMPv1 noSuchName
+            proto.apiPDU.setErrorStatus(response, 2)
+            proto.apiPDU.setErrorIndex(response, error)
+            varbinds = proto.apiPDU.getVarBinds(pdu)
+
+        proto.apiPDU.setVarBinds(response, varbinds)
+        proto.apiMessage.setPDU(message, response)
+        return encoder.encode(message)
+
+
+def load_datasets(paths):
+    """Return the datasets of walk files, by community."""
+    datasets = {}
+    for path in paths:
+        community = os.path.splitext(os.path.basename(path))[0]
+        datasets[community] = Dataset(load_walk(path))
+    return datasets
+
+
+def agent_addresses(first, number):
+    """Return ``number`` IPv4 addresses from ``first``, eg. loopback addresses of a simulated fleet."""
+    start = struct.unpack('!I', socket.inet_aton(first))[0]
+    return [socket.inet_ntoa(struct.pack('!I', start + offset)) for offset in xrange(number)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SNMP agent replaying recorded walks.')
+    parser.add_argument('walks', nargs='+', help='Walk files, served under the community named after the file.')
+    parser.add_argument('-a', dest='address', default='127.0.0.1', help='Listen address (default: %(default)s).')
+    parser.add_argument('-p', dest='port', type=int, default=1161, help='Listen port (default: %(default)s).')
+    parser.add_argument('--agents', type=int, default=1,
+                        help='Agents served on consecutive addresses from the listen address (default: %(default)s).')
+    parser.add_argument('--latency', type=float, default=0, help='Response delay in ms (default: %(default)s).')
+    parser.add_argument('--jitter', type=float, default=0, help='Random delay added or removed in ms '
+                                                                  '(default: %(default)s).')
+    parser.add_argument('--loss', type=float, default=0, help='Percent of requests dropped (default: %(default)s).')
+    options = parser.parse_args()
+
+    datasets = load_datasets(options.walks)
+    addresses = [(address, options.port) for address in agent_addresses(options.address, options.agents)]
+    responder = Responder(datasets, latency=options.latency / 1000.0, jitter=options.jitter / 1000.0,
+                          loss=options.loss / 100.0, addresses=addresses)
+    for community, dataset in sorted(datasets.iteritems()):
+        print('Serving %d OIDs with community %s on %s:%d.' % ((len(dataset), community) + responder.address))
+    if options.agents > 1:
+        print('Serving %d agents up to %s:%d.' % ((options.agents,) + responder.addresses[-1]))
+
+    responder.start()
+    try:
+        while responder.is_alive():
+            responder.join(1)
+    except KeyboardInterrupt:
+        responder.stop()
+        for community, pdus in sorted(responder.pdus.iteritems()):
+            print('%s: %d PDUs' % (community, pdus))
+        if responder.lost:
+            print('%d requests dropped' % responder.lost)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Filename      : bundle.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Build a single executable zip of the Python plugins.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# The bundle holds the byte code of the plugins and of the modules they share,
+# compiled by the interpreter that will run it, so that no source is parsed and
+# a single file is looked up by imports on pollers. Plugins are selected by
+# the name the bundle is run as (symlink) or by its first argument:
+#
+#   $ ./bundle.py -o /usr/lib/faurecia/plugins/net/netplugins.pyz
+#   $ ln -s netplugins.pyz check_cisco_cpu
+#   $ ./check_cisco_cpu -H 10.0.0.1 -C public -w 80 -c 90
+#   $ ./netplugins.pyz check_cisco_cpu -H 10.0.0.1 -C public -w 80 -c 90
+#
+
+import os
+import sys
+import imp
+import time
+import struct
+import marshal
+import zipfile
+import argparse
+
+# Modules that can be run from the bundle
+ENTRY_POINTS = (
+    'check_cisco_config',
+    'check_cisco_cpu',
+    'check_cisco_hard',
+    'check_cisco_health',
+    'check_cisco_hsrp',
+    'check_cisco_temp',
+    'check_ibm_san_directors_crcs',
+    'check_oftp',
+    'check_snmpnetstat',
+    'pollerd',
+)
+
+# Modules imported by the entry points
+MODULES = (
+    'batch',
+    'circuit',
+    'counters',
+    'netplugin',
+    'retention',
+    'shared',
+    'snmpcache',
+    'snmpclient',
+    'statestore',
+)
+
+MAIN = '''# -*- coding: UTF-8 -*-
+import os
+import sys
+
+ENTRY_POINTS = %r
+
+name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+if name not in ENTRY_POINTS:
+    if len(sys.argv) < 2 or os.path.splitext(sys.argv[1])[0] not in ENTRY_POINTS:
+        sys.stderr.write('Usage: %%s <%%s> [arguments...]\\n' %% (sys.argv[0], '|'.join(ENTRY_POINTS)))
+        sys.exit(3)
+    name = os.path.splitext(sys.argv.pop(1))[0]
+
+sys.argv[0] = '%%s.py' %% name
+__import__(name).main()
+'''
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def byte_code(path):
+    """Return the content of the .pyc file of the source ``path``."""
+    with open(path, 'rU') as source:
+        code = compile(source.read() + '\n', path, 'exec')
+    return imp.get_magic() + struct.pack('<I', int(os.stat(path).st_mtime)) + marshal.dumps(code)
+
+
+def build(output, source_dir=SOURCE_DIR):
+    """Write the bundle of all modules found in ``source_dir`` to ``output``."""
+    temp_output = '%s.%d' % (output, os.getpid())
+    with open(temp_output, 'wb') as bundle:
+        bundle.write('#!/usr/bin/env python2.7\n')
+        with zipfile.ZipFile(bundle, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name in ENTRY_POINTS + MODULES:
+                info = zipfile.ZipInfo('%s.pyc' % name, time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(info, byte_code(os.path.join(source_dir, '%s.py' % name)))
+            archive.writestr('__main__.py', MAIN % (ENTRY_POINTS,))
+
+    os.chmod(temp_output, 0755)
+    os.rename(temp_output, output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a single executable zip of the Python plugins.')
+    parser.add_argument('-o', dest='output', default='netplugins.pyz', help='Bundle file (default: %(default)s).')
+    options = parser.parse_args()
+
+    build(options.output)
+    print 'Bundled %d plugins in %s.' % (len(ENTRY_POINTS), options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -25,41 +25,134 @@ import os, sys
 from time import strftime, localtime, time
 
 from shared import __version__
-from monitoring.nagios.plugin import NagiosPluginSNMP
+from netplugin import NetworkPluginSNMP
 
 # The main procedure
 progname = os.path.basename(sys.argv[0])
 progdesc = 'Check config last change and last saved date time.'
 
-plugin = NagiosPluginSNMP(version=__version__, description=progdesc)
-
 oids = {
     'uptime': '1.3.6.1.2.1.1.3.0',
     'config_last_changed': '1.3.6.1.4.1.9.9.43.1.1.1.0',
     'config_last_saved': '1.3.6.1.4.1.9.9.43.1.1.2.0',
 }
 
-query = plugin.snmp.get(oids)
-
-# Date calculations
-delta_time_changed = abs(long(query['uptime'].value) - long(query['config_last_changed'].value)) / 100
-delta_time_saved = abs(long(query['uptime'].value) - long(query['config_last_saved'].value)) / 100
-
-config_last_changed_date = localtime(time() - delta_time_changed)
-config_last_changed_date_str = strftime('%d/%m/%Y %H:%M', config_last_changed_date)
-config_last_saved_date = localtime(time() - delta_time_saved)
-config_last_saved_date_str = strftime('%d/%m/%Y %H:%M', config_last_saved_date)
-
-# Formating output
-longoutput = 'Config last changed: %s\nConfig last saved: %s' % (
-    config_last_changed_date_str,
-    config_last_saved_date_str,
-)
-
-# Checking state of config date
-if config_last_changed_date > config_last_saved_date:
-    output = 'Config was changed without saving on %s !\n' % config_last_changed_date_str
-    plugin.warning(output + longoutput)
-else:
-    output = 'Running configuration was saved on %s.\n' % config_last_saved_date_str
-    plugin.ok(output + longoutput)
+
+def config_status(query):
+    """Return the tuple (status, message) of the config change dates in ``query``."""
+    # Date calculations
+    delta_time_changed = abs(long(query['uptime'].value) - long(query['config_last_changed'].value)) / 100
+    delta_time_saved = abs(long(query['uptime'].value) - long(query['config_last_saved'].value)) / 100
+
+    config_last_changed_date = localtime(time() - delta_time_changed)
+    config_last_changed_date_str = strftime('%d/%m/%Y %H:%M', config_last_changed_date)
+    config_last_saved_date = localtime(time() - delta_time_saved)
+    config_last_saved_date_str = strftime('%d/%m/%Y %H:%M', config_last_saved_date)
+
+    # Formating output
+    longoutput = 'Config last changed: %s\nConfig last saved: %s' % (
+        config_last_changed_date_str,
+        config_last_saved_date_str,
+    )
+
+    # Checking state of config date
+    if config_last_changed_date > config_last_saved_date:
+        output = 'Config was changed without saving on %s !\n' % config_last_changed_date_str
+        return 'warning', output + longoutput
+    else:
+        output = 'Running configuration was saved on %s.\n' % config_last_saved_date_str
+        return 'ok', output + longoutput
+
+
+def check(plugin):
+    """Query config change dates and exit with the Nagios status."""
+    query = plugin.snmp.get(oids)
+    if len(query) != len(oids):
+        plugin.unknown('Config change dates are not available on this device.')
+
+    status, message = config_status(query)
+    getattr(plugin, status)(message)
+
+
+def audit(argv):
+    """
+    Audit the config of a list of devices, querying all of them at once.
+
+    GET requests of all devices are sent on one socket (see
+    snmpclient.get_many()), results are printed as they would be by the batch
+    mode of the plugins (see batch.py) followed by a summary on stderr.
+    """
+    import argparse
+    from snmpclient import Session, SNMPError, get_many
+    from batch import load_hosts
+    from pollerd import STATES, Job, CommandFile, escape_output
+
+    parser = argparse.ArgumentParser(prog=progname, description='Audit mode: check config of a list of devices.')
+    parser.add_argument('--audit', dest='hosts', type=argparse.FileType('r'), required=True,
+                        help='File listing devices to check, - for stdin (see batch.py).')
+    parser.add_argument('-C', dest='snmpcommunity', default='public', help='SNMP community (default: %(default)s).')
+    parser.add_argument('-v', dest='snmpversion', choices=('1', '2c'), default='2c',
+                        help='SNMP version (default: %(default)s).')
+    parser.add_argument('--snmp-port', dest='snmp_port', type=int, default=161,
+                        help='UDP port of the SNMP agents (default: %(default)s).')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=1.0,
+                        help='Seconds before sending a request again (default: %(default)s).')
+    parser.add_argument('--retries', dest='retries', type=int, default=3,
+                        help='Requests sent again to a device before giving up (default: %(default)s).')
+    parser.add_argument('--deadline', dest='deadline', type=float, default=60,
+                        help='Seconds before giving up all devices not answering (default: %(default)s).')
+    parser.add_argument('--window', dest='window', type=int, default=256,
+                        help='Maximum number of requests in flight (default: %(default)s).')
+    parser.add_argument('--command-file', dest='command_file',
+                        help='Submit passive check results to this external command file instead of printing them.')
+    parser.add_argument('--service', dest='service',
+                        help='Service description of the passive check results.')
+    options = parser.parse_args(argv)
+
+    if options.command_file and not options.service:
+        parser.error('--service is required with --command-file.')
+
+    hosts = load_hosts(options.hosts)
+    sessions = [Session(address, community=options.snmpcommunity, version=options.snmpversion,
+                        port=options.snmp_port, timeout=options.timeout, retries=options.retries)
+                for host_name, address in hosts]
+
+    start = time()
+    results = get_many(sessions, oids, options.deadline, options.window)
+    elapsed = time() - start
+
+    command_file = CommandFile(options.command_file) if options.command_file else None
+    counts = [0] * len(STATES)
+    for (host_name, address), query in zip(hosts, results):
+        if isinstance(query, SNMPError):
+            return_code, message = 3, 'SNMP Query Error: %s' % query
+        elif len(query) != len(oids):
+            return_code, message = 3, 'Config change dates are not available on this device.'
+        else:
+            status, message = config_status(query)
+            return_code = STATES.index(status.upper())
+        message = '%s - %s' % (STATES[return_code], message)
+        counts[return_code] += 1
+
+        if command_file:
+            command_file.submit(Job(host_name, options.service, 0, progname, []), return_code, message)
+        else:
+            print '%s;%d;%s' % (host_name, return_code, escape_output(message))
+
+    sys.stderr.write('Audited %d devices in %.2fs (%.1f devices/s, %d PDUs): %s.\n' % (
+        len(hosts), elapsed, len(hosts) / elapsed if elapsed else 0, sum(session.pdus for session in sessions),
+        ', '.join('%d %s' % (count, state) for count, state in zip(counts, STATES))))
+    sys.exit(0)
+
+
+def main():
+    # Audit config of a list of devices
+    if '--audit' in sys.argv[1:]:
+        audit(sys.argv[1:])
+
+    plugin = NetworkPluginSNMP(version=__version__, description=progdesc)
+    plugin.run_check(check)
+
+
+if __name__ == '__main__':
+    main()
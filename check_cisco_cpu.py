@@ -24,13 +24,13 @@
 import logging as log
 import os, sys
 
-from shared import __version__
-from monitoring.nagios.plugin import NagiosPluginSNMP
+from shared import __version__, column_rows
+from netplugin import NetworkPluginSNMP
 
 logger = log.getLogger('plugin')
 
 # Specific class for this plugin
-class CheckCiscoCPU(NagiosPluginSNMP):
+class CheckCiscoCPU(NetworkPluginSNMP):
     def define_plugin_arguments(self):
         """Define arguments for the plugin"""
         # Define common arguments
@@ -56,71 +56,91 @@ class CheckCiscoCPU(NagiosPluginSNMP):
 progname = os.path.basename(sys.argv[0])
 progdesc = 'Check all CPUs usage on Cisco devices supporting CISCO-PROCESS-MIB.'
 
-plugin = CheckCiscoCPU(version=__version__, description=progdesc)
-
 oids = {
     'entity_name': '1.3.6.1.2.1.47.1.1.1.1.7',
     'cpu_indexes': '1.3.6.1.4.1.9.9.109.1.1.1.1.2',
     'cpu_usages': '1.3.6.1.4.1.9.9.109.1.1.1.1.8',
 }
 
-logger.debug('====== Query host...')
-query = plugin.snmp.getnext(oids)
-
-cpu_data = {}
-logger.debug('====== Getting name for CPU module...')
-for i in range(0, len(query['cpu_usages'])):
-    try:
-        cpu_index = query['cpu_indexes'][i].value
-        if cpu_index:
-            logger.debug('\tCPU index found: %s' % cpu_index)
-            cpu_name = [e.pretty() for e in query['entity_name'] if e.index == cpu_index][0]
-        else:
-            logger.debug('\tCPU index cannot be determined. Generating name...')
-            raise KeyError()
-    except KeyError:
-        # Set a default name for the CPU module
-        cpu_name = 'CPU%d' % i
-
-    logger.debug('\tCPU name: %s' % cpu_name)
-    cpu_data[cpu_name] = int(query['cpu_usages'][i].value)
-
-# Checking values if in thresholds and formatting output
-output = ""
-longoutput = ""
-exit_code = 0
-nbr_error = 0
-i = 1
-for cpu in cpu_data:
-    if plugin.options.warnthr < cpu_data[cpu] < plugin.options.critthr:
-        longoutput += '* %s: %d%% * (>%d)\n' % (cpu, cpu_data[cpu], plugin.options.warnthr)
-        if exit_code != 2: exit_code = 1
-        nbr_error+=1
-    elif cpu_data[cpu] > plugin.options.critthr:
-        longoutput += '** %s: %d%% ** (>%d)\n' % (cpu, cpu_data[cpu], plugin.options.critthr)
-        exit_code = 2
-        nbr_error+=1
-    elif cpu_data[cpu] < plugin.options.warnthr:
-        longoutput += '%s: %d%% (<%d)\n' % (cpu, cpu_data[cpu], plugin.options.warnthr)
-
-# Formatting perfdata
-perfdata = " | "
-for cpu in cpu_data:
-    perfdata += '%s=%d%%;%d;%d;0;100 ' % (cpu.replace(' ', '_'), cpu_data[cpu], plugin.options.warnthr, plugin.options.critthr)
-
-# Output to Nagios
-longoutput = longoutput.rstrip('\n')
-
-if not exit_code:
-    output = 'All CPU usage are below thresholds.\n'
-    longoutput += perfdata
-    plugin.ok(output + longoutput)
-elif exit_code == 1:
-    output = '%d CPU are above %d%% of usage !\n' % (nbr_error, plugin.options.warnthr)
-    longoutput += perfdata
-    plugin.warning(output + longoutput)
-elif exit_code == 2:
-    output = '%d CPU are above %d%% of usage !\n' % (nbr_error, plugin.options.critthr)
-    longoutput += perfdata
-    plugin.critical(output + longoutput)
 
+def check(plugin):
+    """Query CPU usages and exit with the Nagios status."""
+    logger.debug('====== Query host...')
+    # CPU table is small, only the names of its entities are kept from the
+    # entity table
+    query = plugin.snmp.getnext(dict((name, oids[name]) for name in ('cpu_indexes', 'cpu_usages')))
+    cpu_indexes = [cpu.value for cpu in query.get('cpu_indexes', [])]
+
+    cpu_data = {}
+    entity_names = column_rows(plugin, oids['entity_name'], set(cpu_indexes))
+    logger.debug('====== Getting name for CPU module...')
+    for i in range(0, len(query['cpu_usages'])):
+        try:
+            cpu_index = cpu_indexes[i]
+            if cpu_index:
+                logger.debug('\tCPU index found: %s' % cpu_index)
+                cpu_name = entity_names[cpu_index].pretty()
+            else:
+                logger.debug('\tCPU index cannot be determined. Generating name...')
+                raise KeyError()
+        except (IndexError, KeyError):
+            # Set a default name for the CPU module
+            cpu_name = 'CPU%d' % i
+
+        logger.debug('\tCPU name: %s' % cpu_name)
+        cpu_data[cpu_name] = int(query['cpu_usages'][i].value)
+
+    # Checking values if in thresholds and formatting output
+    output = ""
+    longoutput = ""
+    exit_code = 0
+    nbr_error = 0
+    for cpu in cpu_data:
+        if plugin.options.warnthr < cpu_data[cpu] < plugin.options.critthr:
+            longoutput += '* %s: %d%% * (>%d)\n' % (cpu, cpu_data[cpu], plugin.options.warnthr)
+            if exit_code != 2: exit_code = 1
+            nbr_error+=1
+        elif cpu_data[cpu] > plugin.options.critthr:
+            longoutput += '** %s: %d%% ** (>%d)\n' % (cpu, cpu_data[cpu], plugin.options.critthr)
+            exit_code = 2
+            nbr_error+=1
+        elif cpu_data[cpu] < plugin.options.warnthr:
+            longoutput += '%s: %d%% (<%d)\n' % (cpu, cpu_data[cpu], plugin.options.warnthr)
+
+    # Formatting perfdata
+    perfdata = " | "
+    items = [(cpu_data[cpu], plugin.options.warnthr,
+              '%s=%d%%;%d;%d;0;100' % (cpu.replace(' ', '_'), cpu_data[cpu], plugin.options.warnthr, plugin.options.critthr))
+             for cpu in cpu_data]
+    for item in plugin.select_perfdata(items, 'cpu', '%', aggregates=('max', 'over')):
+        perfdata += '%s ' % item
+
+    # Output to Nagios
+    longoutput = longoutput.rstrip('\n')
+
+    if not exit_code:
+        output = 'All CPU usage are below thresholds.\n'
+        longoutput += perfdata
+        plugin.ok(output + longoutput)
+    elif exit_code == 1:
+        output = '%d CPU are above %d%% of usage !\n' % (nbr_error, plugin.options.warnthr)
+        longoutput += perfdata
+        plugin.warning(output + longoutput)
+    elif exit_code == 2:
+        output = '%d CPU are above %d%% of usage !\n' % (nbr_error, plugin.options.critthr)
+        longoutput += perfdata
+        plugin.critical(output + longoutput)
+
+
+def main():
+    # Check a list of hosts with a pool of workers (see batch.py)
+    if '--batch' in sys.argv[1:]:
+        from batch import batch_main
+        batch_main('check_cisco_cpu')
+
+    plugin = CheckCiscoCPU(version=__version__, description=progdesc)
+    plugin.run_check(check)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,18 +23,38 @@
 
 import logging as log
 import os, sys
+from time import time
 
-from shared import __version__
-from monitoring.nagios.plugin import NagiosPluginSNMP
+from shared import __version__, column_rows, UPTIME_COLUMN
+from netplugin import NetworkPluginSNMP
 
 logger = log.getLogger('plugin')
 
+# Specific class for this plugin
+class CheckCiscoHard(NetworkPluginSNMP):
+    def define_plugin_arguments(self):
+        """Define arguments for the plugin"""
+        super(CheckCiscoHard, self).define_plugin_arguments()
+
+        self.required_args.add_argument('--capability-ttl',
+                                        dest='capability_ttl',
+                                        type=int,
+                                        default=86400,
+                                        help="Seconds the sensor MIB supported by the device is remembered, 0 to "
+                                             "walk all MIBs every time (default to 86400). The MIB is also probed "
+                                             "again when the device rebooted.",
+                                        )
+
+    def verify_plugin_arguments(self):
+        super(CheckCiscoHard, self).verify_plugin_arguments()
+
+        if self.options.capability_ttl < 0:
+            self.unknown('Capability TTL cannot be below zero !')
+
 # The main procedure
 progname = os.path.basename(sys.argv[0])
 progdesc = 'Check hardware (sensors, fans, power) of Cisco devices.'
 
-plugin = NagiosPluginSNMP(version=__version__, description=progdesc)
-
 oids = {
     # For devices supporting CISCO-ENTITY-SENSOR-MIB
     'sensor_names': '1.3.6.1.2.1.47.1.1.1.1.7',             # from ENTITY-MIB
@@ -44,69 +64,156 @@ oids = {
     'envmon_power_status': '1.3.6.1.4.1.9.9.13.1.5.1.3',    # from CISCO-ENVMON-MIB
 }
 
-# Store all sensors data
-sensor_data = []
-
-# Query using CISCO-ENTITY-SENSOR-MIB be default, fallback to CISCO-ENVMON-MIB
-query = plugin.snmp.getnext(oids)
-
-# Return OK if no hardware sensor support is available
-if not query.has_key('sensors_status') \
-   and not query.has_key('envmon_fan_status') \
-   and not query.has_key('envmon_power_status'):
-    plugin.ok('No support for hardware sensor available.')
-
-if not query.has_key('sensors_status'):
-    # Does not support CISCO-ENTITY-SENSOR-MIB
-    logger.debug('Device not supporting CISCO-ENTITY-SENSOR-MIB, fallback.')
-
-    sensor_status = query['envmon_fan_status'] + query['envmon_power_status']
-    for sensor in sensor_status:
-        sensor_name = [e.pretty() for e in query['sensor_names'] if e.index == sensor.index][0]
-        sensor_status = sensor.value
-
-        # Skip sensor status marked as unavailable(2)
-        if sensor_status == 5:
-            continue
-
-        sensor_data.append((sensor_name, sensor_status))
-else:
-    # Support CISCO-ENTITY-SENSOR-MIB
-    logger.debug('Device supporting CISCO-ENTITY-SENSOR-MIB, continue.')
-    sensor_status = query['sensors_status']
-    for sensor in sensor_status:
-        sensor_name = [e.pretty() for e in query['sensor_names'] if e.index == sensor.index][0]
-        sensor_status = sensor.value
-
-        # Skip sensor status marked as unavailable(2)
-        if sensor_status == 2:
-            continue
-
-        sensor_data.append((sensor_name, sensor_status))
-
-logger.debug('Sensor data:')
-logger.debug('\t%s' % sensor_data)
-
-# Check thresholds and format output to Nagios
-longoutput = ""
-output = ""
-exit_code = 0
-nbr_sensor_fails = 0
-for sensor in sensor_data:
-    sensor_name, sensor_status = sensor
-
-    # Sensor are in errors if >1
-    if sensor_status > 1:
-        longoutput += '** %s: Non operational ! **\n' % sensor_name
-        if exit_code != 2: exit_code = 1
-        nbr_sensor_fails += 1
+# Status columns, names are only fetched for the sensors found
+sensor_oids = dict((name, oid) for name, oid in oids.iteritems() if name != 'sensor_names')
+
+# Columns to walk by supported MIB
+MIB_COLUMNS = {
+    'entity_sensor': ('sensors_status',),
+    'envmon': ('envmon_fan_status', 'envmon_power_status'),
+    'none': (),
+}
+
+
+def supported_mib(query):
+    """Return the sensor MIB supported by the device according to the walked columns."""
+    if query.has_key('sensors_status'):
+        return 'entity_sensor'
+    elif query.has_key('envmon_fan_status') or query.has_key('envmon_power_status'):
+        return 'envmon'
+    return 'none'
+
+
+def cached_capabilities(plugin):
+    """
+    Return the capabilities remembered for the device, None if unknown.
+
+    They are forgotten after the capability TTL. They are also forgotten when
+    the device rebooted (sysUpTime below its value when the MIB was probed), as
+    a new firmware may support another MIB, see query_sensors().
+    """
+    capabilities = plugin.load_state('capabilities')
+    if capabilities is None:
+        return None
+
+    try:
+        age = time() - capabilities['timestamp']
+        if age > plugin.options.capability_ttl:
+            logger.debug('Sensor MIB probed %ds ago, probing again.' % age)
+        elif capabilities['mib'] in MIB_COLUMNS:
+            return capabilities
+    except (KeyError, TypeError):
+        pass
+    return None
+
+
+def query_sensors(plugin):
+    """Walk the sensor columns of the MIB supported by the device, probing all of them when unknown."""
+    if not plugin.options.capability_ttl:
+        return plugin.snmp.getnext(sensor_oids)
+
+    capabilities = cached_capabilities(plugin)
+    mib = capabilities['mib'] if capabilities else None
+    columns = MIB_COLUMNS[mib] if mib else sensor_oids.keys()
+
+    # sysUpTime comes in the requests walking the sensor columns
+    query = plugin.snmp.getnext(dict([(name, oids[name]) for name in columns] + [('uptime', UPTIME_COLUMN)]))
+    uptime = query.pop('uptime', [None])[0]
+    uptime = uptime.value if uptime else None
+
+    if mib:
+        if uptime is not None and uptime < capabilities.get('uptime'):
+            logger.debug('Device rebooted since sensor MIB was probed, probing again.')
+        elif supported_mib(query) == mib:
+            logger.debug('Device known to support %s MIB.' % mib)
+            return query
+        else:
+            logger.debug('Device does not support %s MIB anymore, probing again.' % mib)
+
+        # Walk the columns not walked yet
+        query.update(plugin.snmp.getnext(dict((name, oid) for name, oid in sensor_oids.iteritems()
+                                              if name not in MIB_COLUMNS[mib])))
+
+    plugin.save_state('capabilities', {'mib': supported_mib(query), 'uptime': uptime, 'timestamp': time()})
+    return query
+
+
+def check(plugin):
+    """Query hardware sensors status and exit with the Nagios status."""
+    # Store all sensors data
+    sensor_data = []
+
+    # Query using CISCO-ENTITY-SENSOR-MIB be default, fallback to CISCO-ENVMON-MIB
+    query = query_sensors(plugin)
+
+    # Return OK if no hardware sensor support is available
+    if not query.has_key('sensors_status') \
+       and not query.has_key('envmon_fan_status') \
+       and not query.has_key('envmon_power_status'):
+        plugin.ok('No support for hardware sensor available.')
+
+    # Only the names of the sensors are kept from the entity table
+    sensors = query.get('sensors_status') or query.get('envmon_fan_status', []) + query.get('envmon_power_status', [])
+    sensor_names = column_rows(plugin, oids['sensor_names'], set(sensor.index for sensor in sensors))
+
+    if not query.has_key('sensors_status'):
+        # Does not support CISCO-ENTITY-SENSOR-MIB
+        logger.debug('Device not supporting CISCO-ENTITY-SENSOR-MIB, fallback.')
+
+        for sensor in sensors:
+            sensor_name = sensor_names[sensor.index].pretty()
+            sensor_status = sensor.value
+
+            # Skip sensor status marked as unavailable(2)
+            if sensor_status == 5:
+                continue
+
+            sensor_data.append((sensor_name, sensor_status))
     else:
-        longoutput += '%s: ok\n' % sensor_name
-
-longoutput = longoutput.rstrip('\n')
-if exit_code == 1:
-    output = '%d sensors are non operationals !\n' % nbr_sensor_fails
-    plugin.critical(output + longoutput)
-elif not exit_code:
-    output = 'Sensor health is good.\n'
-    plugin.ok(output + longoutput)
+        # Support CISCO-ENTITY-SENSOR-MIB
+        logger.debug('Device supporting CISCO-ENTITY-SENSOR-MIB, continue.')
+        for sensor in sensors:
+            sensor_name = sensor_names[sensor.index].pretty()
+            sensor_status = sensor.value
+
+            # Skip sensor status marked as unavailable(2)
+            if sensor_status == 2:
+                continue
+
+            sensor_data.append((sensor_name, sensor_status))
+
+    logger.debug('Sensor data:')
+    logger.debug('\t%s' % sensor_data)
+
+    # Check thresholds and format output to Nagios
+    longoutput = ""
+    output = ""
+    exit_code = 0
+    nbr_sensor_fails = 0
+    for sensor in sensor_data:
+        sensor_name, sensor_status = sensor
+
+        # Sensor are in errors if >1
+        if sensor_status > 1:
+            longoutput += '** %s: Non operational ! **\n' % sensor_name
+            if exit_code != 2: exit_code = 1
+            nbr_sensor_fails += 1
+        else:
+            longoutput += '%s: ok\n' % sensor_name
+
+    longoutput = longoutput.rstrip('\n')
+    if exit_code == 1:
+        output = '%d sensors are non operationals !\n' % nbr_sensor_fails
+        plugin.critical(output + longoutput)
+    elif not exit_code:
+        output = 'Sensor health is good.\n'
+        plugin.ok(output + longoutput)
+
+
+def main():
+    plugin = CheckCiscoHard(version=__version__, description=progdesc)
+    plugin.run_check(check)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Name          : check_cisco_health.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Check CPU, temperature, hardware, config and HSRP of Cisco
+#                 devices in one pass, submitting a passive result per service.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# Runs the checks of several plugins of this collection on a device from one
+# process and SNMP session. The services are described in a file, one per line:
+#
+#   <service_description> <plugin> <plugin arguments...>
+#
+# eg.
+#
+#   CPU check_cisco_cpu -w 80 -c 90
+#   Temperature check_cisco_temp -w 60 60 60 -c 70 70 70
+#   Hardware check_cisco_hard
+#   Config check_cisco_config
+#   HSRP check_cisco_hsrp -r active
+#
+# Blank lines and lines starting with '#' are ignored. Service descriptions
+# containing spaces must be quoted. -H, -C and -v are given to each plugin.
+#
+# The values and data columns of all plugins are fetched first, in one GET and
+# one walk of all the columns together. The check of each plugin then runs on
+# these results with its own thresholds and output, rows of name tables needed
+# by several plugins (entPhysicalName) being fetched once. The result of each
+# plugin is submitted as the passive check result of its service:
+#
+#   $ ./check_cisco_health.py -H 10.0.0.1 -C public --services cisco.services \
+#       --host-name sw-core-01 --command-file /var/lib/shinken/nagios.cmd
+#
+# The plugin returns the worst state of the services, CRITICAL being worse than
+# WARNING, worse than UNKNOWN, worse than OK, with the first line of the output
+# of each service in its long output.
+#
+
+import logging as log
+import os, sys
+import shlex
+from collections import Counter
+
+from shared import __version__
+from netplugin import NetworkPluginSNMP
+from snmpclient import SNMPError, SNMPTimeout
+
+logger = log.getLogger('plugin')
+
+# Plugins that can check a service: (class of the plugin in its module, None
+# for NetworkPluginSNMP, names in its oids of the values it gets and of the
+# columns it walks, fetched for all services at once)
+PLUGINS = {
+    'check_cisco_config': (None, ('uptime', 'config_last_changed', 'config_last_saved'), ()),
+    'check_cisco_cpu': ('CheckCiscoCPU', (), ('cpu_indexes', 'cpu_usages')),
+    'check_cisco_hard': ('CheckCiscoHard', (), ('sensors_status', 'envmon_fan_status', 'envmon_power_status')),
+    'check_cisco_hsrp': ('CheckCiscoHSRP', (), ('hsrp_states',)),
+    'check_cisco_temp': ('CheckCiscoTEMP', (), ('sensor_types', 'sensor_values')),
+}
+
+
+def load_services(filename):
+    """Parse the services file and return the list of (service, plugin, arguments)."""
+    services = []
+    with open(filename) as services_file:
+        for lineno, line in enumerate(services_file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            fields = shlex.split(line)
+            if len(fields) < 2:
+                raise ValueError('%s:%d: expecting service and plugin.' % (filename, lineno))
+
+            service, plugin = fields[:2]
+            plugin = os.path.splitext(plugin)[0]
+            if plugin not in PLUGINS:
+                raise ValueError('%s:%d: unknown plugin %s.' % (filename, lineno, plugin))
+
+            services.append((service, plugin, fields[2:]))
+
+    return services
+
+
+# Specific class for this plugin
+class CheckCiscoHealth(NetworkPluginSNMP):
+    def define_plugin_arguments(self):
+        """Define arguments for the plugin"""
+        super(CheckCiscoHealth, self).define_plugin_arguments()
+
+        self.required_args.add_argument('--command-file',
+                                        dest='command_file',
+                                        help="Submit the result of each service as a passive check result to this "
+                                             "external command file.",
+                                        )
+        self.required_args.add_argument('--host-name',
+                                        dest='host_name',
+                                        help="Host name of the passive check results (default to the -H address).",
+                                        )
+        self.required_args.add_argument('--services',
+                                        dest='services',
+                                        required=True,
+                                        help="File describing the services to check and their plugin arguments.",
+                                        )
+
+    def verify_plugin_arguments(self):
+        super(CheckCiscoHealth, self).verify_plugin_arguments()
+
+        try:
+            self.services = load_services(self.options.services)
+        except (IOError, ValueError) as e:
+            raise self.unknown('Cannot load services: %s' % e)
+        if not self.services:
+            raise self.unknown('No service to check in %s !' % self.options.services)
+
+
+class SharedQuery(object):
+    """
+    Wrap the SNMP query object of the plugin so that the checks of all services
+    share their results: each value, column or row is asked once to the agent.
+    """
+    def __init__(self, query):
+        self.query = query
+        self.values = {}
+        self.columns = {}
+        self.rows = {}
+
+    def prefetch(self, values, columns):
+        """GET the OIDs ``values`` in one request and walk the OIDs ``columns`` together."""
+        if values:
+            try:
+                self.get(dict((oid, oid) for oid in values))
+            except SNMPTimeout:
+                raise
+            except SNMPError as e:
+                # eg. noSuchName of SNMPv1 agents, left to the plugins getting them
+                logger.debug('Cannot get all values at once: %s' % e)
+
+        for name, row in self.walk_columns(dict((oid, oid) for oid in columns)):
+            pass
+
+    def get(self, oids):
+        missing = set(oid for oid in oids.itervalues() if oid not in self.values)
+        if missing:
+            results = self.query.get(dict((oid, oid) for oid in missing))
+            for oid in missing:
+                self.values[oid] = results.get(oid)
+
+        return dict((name, self.values[oid]) for name, oid in oids.iteritems() if self.values[oid] is not None)
+
+    def walk_columns(self, oids):
+        """Stream the rows of ``oids`` like Session.walk_columns(), columns walked before coming from memory."""
+        walked = {}
+        uncached = {}
+        for name, oid in oids.iteritems():
+            if oid not in self.columns:
+                uncached[name] = oid
+                continue
+
+            for row in self.columns[oid]:
+                yield name, row
+            yield name, None
+
+        if uncached:
+            for name, row in self.query.walk_columns(uncached):
+                if row is None:
+                    self.columns[uncached[name]] = walked.pop(name, [])
+                else:
+                    walked.setdefault(name, []).append(row)
+                yield name, row
+
+    def getnext(self, oids):
+        results = {}
+        for name, row in self.walk_columns(oids):
+            if row is not None:
+                results.setdefault(name, []).append(row)
+        return results
+
+    def get_rows(self, oid, indexes):
+        if oid in self.columns:
+            return dict((row.index, row) for row in self.columns[oid] if row.index in indexes)
+
+        missing = set(index for index in indexes if (oid, index) not in self.rows)
+        if missing:
+            rows = self.query.get_rows(oid, missing)
+            for index in missing:
+                self.rows[oid, index] = rows.get(index)
+
+        return dict((index, self.rows[oid, index]) for index in indexes if self.rows[oid, index] is not None)
+
+
+# The main procedure
+progname = os.path.basename(sys.argv[0])
+progdesc = 'Check CPU, temperature, hardware, config and HSRP of Cisco devices in one pass.'
+
+
+def prefetched_oids(modules):
+    """Return the tuple (values, columns) of the OIDs of all plugin ``modules``."""
+    values = set()
+    columns = set()
+    for name, module in modules.iteritems():
+        plugin_class, value_names, column_names = PLUGINS[name]
+        values.update(module.oids[value] for value in value_names)
+        columns.update(module.oids[column] for column in column_names)
+    return sorted(values), sorted(columns)
+
+
+def run_service(query, module, plugin_class):
+    """Return the function running the check of ``module`` with the shared ``query``."""
+    def run():
+        plugin = plugin_class(version=__version__, description=module.progdesc)
+        plugin.use_query(query)
+        plugin.run_check(module.check)
+    return run
+
+
+def check(plugin):
+    """Check all services of the device, submit their results and exit with the worst state."""
+    # pollerd imports multiprocessing, not needed to load the plugin
+    from pollerd import STATES, SEVERITY, Job, CommandFile, capture_check
+
+    modules = dict((name, __import__(name)) for service, name, arguments in plugin.services)
+    command_file = CommandFile(plugin.options.command_file) if plugin.options.command_file else None
+    host_name = plugin.options.host_name or plugin.options.hostname
+
+    def submit(results):
+        if command_file:
+            for (service, name, arguments), (return_code, output) in zip(plugin.services, results):
+                command_file.submit(Job(host_name, service, 0, name, arguments), return_code, output)
+
+    query = SharedQuery(plugin.snmp)
+    try:
+        query.prefetch(*prefetched_oids(modules))
+    except SNMPError as e:
+        submit([(3, 'UNKNOWN - SNMP Query Error: %s' % e)] * len(plugin.services))
+        raise
+
+    results = []
+    for service, name, arguments in plugin.services:
+        module = modules[name]
+        plugin_class = getattr(module, PLUGINS[name][0]) if PLUGINS[name][0] else NetworkPluginSNMP
+        argv = ['%s.py' % name, '-H', plugin.options.hostname, '-C', plugin.options.snmpcommunity,
+                '-v', str(plugin.options.snmpversion)] + arguments
+        logger.debug('Checking service %s with %s.' % (service, ' '.join(argv)))
+        results.append(capture_check(run_service(query, module, plugin_class), argv))
+    submit(results)
+
+    # Output to Nagios
+    counts = Counter(return_code for return_code, output in results)
+    output = '%d services checked: %s.\n' % (len(results), ', '.join(
+        '%d %s' % (counts[return_code], state) for return_code, state in enumerate(STATES) if counts[return_code]))
+    longoutput = '\n'.join('%s: %s' % (service, result.split('\n')[0].split('|')[0].strip())
+                           for (service, name, arguments), (return_code, result) in zip(plugin.services, results))
+    getattr(plugin, STATES[max(counts, key=SEVERITY.index)].lower())(output + longoutput)
+
+
+def main():
+    plugin = CheckCiscoHealth(version=__version__, description=progdesc)
+    plugin.run_check(check)
+
+
+if __name__ == '__main__':
+    main()
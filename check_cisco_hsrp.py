@@ -22,11 +22,11 @@
 
 import os, sys
 
-from shared import __version__
-from monitoring.nagios.plugin import NagiosPluginSNMP
+from shared import __version__, column_rows
+from netplugin import NetworkPluginSNMP
 
 # Specific class for this plugin
-class CheckCiscoHSRP(NagiosPluginSNMP):
+class CheckCiscoHSRP(NetworkPluginSNMP):
     def initialize(self):
         """Specific plugin attributes"""
         super(CheckCiscoHSRP, self).initialize()
@@ -46,38 +46,51 @@ class CheckCiscoHSRP(NagiosPluginSNMP):
 progname = os.path.basename(sys.argv[0])
 progdesc = 'Check HSRP on Cisco devices. Check if the router must be the active or standby router for VLANs.'
 
-plugin = CheckCiscoHSRP(version=__version__, description=progdesc)
-
 oids = {
     'hsrp_states': '1.3.6.1.4.1.9.9.106.1.2.1.1.15',
     'if_descr': '1.3.6.1.2.1.2.2.1.2',
 }
 
-query = plugin.snmp.getnext(oids)
-if not query.has_key('hsrp_states'):
-    raise plugin.unknown('No data about HSRP on this device !')
-
-# Checking state of HSRP for all interfaces
-longoutput = ""
-output = ""
-exit_code = 0
-nbr_error = 0
-for state in query['hsrp_states']:
-    ifIndex = int(state.oid.split('.')[-2])
-    ifDescr = [i.pretty() for i in query['if_descr'] if i.index == ifIndex][0]
-
-    if state.value != plugin.roleid[plugin.options.role]:
-        longoutput += '** %s is in state %s (must be %s) **\n' % (
-        ifDescr, plugin.rolename[state.value], plugin.options.role)
-        nbr_error += 1
-        exit_code = 1
-    else:
-        longoutput += '%s is in state %s\n' % (ifDescr, plugin.options.role)
-
-longoutput = longoutput.rstrip('\n')
-if exit_code == 1:
-    output = '%d HRSP interface error !\n' % nbr_error
-    plugin.warning(output + longoutput)
-elif not exit_code:
-    output = 'Role for HSRP is %s.\n' % plugin.options.role
-    plugin.ok(output + longoutput)
+
+def check(plugin):
+    """Query HSRP states and exit with the Nagios status."""
+    # HSRP groups indexed by (ifIndex, group), only the descriptions of their
+    # interfaces are kept from the interface table
+    query = plugin.snmp.getnext({'hsrp_states': oids['hsrp_states']})
+    if not query.has_key('hsrp_states'):
+        raise plugin.unknown('No data about HSRP on this device !')
+
+    # Checking state of HSRP for all interfaces
+    longoutput = ""
+    output = ""
+    exit_code = 0
+    nbr_error = 0
+    if_descr = column_rows(plugin, oids['if_descr'], set(state.suffix[0] for state in query['hsrp_states']))
+    for state in query['hsrp_states']:
+        ifIndex = state.suffix[0]
+        ifDescr = if_descr[ifIndex].pretty()
+
+        if state.value != plugin.roleid[plugin.options.role]:
+            longoutput += '** %s is in state %s (must be %s) **\n' % (
+            ifDescr, plugin.rolename[state.value], plugin.options.role)
+            nbr_error += 1
+            exit_code = 1
+        else:
+            longoutput += '%s is in state %s\n' % (ifDescr, plugin.options.role)
+
+    longoutput = longoutput.rstrip('\n')
+    if exit_code == 1:
+        output = '%d HRSP interface error !\n' % nbr_error
+        plugin.warning(output + longoutput)
+    elif not exit_code:
+        output = 'Role for HSRP is %s.\n' % plugin.options.role
+        plugin.ok(output + longoutput)
+
+
+def main():
+    plugin = CheckCiscoHSRP(version=__version__, description=progdesc)
+    plugin.run_check(check)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,13 +24,13 @@
 import logging as log
 import re
 
-from shared import __version__
-from monitoring.nagios.plugin import NagiosPluginSNMP
+from shared import __version__, column_rows, join_columns
+from netplugin import NetworkPluginSNMP
 
 logger = log.getLogger('plugin')
 
 # Specific class for this plugin
-class CheckCiscoTEMP(NagiosPluginSNMP):
+class CheckCiscoTEMP(NetworkPluginSNMP):
     def define_plugin_arguments(self):
         """Define arguments for the plugin"""
         # Define common arguments
@@ -41,6 +41,13 @@ class CheckCiscoTEMP(NagiosPluginSNMP):
                                   help='Warning threshold for 5K Outlet / Catalyst, Fex Outlet and Fex Die (only on Nexus).', required=True)
         self.required_args.add_argument('-c', nargs=3, metavar=('outlet', 'fex_outlet', 'fex_die'), type=int, dest='critthr',
                                   help='Critical threshold for 5K Outlet / Catalyst, Fex Outlet and Fex Die (only on Nexus).', required=True)
+        self.required_args.add_argument('--rules',
+                                        dest='rules',
+                                        help="Configuration file of extra sensor classes, each section being a class "
+                                             "with its 'pattern' (regex on sensor name), 'warning' and 'critical' "
+                                             "thresholds. Classes outlet, fex_outlet and fex_die use -w / -c "
+                                             "thresholds if not set.",
+                                        )
 
     def verify_plugin_arguments(self):
         """Do arguments checks"""
@@ -50,115 +57,194 @@ class CheckCiscoTEMP(NagiosPluginSNMP):
         if self.options.warnthr >= self.options.critthr:
             raise self.unknown('Warning threshold cannot be >= critical threshold.')
 
-# Function that verify thresholds
-def check_thresholds(sensor, value, warn, crit):
-    global count, perfdata, longoutput_warn, longoutput_crit, longoutput_ok
-    global exit_code
-    global nbr_error, nbr_warn, nbr_crit, nbr_ok
-
+        # Thresholds (warning, critical) by sensor class
+        self.thresholds = dict(zip(THRESHOLD_CLASSES, zip(self.options.warnthr, self.options.critthr)))
+        rules = list(DEFAULT_RULES)
+        if self.options.rules:
+            try:
+                extra_rules, thresholds = load_rules(self.options.rules, self.thresholds)
+            except (IOError, ValueError) as e:
+                raise self.unknown('Cannot load sensor rules: %s' % e)
+            rules = extra_rules + rules
+            self.thresholds.update(thresholds)
+        self.classifier = SensorClassifier(rules, DEFAULT_CLASS)
+
+
+# Sensor classes of the -w / -c thresholds
+THRESHOLD_CLASSES = ('outlet', 'fex_outlet', 'fex_die')
+
+# Rules (pattern on sensor name, class) checked in order, the first matching
+# one gives the class of the sensor
+DEFAULT_RULES = (
+    (r'^Module.*Outlet', 'outlet'),         # Nexus 5K outlet
+    (r'^Fex.*Outlet', 'fex_outlet'),
+    (r'^Fex.*Die', 'fex_die'),
+)
+DEFAULT_CLASS = 'outlet'                    # Catalyst sensors
+
+
+class SensorClassifier(object):
+    """Give the class of a sensor name from a table of precompiled rules."""
+    def __init__(self, rules, default):
+        self.rules = [(re.compile(pattern), sensor_class) for pattern, sensor_class in rules]
+        self.default = default
+
+    def classify(self, name):
+        for regex, sensor_class in self.rules:
+            if regex.search(name):
+                return sensor_class
+        return self.default
+
+
+def load_rules(path, thresholds):
+    """
+    Load sensor classes from the configuration file ``path``.
+
+    Return the tuple (rules, thresholds by class) of the classes defined in the
+    file, in the order of its sections. Classes already in ``thresholds``
+    inherit their missing thresholds.
+
+    Example::
+
+        [supervisor]
+        pattern = ^Supervisor
+        warning = 55
+        critical = 65
+    """
+    # Only imported when needed, most checks have no rules file
+    import ConfigParser
+
+    config = ConfigParser.RawConfigParser()
+    try:
+        if not config.read(path):
+            raise IOError('cannot read %s' % path)
+        return _parse_rules(config, thresholds)
+    except ConfigParser.Error as e:
+        raise ValueError(str(e).strip())
+
+
+def _parse_rules(config, thresholds):
+    """Return the rules and thresholds of the sections of ``config``, see load_rules()."""
+    rules = []
+    new_thresholds = {}
+    for sensor_class in config.sections():
+        if config.has_option(sensor_class, 'pattern'):
+            try:
+                re.compile(config.get(sensor_class, 'pattern'))
+            except re.error as e:
+                raise ValueError('invalid pattern for class %s: %s' % (sensor_class, e))
+            rules.append((config.get(sensor_class, 'pattern'), sensor_class))
+
+        warn, crit = thresholds.get(sensor_class, (None, None))
+        if config.has_option(sensor_class, 'warning'):
+            warn = config.getint(sensor_class, 'warning')
+        if config.has_option(sensor_class, 'critical'):
+            crit = config.getint(sensor_class, 'critical')
+        if warn is None or crit is None:
+            raise ValueError('missing thresholds for class %s' % sensor_class)
+        elif warn >= crit:
+            raise ValueError('warning threshold of class %s cannot be >= critical threshold' % sensor_class)
+        new_thresholds[sensor_class] = (warn, crit)
+
+    return rules, new_thresholds
+
+
+def sensor_status(value, warn, crit):
+    """Return the status of a sensor value: 'critical', 'warning', 'ok' or None on a threshold."""
     if warn < value < crit:
-        longoutput_warn += ' * %s: %d C (>%d <%d) *\n' % (sensor, value, warn, crit)
-        if exit_code != 2: exit_code = 1
-        nbr_error += 1
-        nbr_warn += 1
+        return 'warning'
     elif value > crit:
-        longoutput_crit += ' ** %s: %d C (>%d) **\n' % (sensor, value, crit)
-        exit_code = 2
-        nbr_error += 1
-        nbr_crit += 1
+        return 'critical'
     elif value < warn:
-        longoutput_ok += ' %s: %d C (<%d)\n' % (sensor, value, warn)
-        nbr_ok += 1
+        return 'ok'
+    return None
 
-    perfdata += '%d_%s=%dC;%d;%d;; ' % (
-        count,
-        sensor.replace(' ', '_').replace(',', '_').replace('_temperature', ''),
-        value,
-        warn,
-        crit
-    )
 
 # The main procedure
 progdesc = 'Check all temperature on Cisco devices and alert if one is above thresholds.'
 
-plugin = CheckCiscoTEMP(version=__version__, description=progdesc)
-
 oids = {
     'sensor_types': '1.3.6.1.4.1.9.9.91.1.1.1.1.1',     # From CISCO-ENTITY-SENSOR-MIB
     'sensor_values': '1.3.6.1.4.1.9.9.91.1.1.1.1.4',     # From CISCO-ENTITY-SENSOR-MIB
     'entity_names': '1.3.6.1.2.1.47.1.1.1.1.7',         # From ENTITY-MIB
 }
 
-query = plugin.snmp.getnext(oids)
 
-# Store temp data
-temp_data = []
-
-# Get all "celsius" sensor types
-if query.has_key('sensor_types'):
-    for type in query['sensor_types']:
+def check(plugin):
+    """Query temperature sensors and exit with the Nagios status."""
+    # Values of all "celsius" sensors, folded as the sensor table is walked
+    celsius = []
+    nbr_sensors = 0
+    sensor_oids = dict((name, oids[name]) for name in ('sensor_types', 'sensor_values'))
+    for index, sensor in join_columns(plugin.snmp.walk_columns(sensor_oids), sensor_oids):
+        nbr_sensors += 1
         # If sensor type is celsius(8)
-        if type.value == 8:
-            sensor_name = [e.pretty() for e in query['entity_names'] if e.index == type.index][0]
-            sensor_value = [e.value for e in query['sensor_values'] if e.index == type.index][0]
-            temp_data.append((sensor_name, sensor_value))
-else:
-    plugin.unknown('SNMP Query Error: query all sensor types returned no result !')
-
-logger.debug('Temp data: %s' % temp_data)
-
-# Check thresholds and format output to Nagios
-longoutput = ""
-longoutput_crit = ""
-longoutput_warn = ""
-longoutput_ok = ""
-output = ""
-perfdata = "| "
-exit_code = 0
-nbr_error = 0
-nbr_crit = 0
-nbr_warn = 0
-nbr_ok = 0
-count = 0
-
-# Expand tuple of thresholds
-outlet_warn, fexout_warn, fexdie_warn = plugin.options.warnthr
-outlet_crit, fexout_crit, fexdie_crit = plugin.options.critthr
-
-for temp in temp_data:
-    count += 1
-    temp_descr, temp_value = temp
-
-    # Check 5K Outlet thresholds
-    logger.debug('Processing sensor %s.' % temp_descr)
-    if re.search(r'^Module.*Outlet', temp_descr):
-        check_thresholds(temp_descr, temp_value, outlet_warn, outlet_crit)
-    elif re.search(r'^Fex.*Outlet', temp_descr):
-        check_thresholds(temp_descr, temp_value, fexout_warn, fexout_crit)
-    elif re.search(r'^Fex.*Die', temp_descr):
-        check_thresholds(temp_descr, temp_value, fexdie_warn, fexdie_crit)
+        if sensor['sensor_types'].value == 8:
+            celsius.append((index, sensor['sensor_values'].value))
+
+    if not nbr_sensors:
+        plugin.unknown('SNMP Query Error: query all sensor types returned no result !')
+
+    # Store temp data
+    entity_names = column_rows(plugin, oids['entity_names'], set(index for index, value in celsius))
+    temp_data = [(entity_names[index].pretty(), value) for index, value in celsius]
+
+    logger.debug('Temp data: %s' % temp_data)
+
+    # Sensors (name, value, warning, critical) by status, and perfdata items
+    sensors = {'critical': [], 'warning': [], 'ok': []}
+    perfdata = []
+    for count, (temp_descr, temp_value) in enumerate(temp_data, 1):
+        sensor_class = plugin.classifier.classify(temp_descr)
+        warn, crit = plugin.thresholds[sensor_class]
+        logger.debug('Processing sensor %s (%s).' % (temp_descr, sensor_class))
+
+        status = sensor_status(temp_value, warn, crit)
+        if status:
+            sensors[status].append((temp_descr, temp_value, warn, crit))
+
+        perfdata.append((temp_value, warn, '%d_%s=%dC;%d;%d;;' % (
+            count,
+            temp_descr.replace(' ', '_').replace(',', '_').replace('_temperature', ''),
+            temp_value,
+            warn,
+            crit
+        )))
+
+    # Format output
+    sections = []
+    if sensors['critical']:
+        sections.append('Critical: (%d)' % len(sensors['critical']))
+        sections.extend(' ** %s: %d C (>%d) **' % (name, value, crit) for name, value, warn, crit in sensors['critical'])
+        sections.append('')
+    if sensors['warning']:
+        sections.append('Warning: (%d)' % len(sensors['warning']))
+        sections.extend(' * %s: %d C (>%d <%d) *' % sensor for sensor in sensors['warning'])
+        sections.append('')
+    if sensors['ok']:
+        sections.append('OK: (%d)' % len(sensors['ok']))
+        sections.extend(' %s: %d C (<%d)' % (name, value, warn) for name, value, warn, crit in sensors['ok'])
+        sections.append('')
+    perfdata = plugin.select_perfdata(perfdata, 'temp', 'C', aggregates=('max', 'over'))
+    longoutput = '\n'.join(sections + ['| %s' % ' '.join(perfdata)])
+
+    # Output to Nagios
+    nbr_error = len(sensors['critical']) + len(sensors['warning'])
+    if sensors['critical']:
+        output = '%d temperature sensor above thresholds !\n' % nbr_error
+        plugin.critical(output + longoutput)
+    elif sensors['warning']:
+        output = '%d temperature sensor above thresholds !\n' % nbr_error
+        plugin.warning(output + longoutput)
     else:
-        check_thresholds(temp_descr, temp_value, outlet_warn, outlet_crit)
-
-# Format output
-if nbr_crit > 0:
-    longoutput += 'Critical: (%d)\n%s\n' % (nbr_crit, longoutput_crit)
-if nbr_warn > 0:
-    longoutput += 'Warning: (%d)\n%s\n' % (nbr_warn, longoutput_warn)
-if nbr_ok > 0:
-    longoutput += 'OK: (%d)\n%s\n' % (nbr_ok, longoutput_ok)
-
-# Add perfdata
-longoutput += perfdata
-
-# Output to Nagios
-longoutput = longoutput.rstrip('\n')
-if exit_code == 2:
-    output = '%d temperature sensor above thresholds !\n' % nbr_error
-    plugin.critical(output + longoutput)
-elif exit_code == 1:
-    output = '%d temperature sensor above thresholds !\n' % nbr_error
-    plugin.warning(output + longoutput)
-elif not exit_code:
-    output = 'All temperature sensor are below thresholds.\n'
-    plugin.ok(output + longoutput)
+        output = 'All temperature sensor are below thresholds.\n'
+        plugin.ok(output + longoutput)
+
+
+def main():
+    plugin = CheckCiscoTEMP(version=__version__, description=progdesc)
+    plugin.run_check(check)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,20 +20,19 @@
 #===============================================================================
 #
 
+import os
 import logging as log
-from pprint import pformat
-import traceback
 from time import time
-from datetime import datetime
 import math
 
-from shared import __version__
-from monitoring.nagios.plugin import NagiosPluginSNMP
+from shared import __version__, join_columns, UPTIME_COLUMN
+from netplugin import NetworkPluginSNMP
+from retention import RingStore
 
 logger = log.getLogger('plugin')
 
 # Plugin init class
-class IBMSanDirectorsCRC(NagiosPluginSNMP):
+class IBMSanDirectorsCRC(NetworkPluginSNMP):
 
     def initialize(self):
         super(IBMSanDirectorsCRC, self).initialize()
@@ -64,6 +63,11 @@ class IBMSanDirectorsCRC(NagiosPluginSNMP):
                                         help="Crit if average number of CRCs are above this threshold.",
                                         required=True,
                                         )
+        self.required_args.add_argument('--retention-dir',
+                                        dest='retention_dir',
+                                        default='/var/tmp',
+                                        help="Directory of the retention files (default to /var/tmp).",
+                                        )
 
     def verify_plugin_arguments(self):
         super(IBMSanDirectorsCRC, self).verify_plugin_arguments()
@@ -81,15 +85,8 @@ class IBMSanDirectorsCRC(NagiosPluginSNMP):
 # Init plugin
 progdesc = 'Check IBM SAN Directors for CRCs on ports.'
 
-plugin = IBMSanDirectorsCRC(version=__version__, description=progdesc)
-
-# Load any existing pickled data
-try:
-    # Load retention data
-    retention_data = plugin.load_data()
-except IOError:
-    # No retention data to load
-    retention_data = []
+# Minimum number of records kept in the retention file
+RETENTION_RECORDS = 50
 
 # Prepare SNMP query
 oids = {
@@ -98,144 +95,181 @@ oids = {
     'crc': '1.3.6.1.4.1.1588.2.1.1.1.6.2.1.22',
 }
 
-query = plugin.snmp.getnext(oids)
-
-# Dictionnary used to store gathered SNMP data and used by pickle for saving results
-snmp_results = {
-    'timestamp': plugin.runtime,
-    'values': {},                   # Store SNMP results
-}
-try:
-    for port in query['name']:
-        data = snmp_results['values']
-        name = port.pretty()
-        alias = [a.pretty() for a in query['alias'] if a.index == port.index ][0]
-        crc = [c.value for c in query['crc'] if c.index == port.index ][0]
+# swFCPortRxCrcs is a Counter32
+CRC_COUNTER_BITS = 32
+
+
+def debug_dump(title, data):
+    """Log ``data`` pretty printed, pprint is only imported in debug mode."""
+    if logger.isEnabledFor(log.DEBUG):
+        from pprint import pformat
+        logger.debug(title)
+        logger.debug(pformat(data, indent=4))
+
+
+def migrate_pickled_data(plugin, retention):
+    """Import records pickled by previous versions of the plugin into the retention file."""
+    try:
+        retention_data = plugin.load_data()
+    except IOError:
+        # No retention data to migrate
+        return
+
+    logger.debug('-- Migrating %d pickled records to %s.' % (len(retention_data), retention.path))
+    for record in retention_data[-retention.capacity:]:
+        names = dict((alias, stat['name']) for alias, stat in record['values'].iteritems())
+        counters = dict((alias, stat['crc']) for alias, stat in record['values'].iteritems())
+        retention.append(record['timestamp'], counters, names)
+
+
+def port_rows(rows, uptimes):
+    """Yield the rows of the port table from ``rows`` walked with sysUpTime, appended to ``uptimes``."""
+    for name, row in rows:
+        if name != 'uptime':
+            yield name, row
+        elif row is not None:
+            uptimes.append(row.value)
+
+
+def check(plugin):
+    """Compute CRC increase of ports and exit with the Nagios status."""
+    # sysUpTime, walked with the port table, tells a reboot of the director
+    # (counters reset) from a counter wrap
+    uptimes = []
+    rows = port_rows(plugin.snmp.walk_columns(dict(oids, uptime=UPTIME_COLUMN)), uptimes)
+
+    # Port names and CRC counters gathered by SNMP, indexed by port alias,
+    # folded as the port table is walked
+    names = {}
+    counters = {}
+    nbr_ports = 0
+    for index, port in join_columns(rows, ('name', 'alias', 'crc')):
+        nbr_ports += 1
+        name = port['name'].pretty()
+        alias = port['alias'].pretty()
 
         if alias:
-            if not data.has_key(alias):
-                data[alias] = {}
-
             if name:
-                data[alias]['name'] = name
+                names[alias] = name
             else:
-                data[alias]['name'] = 'No description'
+                names[alias] = 'No description'
+
+            counters[alias] = port['crc'].value
 
-            data[alias]['crc'] = crc
-except KeyError:
-    # That would mean unexpected result from the query (empty OID, etc...)
-    message = """Unexpected error ! Please check plugin configuration.
+    if not nbr_ports:
+        # That would mean unexpected result from the query (empty OID, etc...)
+        message = """Unexpected error ! Please check plugin configuration.
 If you see this message that would mean the query returned no result (empty OID) or the equipment does not
 support such requests...
 
-%s
-
-Please check your plugin configuration first.""" % traceback.format_exc(limit=1)
-    plugin.unknown(message)
-
-logger.debug('-- SNMP data:')
-logger.debug(pformat(snmp_results, indent=4))
-
-# Save to pickle file the new data gathered
-retention_data.append(snmp_results)
-plugin.save_data(retention_data, limit=50)
-
-# Calculate average time
-last_records = retention_data[-plugin.options.avgrec:]
-avg_record_time = 0
-if len(retention_data) >= plugin.options.avgrec:
-    calc_total_seconds = datetime.fromtimestamp(plugin.runtime) - datetime.fromtimestamp(last_records[0]['timestamp'])
-    avg_record_time = int(math.ceil(calc_total_seconds.total_seconds()/60))
-else:
-    # Stop execution if not enough records in retention file. Wait next check.
-    missing = plugin.options.avgrec - len(retention_data)
-    plugin.unknown('Not enough data to generate average, need %d more checks. Waiting next check.' % missing)
-
-# Calculate CRC increase
-port_stats = {}
-
-logger.debug('-- Processing pickled data for the last %d records.' % plugin.options.avgrec)
-for data in last_records:
-    index = last_records.index(data)
-    val = data['values']
-    prev_val = None
-
-    if not index:
-        continue
+Please check your plugin configuration first."""
+        plugin.unknown(message)
+
+    debug_dump('-- SNMP data:', counters)
+    uptime = uptimes[0] if uptimes else None
+
+    # Append the new data gathered to the retention file and update the sums
+    # of CRC increase over the last records
+    retention_path = os.path.join(plugin.options.retention_dir,
+                                  'check_ibm_san_directors_crcs_%s.ring' % plugin.host_key())
+    with plugin.timed('retention'), \
+            RingStore(retention_path, max(RETENTION_RECORDS, plugin.options.avgrec), CRC_COUNTER_BITS) as retention:
+        if not retention.count:
+            migrate_pickled_data(plugin, retention)
+        retention.slide(plugin.runtime, counters, names, plugin.options.avgrec, uptime)
+
+        nbr_records = min(retention.count, plugin.options.avgrec)
+        first_record_time = retention.record(nbr_records - 1)[0]
+        crc_sums = retention.sums
+
+    # Calculate average time
+    avg_record_time = 0
+    if nbr_records >= plugin.options.avgrec:
+        calc_total_seconds = plugin.runtime - first_record_time
+        avg_record_time = int(math.ceil(calc_total_seconds/60))
     else:
-        prev_val = last_records[index-1]['values']
-        logger.debug("Prev: %s, Next: %s" % (last_records[index-1]['timestamp'], data['timestamp']))
-
-    for alias, stat in val.viewitems():
-        name = stat['name']
-        crc = stat['crc']
-        prev_crc = prev_val[alias]['crc']
-
-        if prev_val:
-            prev_crc = prev_val[alias]['crc']
-
-        if not port_stats.has_key(alias):
-            port_stats[alias] = {'crc': 0}
-
-        port_stats[alias]['name'] = name
-        port_stats[alias]['crc'] += crc - prev_crc
-
-logger.debug('port_stats:')
-logger.debug(pformat(port_stats, indent=4))
-
-# Define some Nagios related stuff used in output and status
-nagios_output = ""
-nagios_longoutput = ""
-nagios_perfdata = " | "
-nagios_status = None
-
-errors = {
-    'warning': [],
-    'critical': [],
-}
-
-# Checking if we have port crc above or below thresholds
-for port, stat in port_stats.viewitems():
-    if plugin.options.warning < stat['crc'] <= plugin.options.critical:
-        errors['warning'].append(port)
-    elif stat['crc'] > plugin.options.critical:
-        errors['critical'].append(port)
-
-    nagios_perfdata += "\'Port_{name}\'={crc}c;{opt.warning};{opt.critical};0; ".format(crc=stat['crc'], name=port,
-                                                                                     opt=plugin.options)
-
-# Show short message in Nagios output
-nbr_warn = len(errors['warning'])
-nbr_crit = len(errors['critical'])
-if not nbr_warn and not nbr_crit:
-    nagios_status = plugin.ok
-    nagios_output = "No CRC error detected on ports."
-elif nbr_warn and not nbr_crit:
-    nagios_status = plugin.warning
-    nagios_output = "%d ports have warnings CRC errors !" % nbr_warn
-elif nbr_crit and not nbr_warn:
-    nagios_status = plugin.critical
-    nagios_output = "%d ports have criticals CRC errors !" % nbr_crit
-elif nbr_warn and nbr_crit:
-    nagios_status = plugin.critical
-    nagios_output = "%d ports have criticals, %d ports have warnings CRC errors !" % (nbr_crit, nbr_warn)
-
-# Show average record time
-nagios_output = "%s (Average on last %s mins)" % (nagios_output, avg_record_time)
-
-# Check for errors details in long output
-for status in errors:
-    if len(errors[status]):
-        nagios_longoutput += "\n{status} ({nbrerr}) (>= {thr}):\n".format(status=status.title(),
-                                                                       nbrerr=len(errors[status]),
-                                                                       thr=eval('plugin.options.{}'.format(status)))
-        for alias in errors[status]:
-            nagios_longoutput += "  Port %s: %d crc (%s)\n" % (
-                alias,
-                port_stats[alias]['crc'],
-                port_stats[alias]['name'],
-            )
-
-# Output and return status to Nagios
-output = nagios_output + nagios_longoutput + nagios_perfdata
-nagios_status(output)
+        # Stop execution if not enough records in retention file. Wait next check.
+        missing = plugin.options.avgrec - nbr_records
+        plugin.unknown('Not enough data to generate average, need %d more checks. Waiting next check.' % missing)
+
+    # CRC increase of the ports seen by this run
+    port_stats = {}
+    for alias in counters:
+        port_stats[alias] = {
+            'name': names[alias],
+            'crc': crc_sums.get(alias, 0),
+        }
+
+    debug_dump('port_stats:', port_stats)
+
+    # Define some Nagios related stuff used in output and status
+    nagios_output = ""
+    nagios_longoutput = ""
+    nagios_perfdata = " | "
+    nagios_status = None
+
+    errors = {
+        'warning': [],
+        'critical': [],
+    }
+
+    # Checking if we have port crc above or below thresholds
+    perfdata_items = []
+    for port, stat in port_stats.viewitems():
+        if plugin.options.warning < stat['crc'] <= plugin.options.critical:
+            errors['warning'].append(port)
+        elif stat['crc'] > plugin.options.critical:
+            errors['critical'].append(port)
+
+        perfdata_items.append((stat['crc'], plugin.options.warning,
+                               "\'Port_{name}\'={crc}c;{opt.warning};{opt.critical};0;".format(crc=stat['crc'],
+                                                                                             name=port,
+                                                                                             opt=plugin.options)))
+
+    for item in plugin.select_perfdata(perfdata_items, 'crc', 'c'):
+        nagios_perfdata += "%s " % item
+
+    # Show short message in Nagios output
+    nbr_warn = len(errors['warning'])
+    nbr_crit = len(errors['critical'])
+    if not nbr_warn and not nbr_crit:
+        nagios_status = plugin.ok
+        nagios_output = "No CRC error detected on ports."
+    elif nbr_warn and not nbr_crit:
+        nagios_status = plugin.warning
+        nagios_output = "%d ports have warnings CRC errors !" % nbr_warn
+    elif nbr_crit and not nbr_warn:
+        nagios_status = plugin.critical
+        nagios_output = "%d ports have criticals CRC errors !" % nbr_crit
+    elif nbr_warn and nbr_crit:
+        nagios_status = plugin.critical
+        nagios_output = "%d ports have criticals, %d ports have warnings CRC errors !" % (nbr_crit, nbr_warn)
+
+    # Show average record time
+    nagios_output = "%s (Average on last %s mins)" % (nagios_output, avg_record_time)
+
+    # Check for errors details in long output
+    for status in errors:
+        if len(errors[status]):
+            nagios_longoutput += "\n{status} ({nbrerr}) (>= {thr}):\n".format(status=status.title(),
+                                                                           nbrerr=len(errors[status]),
+                                                                           thr=eval('plugin.options.{}'.format(status)))
+            for alias in errors[status]:
+                nagios_longoutput += "  Port %s: %d crc (%s)\n" % (
+                    alias,
+                    port_stats[alias]['crc'],
+                    port_stats[alias]['name'],
+                )
+
+    # Output and return status to Nagios
+    output = nagios_output + nagios_longoutput + nagios_perfdata
+    nagios_status(output)
+
+
+def main():
+    plugin = IBMSanDirectorsCRC(version=__version__, description=progdesc)
+    plugin.run_check(check)
+
+
+if __name__ == '__main__':
+    main()
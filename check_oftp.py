@@ -23,6 +23,8 @@
 #===============================================================================
 
 import socket
+import select
+import errno
 import optparse
 import logging
 import time
@@ -37,59 +39,188 @@ argparser = optparse.OptionParser()
 # Defining plugin arguments
 argparser.add_option("-H", dest="hostname", help="OFTP server address")
 argparser.add_option("-p", dest="port", help="OFTP server port", type=int)
+argparser.add_option("-T", dest="targets",
+                     help="Probe several OFTP servers concurrently, comma separated list of host:port")
 argparser.add_option("-t", dest="timeout", help="Response timeout (default: 30 secs)", type=float, default="30")
 argparser.add_option("--debug", dest="debug", help="Enable debugging", action='store_true')
 
-# Tell OptionParser to parse all args and return their values
-arguments = argparser.parse_args()[0]
-
-# Check presence of mandatory arguments
-if not arguments.hostname or not arguments.port:
-    print "UNKNOWN - Syntax error, missing connection information !"
-    raise SystemExit(3)
-
-# Enable debug messages ?
-if arguments.debug:
-    logger.setLevel(logging.DEBUG)
-
-# Establish a connection and catch any possible error
-try:
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(arguments.timeout)
-    s.connect((arguments.hostname, arguments.port))
-    s.setblocking(0)
-
-    logger.debug('Successfully connected to socket.')
-except socket.error:
-    print "CRITICAL - Cannot establish a connection to OFTP server !"
-    raise SystemExit(2)
-
-# Get data from the server and process response
-nagios_output = ""
-try:
-    start_time = time.time()
-
-    while 1:
-        # Break if timeout is reached
-        remaining_time = time.time()-start_time
-        if remaining_time > arguments.timeout:
-            logger.error('Timeout reached')
-            nagios_output = "CRITICAL - OFTP server is reachable but no data was received !"
-            raise SystemExit(2)
 
-        # Get some data from socket
+class Probe(object):
+    """Non-blocking connection to an OFTP server waiting for the READY message."""
+    def __init__(self, hostname, port):
+        self.hostname = hostname
+        self.port = port
+        self.sock = None
+        self.data = ""
+        self.error = None
+        self.connect_time = None
+        self.ready_time = None
+
+    @property
+    def name(self):
+        return '%s:%d' % (self.hostname, self.port)
+
+    @property
+    def done(self):
+        return self.error is not None or self.ready_time is not None
+
+    def start(self):
+        self.start_time = time.time()
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setblocking(0)
+            result = self.sock.connect_ex((self.hostname, self.port))
+        except socket.error as e:
+            self.fail("Cannot establish a connection to OFTP server !", e)
+            return
+
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.fail("Cannot establish a connection to OFTP server !", result)
+
+    def on_writable(self):
+        """Connection is established or has failed."""
+        result = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if result:
+            self.fail("Cannot establish a connection to OFTP server !", errno.errorcode.get(result, result))
+            return
+
+        self.connect_time = time.time() - self.start_time
+        logger.debug('%s: successfully connected to socket in %.3fs.', self.name, self.connect_time)
+
+    def on_readable(self):
+        """Get some data from socket and look for the READY message."""
         try:
-            data = s.recv(32)
-            result = data.decode('utf-8')
-            if "READY" in result:
-                nagios_output = "OK - OFTP server is available."
-                raise SystemExit(0)
-        except socket.error:
-            # No data yet, make CPU happy ;-)
-            time.sleep(0.1)
-except socket.timeout:
-    nagios_output = "CRITICAL - Unable to connect to OFTP server within %d seconds !" % arguments.timeout
-    raise SystemExit(2)
-finally:
-    s.close()
-    print nagios_output
+            data = self.sock.recv(32)
+        except socket.error as e:
+            self.fail("OFTP server is reachable but no data was received !", e)
+            return
+
+        if not data:
+            self.fail("OFTP server closed the connection without being ready !", 'EOF')
+            return
+
+        self.data = (self.data + data)[-64:]
+        if "READY" in self.data:
+            self.ready_time = time.time() - self.start_time
+            logger.debug('%s: READY received in %.3fs.', self.name, self.ready_time)
+            self.close()
+
+    def on_timeout(self, timeout):
+        logger.error('%s: timeout reached', self.name)
+        if self.connect_time is None:
+            self.fail("Unable to connect to OFTP server within %d seconds !" % timeout, 'timeout')
+        else:
+            self.fail("OFTP server is reachable but no data was received !", 'timeout')
+
+    def fail(self, message, reason):
+        logger.debug('%s: %s (%s)', self.name, message, reason)
+        self.error = message
+        self.close()
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def perfdata(self, prefix=''):
+        perfdata = []
+        for label, value in (('connect_time', self.connect_time), ('ready_time', self.ready_time)):
+            if value is not None:
+                perfdata.append("'%s%s'=%.3fs;;;0;" % (prefix, label, value))
+        return perfdata
+
+
+def probe_all(probes, timeout):
+    """Run all probes concurrently until they are done or timeout is reached."""
+    deadline = time.time() + timeout
+    for probe in probes:
+        probe.start()
+
+    while True:
+        pending = [probe for probe in probes if not probe.done]
+        remaining = deadline - time.time()
+        if not pending:
+            break
+        elif remaining <= 0:
+            for probe in pending:
+                probe.on_timeout(timeout)
+            break
+
+        connecting = dict((probe.sock, probe) for probe in pending if probe.connect_time is None)
+        connected = dict((probe.sock, probe) for probe in pending if probe.connect_time is not None)
+        readable, writable, errored = select.select(connected.keys(), connecting.keys(), [], remaining)
+
+        for sock in writable:
+            connecting[sock].on_writable()
+        for sock in readable:
+            connected[sock].on_readable()
+
+
+def parse_targets(arguments):
+    """Return the list of probes for the targets given on the command line."""
+    if arguments.targets:
+        targets = []
+        for target in arguments.targets.split(','):
+            hostname, _, port = target.strip().rpartition(':')
+            if not hostname or not port.isdigit():
+                raise ValueError(target)
+            targets.append(Probe(hostname, int(port)))
+        return targets
+    elif arguments.hostname and arguments.port:
+        return [Probe(arguments.hostname, arguments.port)]
+    return []
+
+
+def main():
+    # Tell OptionParser to parse all args and return their values
+    arguments = argparser.parse_args()[0]
+
+    # Check presence of mandatory arguments
+    try:
+        probes = parse_targets(arguments)
+    except ValueError as e:
+        print "UNKNOWN - Syntax error, invalid target %s (expecting host:port) !" % e
+        raise SystemExit(3)
+
+    if not probes:
+        print "UNKNOWN - Syntax error, missing connection information !"
+        raise SystemExit(3)
+
+    # Enable debug messages ?
+    if arguments.debug:
+        logger.setLevel(logging.DEBUG)
+
+    try:
+        probe_all(probes, arguments.timeout)
+    finally:
+        for probe in probes:
+            probe.close()
+
+    failed = [probe for probe in probes if probe.error]
+
+    if not arguments.targets:
+        # Single OFTP server
+        probe = probes[0]
+        if probe.error:
+            print "CRITICAL - %s" % probe.error
+            raise SystemExit(2)
+
+        print "OK - OFTP server is available. | %s" % " ".join(probe.perfdata())
+        raise SystemExit(0)
+
+    perfdata = []
+    for probe in probes:
+        perfdata.extend(probe.perfdata('%s_' % probe.name))
+
+    longoutput = "".join("\n%s: %s" % (probe.name, probe.error) for probe in failed)
+    if failed:
+        print "CRITICAL - %d/%d OFTP servers are not available !%s | %s" % (
+            len(failed), len(probes), longoutput, " ".join(perfdata))
+        raise SystemExit(2)
+
+    print "OK - %d OFTP servers are available. | %s" % (len(probes), " ".join(perfdata))
+    raise SystemExit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,7 @@
 import os, sys, argparse, subprocess, re
 
 from shared import __version__
+from snmpclient import Session, SNMPError
 
 #-------------------------------------------------------------------------------
 ## START OF CONFIGURATION ######################################################
@@ -36,15 +37,14 @@ snmpnetstat_opts = "-c {0.community} -v{0.version} {0.no_dns} -Cp {0.protocol} {
 ######################################################## END OF CONFIGURATION ##
 #-------------------------------------------------------------------------------
 
-###################
-####  Globals  ####
-###################
+# Columns walked in native mode
+TCP_CONNECTION_STATE = '1.3.6.1.2.1.6.19.1.7'     # TCP-MIB::tcpConnectionState (IPv4 / IPv6)
+TCP_CONN_STATE = '1.3.6.1.2.1.6.13.1.1'           # TCP-MIB::tcpConnState (IPv4 only, deprecated)
+UDP_LOCAL_ADDRESS = '1.3.6.1.2.1.7.5.1.1'         # UDP-MIB::udpLocalAddress
 
-# Nagios
-nagios_state = "OK"
-nagios_output = ""
-nagios_thresholds = ""
-nagios_exit_code = 0
+# TCP states as shown by snmpnetstat
+TCP_STATES = {1: 'CLOSED', 2: 'LISTEN', 3: 'SYNSENT', 4: 'SYNRECEIVED', 5: 'ESTABLISHED', 6: 'FINWAIT1',
+              7: 'FINWAIT2', 8: 'CLOSEWAIT', 9: 'LASTACK', 10: 'CLOSING', 11: 'TIMEWAIT', 12: 'DELETETCB'}
 
 #############################
 ####  Arguments parsing  ####
@@ -72,90 +72,190 @@ parser_extra_group.add_argument("-m", "--match", dest="match", default='',
                     help="Show only lines that match this string (default to 'all')")
 parser_extra_group.add_argument("--no-dns", action="store_true", dest="no_dns",
                     help="Do not try to use DNS to interpret IP addresses (off by default)")
+parser_extra_group.add_argument("--native", action="store_true", dest="native",
+                    help="Walk the connection tables directly instead of running 'snmpnetstat'. Lines are "
+                         "formatted like 'snmpnetstat -Cn' output (numeric addresses and ports)")
 parser.add_argument('--version', action='version', version='%s %s' % (progname, __version__))
 
-# Parse arguments on command line
-options = parser.parse_args()
-
 #########################
 ####  Sanity checks  ####
 #########################
 
 # Show debug message if debug is on
-def debug(message):
+def debug(options, message):
     if options.debug:
         sys.stderr.write(message)
 
-# Check the thresholds range
-if options.warning > 0 or options.critical > 0:
-    if options.warning > options.critical:
-        sys.stderr.write("Warning could not be greater than critical !\n")
-        sys.exit(3)
+def verify_options(options):
+    """Check the arguments parsed on command line and set their defaults."""
+    # Check the thresholds range
+    if options.warning > 0 or options.critical > 0:
+        if options.warning > options.critical:
+            sys.stderr.write("Warning could not be greater than critical !\n")
+            sys.exit(3)
+
+    # Set default match pattern (depending on which protocol to check for)
+    if not len(options.match):
+        options.match = r'^%s' % options.protocol
+
+    # Set SNMP version to use (v1 by default)
+    if options.version:
+        options.version = '2c'
+    else:
+        options.version = '1'
+
+    # Should we disable usage of DNS ?
+    if options.no_dns:
+        options.no_dns = '-Cn'
+    else:
+        options.no_dns = ''
+
+#######################
+####  Native mode  ####
+#######################
+
+def format_address(octets):
+    """Format an IPv4 or IPv6 address given as a list of octets."""
+    if len(octets) == 16:
+        return ':'.join('%x' % (octets[i] << 8 | octets[i + 1]) for i in range(0, 16, 2))
+    address = '.'.join(str(octet) for octet in octets)
+    if address == '0.0.0.0':
+        return '*'
+    return address
 
-# Set default match pattern (depending on which protocol to check for)
-if not len(options.match):
-    options.match = r'^%s' % options.protocol
+def format_endpoint(octets, port):
+    if not port and format_address(octets) == '*':
+        return '*.*'
+    return '%s.%d' % (format_address(octets), port)
 
-# Set SNMP version to use (v1 by default)
-if options.version:
-    options.version = '2c'
-else:
-    options.version = '1'
+def tcp_connection_lines(session):
+    """
+    Generator of snmpnetstat-like lines for TCP connections, walking
+    tcpConnectionTable or tcpConnTable on agents not supporting it.
+    """
+    rows = 0
+    for state in session.walk(TCP_CONNECTION_STATE):
+        rows += 1
+        if state.value == 2:
+            # Listening sockets are not shown by snmpnetstat
+            continue
 
-# Should we disable usage of DNS ?
-if options.no_dns:
-    options.no_dns = '-Cn'
-else:
-    options.no_dns = ''
+        # Index: local type, length, address, port, remote type, length, address, port
+        index = list(state.suffix)
+        local_length = index[1]
+        local, local_port = index[2:2 + local_length], index[2 + local_length]
+        index = index[3 + local_length:]
+        remote_length = index[1]
+        remote, remote_port = index[2:2 + remote_length], index[2 + remote_length]
+
+        yield 'tcp   %-28s %-28s %s' % (format_endpoint(local, local_port), format_endpoint(remote, remote_port),
+                                         TCP_STATES.get(state.value, state.value))
+    if rows:
+        return
+
+    for state in session.walk(TCP_CONN_STATE):
+        if state.value == 2:
+            continue
+
+        # Index: local address (4), local port, remote address (4), remote port
+        index = list(state.suffix)
+        yield 'tcp   %-28s %-28s %s' % (format_endpoint(index[0:4], index[4]), format_endpoint(index[5:9], index[9]),
+                                         TCP_STATES.get(state.value, state.value))
+
+def udp_lines(session):
+    """Generator of snmpnetstat-like lines for UDP listeners."""
+    for address in session.walk(UDP_LOCAL_ADDRESS):
+        index = list(address.suffix)
+        yield 'udp   %-28s *.*' % format_endpoint(index[0:4], index[4])
 
 ###############################
 ####  Commands processing  ####
 ###############################
 
-# Prepare command argument with the ones provided by user
-snmpnetstat_opts = snmpnetstat_opts.format(options)
-command = '%s %s' % (snmpnetstat, snmpnetstat_opts)
-
-debug("Debug is on.\n")
-debug("Command being executed: %s\n" % command)
-proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-out = proc.stdout.readlines()
-err = proc.stderr.read()
-
-# Check if there was any error
-if len(err) > 0:
-    sys.stderr.write(err)
-    sys.exit(3)
-elif not len(out) > 0:
-    sys.stderr.write('UNKNOWN - No output from snmpnetstat !')
-    sys.exit(3)
-
-# Start counting the number of connection found
-nbrConn = 0
-debug("Using pattern: %s\n" % options.match)
-debug("Getting output... (please wait):\n")
-for line in out:
-    if re.search(options.match, line):
-        debug(line)
-        nbrConn+=1
-
-# Check if number of connection found is in thresholds range
-if options.warning > 0 or options.critical > 0:
-    nagios_thresholds = "(<%s)" % options.warning
-
-    if options.warning < nbrConn < options.critical:
-        nagios_state = "WARNING"
-        nagios_thresholds = "(>%s) (<%s)" % (options.warning, options.critical)
-        nagios_exit_code = 1
-    if nbrConn > options.critical:
-        nagios_state = "CRITICAL"
-        nagios_thresholds = "(>%s)" % options.critical
-        nagios_exit_code = 2
-
-# Prepare Nagios output
-nagios_output = "%s - %d connection(s) using pattern '%s' %s | 'nbrConn'=%d;;;;\n" % (nagios_state, nbrConn,
-                                                                                      options.match, nagios_thresholds,
-                                                                                      nbrConn)
-
-sys.stdout.write(nagios_output)
-sys.exit(nagios_exit_code)
+def count_connections(options):
+    """Return the number of connections matching the pattern."""
+    matcher = re.compile(options.match)
+    debug(options, "Debug is on.\n")
+
+    if options.native:
+        # Walk the connection table and count matching lines as they are received
+        session = Session(options.hostname, community=options.community, version=options.version)
+        if options.protocol == 'tcp':
+            lines = tcp_connection_lines(session)
+        else:
+            lines = udp_lines(session)
+
+        nbrConn = 0
+        debug(options, "Using pattern: %s\n" % options.match)
+        debug(options, "Getting output... (please wait):\n")
+        try:
+            for line in lines:
+                if matcher.search(line):
+                    debug(options, line + "\n")
+                    nbrConn+=1
+        except SNMPError as e:
+            sys.stderr.write('UNKNOWN - SNMP Query Error: %s\n' % e)
+            sys.exit(3)
+    else:
+        # Prepare command argument with the ones provided by user
+        command = '%s %s' % (snmpnetstat, snmpnetstat_opts.format(options))
+
+        debug(options, "Command being executed: %s\n" % command)
+        proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out = proc.stdout.readlines()
+        err = proc.stderr.read()
+
+        # Check if there was any error
+        if len(err) > 0:
+            sys.stderr.write(err)
+            sys.exit(3)
+        elif not len(out) > 0:
+            sys.stderr.write('UNKNOWN - No output from snmpnetstat !')
+            sys.exit(3)
+
+        # Start counting the number of connection found
+        nbrConn = 0
+        debug(options, "Using pattern: %s\n" % options.match)
+        debug(options, "Getting output... (please wait):\n")
+        for line in out:
+            if matcher.search(line):
+                debug(options, line)
+                nbrConn+=1
+
+    return nbrConn
+
+def main():
+    # Parse arguments on command line
+    options = parser.parse_args()
+    verify_options(options)
+
+    nbrConn = count_connections(options)
+
+    # Nagios
+    nagios_state = "OK"
+    nagios_thresholds = ""
+    nagios_exit_code = 0
+
+    # Check if number of connection found is in thresholds range
+    if options.warning > 0 or options.critical > 0:
+        nagios_thresholds = "(<%s)" % options.warning
+
+        if options.warning < nbrConn < options.critical:
+            nagios_state = "WARNING"
+            nagios_thresholds = "(>%s) (<%s)" % (options.warning, options.critical)
+            nagios_exit_code = 1
+        if nbrConn > options.critical:
+            nagios_state = "CRITICAL"
+            nagios_thresholds = "(>%s)" % options.critical
+            nagios_exit_code = 2
+
+    # Prepare Nagios output
+    nagios_output = "%s - %d connection(s) using pattern '%s' %s | 'nbrConn'=%d;;;;\n" % (nagios_state, nbrConn,
+                                                                                          options.match,
+                                                                                          nagios_thresholds, nbrConn)
+
+    sys.stdout.write(nagios_output)
+    sys.exit(nagios_exit_code)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Filename      : circuit.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Circuit breaker failing fast the checks of unreachable hosts.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# When a site is down, every check of every device there waits for the SNMP
+# timeout and all retries. The circuit of a host opens after ``threshold``
+# consecutive checks ending on a SNMP timeout: checks of all plugins then fail
+# at once until ``backoff`` seconds passed. The first check run after that is
+# the probe (half-open circuit), other checks keep failing fast while it runs.
+# The probe closes the circuit if the agent answers, opens it again for
+# ``backoff`` seconds otherwise. A probe that did not report within ``backoff``
+# seconds (killed) is replaced by the next check.
+#
+# The state of the circuit of each host is shared by all plugins in the state
+# store (see statestore.py) as the tuple (consecutive timeouts, opened at,
+# probe started at). It is only written when it changes, hosts answering
+# every check have no entry.
+#
+
+from time import time
+
+CLOSED = (0, None, None)
+
+# Decisions of allow()
+PASS = 'pass'
+PROBE = 'probe'
+REJECT = 'reject'
+
+
+class CircuitBreaker(object):
+    """Circuit of ``host`` kept in the ``StateStore`` ``store``."""
+    def __init__(self, store, host, threshold, backoff):
+        self.store = store
+        self.host = host
+        self.threshold = threshold
+        self.backoff = backoff
+        self.state = CLOSED
+
+    def _update(self, function):
+        self.state = tuple(self.store.update(self.host, 'circuit', 'snmp', function) or CLOSED)
+        return self.state
+
+    def allow(self):
+        """Return PASS if the circuit is closed, PROBE if this check is the probe, REJECT otherwise."""
+        decision = []
+
+        def claim(state):
+            failures, opened, probe = state or CLOSED
+            now = time()
+            if failures < self.threshold or opened is None:
+                decision.append(PASS)
+            elif now < opened + self.backoff:
+                decision.append(REJECT)
+            elif probe is None or now >= probe + self.backoff:
+                decision.append(PROBE)
+                return failures, opened, now
+            else:
+                decision.append(REJECT)
+            return state
+
+        self._update(claim)
+        return decision[0]
+
+    def record(self, success):
+        """Record the end of a check, ``success`` if the agent answered."""
+        def update(state):
+            failures, opened, probe = state or CLOSED
+            if success:
+                # Hosts without entry stay without entry
+                return state and CLOSED
+            failures += 1
+            if failures >= self.threshold:
+                return failures, time(), None
+            return failures, opened, probe
+
+        self._update(update)
+
+    def retry_in(self):
+        """Return the seconds before the next probe of an open circuit."""
+        failures, opened, probe = self.state
+        return max((probe or opened or 0) + self.backoff - time(), 0)
@@ -0,0 +1,70 @@
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Filename      : counters.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Deltas of SNMP counters between two runs.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# A counter lower than its previous sample either wrapped (it went over its
+# maximum value and restarted from zero) or was reset (device reboot, counters
+# cleared). A wrap adds the range of the counter to the delta, a reset means
+# the counter started again from zero since the previous sample.
+#
+# Reboots are detected with sysUpTime. Without it, a decrease of a Counter32 is
+# a wrap when the resulting delta is below half of its range, a reset
+# otherwise. A Counter64 does not wrap in practice, a decrease is a reset.
+#
+
+# sysUpTime is a 32 bits counter of hundredths of seconds
+UPTIME_RANGE = 2 ** 32
+
+
+def rebooted(previous_uptime, uptime, elapsed=None):
+    """
+    Return True if the device rebooted between two samples of sysUpTime.
+
+    ``elapsed`` (seconds between the samples) tells a wrap of sysUpTime, after
+    497 days, from a reboot. Unknown uptimes (None) never show a reboot.
+    """
+    if previous_uptime is None or uptime is None or uptime >= previous_uptime:
+        return False
+    elif elapsed is not None and previous_uptime + elapsed * 100 >= UPTIME_RANGE:
+        # sysUpTime wrapped, it is about the expected value modulo its range
+        return abs((previous_uptime + elapsed * 100) % UPTIME_RANGE - uptime) > elapsed * 100
+    return True
+
+
+def counter_delta(previous, current, bits=32, reset=False):
+    """
+    Return the increase of a counter of ``bits`` bits between two samples.
+
+    ``reset`` tells the counter was reset since the previous sample (eg. device
+    rebooted), the delta is then the current value. Return None if one of the
+    samples is missing.
+    """
+    if previous is None or current is None:
+        return None
+    elif reset:
+        return current
+    elif current >= previous:
+        return current - previous
+
+    wrapped = current + 2 ** bits - previous
+    if bits < 64 and wrapped < 2 ** (bits - 1):
+        return wrapped
+    # Counter discontinuity (counters cleared, agent restarted...)
+    return current
+
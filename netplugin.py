@@ -0,0 +1,392 @@
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Filename      : netplugin.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Base class of the SNMP plugins of this collection.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+
+import logging
+from timeit import default_timer
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from monitoring.nagios.plugin import NagiosPluginSNMP
+
+from snmpclient import Session, SNMPError, SNMPTimeout
+
+logger = logging.getLogger('plugin')
+
+# State stores opened by this process, kept open for the next checks of a
+# pollerd or batch worker
+_state_stores = {}
+
+# Sessions to the SNMP agents kept for the next checks of a pollerd or batch
+# worker, None to open a new session for each check (see use_session_cache())
+_sessions = None
+
+# Store of the circuit breaker state when --state-file is not given
+DEFAULT_STATE_FILE = '/var/tmp/netplugins.state'
+
+
+def use_session_cache(size):
+    """Keep the sessions of up to ``size`` SNMP agents open for the next checks of this process."""
+    global _sessions
+    from snmpclient import SessionCache
+    _sessions = SessionCache(size)
+
+
+class NetworkPluginSNMP(NagiosPluginSNMP):
+    """
+    NagiosPluginSNMP with the options shared by the plugins of this collection.
+
+    ``self.snmp`` replaces the query object set by NagiosPluginSNMP by a
+    snmpclient session (GETBULK walks, PDU counting), wrapped on first use
+    according to the plugin options (eg. walk cache).
+
+    With ``--timings``, the time spent in each phase of the check is added to
+    the perfdata: SNMP (setup, requests, walk of each column), phases measured
+    with ``timed()`` and the remaining data processing.
+
+    ``select_perfdata()`` keeps the perfdata of the worst items of devices
+    with many ports or sensors with ``--perfdata top=N``.
+
+    ``load_state()`` and ``save_state()`` keep small values between runs, in
+    the state store shared by all hosts and plugins with ``--state-file``, in
+    the retention file of the plugin for the host otherwise.
+
+    With ``--circuit-breaker N``, checks of a host fail fast with UNKNOWN after
+    N consecutive checks ended on a SNMP timeout (see circuit.py).
+    """
+    _snmp_backend = None
+    _snmp_query = None
+    _snmp_session = None
+    _check_start = None
+    timings = None
+    perfdata_top = None
+
+    def define_plugin_arguments(self):
+        """Define arguments common to all network plugins"""
+        super(NetworkPluginSNMP, self).define_plugin_arguments()
+
+        self.required_args.add_argument('--cache-dir',
+                                        dest='cache_dir',
+                                        help="Share name tables walks with other plugins using a cache in this "
+                                             "directory (disabled by default).",
+                                        )
+        self.required_args.add_argument('--cache-ttl',
+                                        dest='cache_ttl',
+                                        type=int,
+                                        default=60,
+                                        help="Lifetime of cached walks in seconds (default to 60).",
+                                        )
+        self.required_args.add_argument('--circuit-breaker',
+                                        dest='circuit_breaker',
+                                        type=int,
+                                        default=0,
+                                        help="Fail fast with UNKNOWN after this number of consecutive checks of the "
+                                             "host ended on a SNMP timeout, whatever the plugin (default to 0, "
+                                             "disabled). Its state is kept in the state store (--state-file, "
+                                             "default to %s)." % DEFAULT_STATE_FILE,
+                                        )
+        self.required_args.add_argument('--circuit-backoff',
+                                        dest='circuit_backoff',
+                                        type=int,
+                                        default=300,
+                                        help="Seconds checks fail fast before probing the host again (default to "
+                                             "300).",
+                                        )
+        self.required_args.add_argument('--max-columns',
+                                        dest='max_columns',
+                                        type=int,
+                                        default=8,
+                                        help="Table columns walked together in each request, 1 to walk them one "
+                                             "after the other (default to 8).",
+                                        )
+        self.required_args.add_argument('--max-repetitions',
+                                        dest='max_repetitions',
+                                        type=int,
+                                        default=25,
+                                        help="Rows requested per GETBULK PDU when walking tables, 0 to use "
+                                             "GETNEXT (default to 25). SNMPv1 agents always use GETNEXT.",
+                                        )
+        self.required_args.add_argument('--perfdata',
+                                        dest='perfdata_mode',
+                                        default='all',
+                                        help="Perfdata of all items, or top=N for the N worst items and the "
+                                             "sum, max and count over warning of all items (default to all).",
+                                        )
+        self.required_args.add_argument('--snmp-port',
+                                        dest='snmp_port',
+                                        type=int,
+                                        default=161,
+                                        help="UDP port of the SNMP agent (default to 161).",
+                                        )
+        self.required_args.add_argument('--snmp-retries',
+                                        dest='snmp_retries',
+                                        type=int,
+                                        default=5,
+                                        help="Requests sent again to the SNMP agent not answering before giving "
+                                             "up (default to 5).",
+                                        )
+        self.required_args.add_argument('--snmp-timeout',
+                                        dest='snmp_timeout',
+                                        type=float,
+                                        default=1.0,
+                                        help="Seconds waiting for a response of the SNMP agent before sending the "
+                                             "request again (default to 1).",
+                                        )
+        self.required_args.add_argument('--sparse-rows',
+                                        dest='sparse_rows',
+                                        type=int,
+                                        default=100,
+                                        help="Get the names of up to this number of ports or sensors with GET "
+                                             "requests instead of walking the whole name table, 0 to always walk "
+                                             "(default to 100).",
+                                        )
+        self.required_args.add_argument('--state-file',
+                                        dest='state_file',
+                                        help="Keep the state of the plugin in this store shared by all hosts and "
+                                             "plugins (see statestore.py) instead of a retention file per host.",
+                                        )
+        self.required_args.add_argument('--timings',
+                                        dest='timings',
+                                        action='store_true',
+                                        help="Add the time spent in each phase of the check to perfdata.",
+                                        )
+
+    def verify_plugin_arguments(self):
+        super(NetworkPluginSNMP, self).verify_plugin_arguments()
+
+        if self.options.max_repetitions < 0:
+            self.unknown('Max repetitions cannot be below zero !')
+        if self.options.max_columns < 1:
+            self.unknown('Max columns cannot be below one !')
+        if self.options.sparse_rows < 0:
+            self.unknown('Sparse rows cannot be below zero !')
+        if self.options.snmp_retries < 0:
+            self.unknown('SNMP retries cannot be below zero !')
+        if self.options.snmp_timeout <= 0:
+            self.unknown('SNMP timeout must be above zero !')
+        if self.options.circuit_breaker < 0 or self.options.circuit_backoff < 0:
+            self.unknown('Circuit breaker threshold and backoff cannot be below zero !')
+
+        if self.options.perfdata_mode != 'all':
+            mode, _, top = self.options.perfdata_mode.partition('=')
+            if mode != 'top' or not top.isdigit():
+                self.unknown('Perfdata mode must be all or top=N !')
+            self.perfdata_top = int(top)
+
+    def _get_snmp(self):
+        if self._snmp_query is None:
+            version = '1' if str(self.options.snmpversion) == '1' else '2c'
+            options = dict(community=self.options.snmpcommunity,
+                           version=version,
+                           port=self.options.snmp_port,
+                           timeout=self.options.snmp_timeout,
+                           retries=self.options.snmp_retries,
+                           max_repetitions=self.options.max_repetitions,
+                           max_columns=self.options.max_columns)
+            if _sessions:
+                self._snmp_session = _sessions.get(self.options.hostname, **options)
+            else:
+                self._snmp_session = Session(self.options.hostname, **options)
+            query = self._snmp_session
+            if self.options.cache_dir:
+                from snmpcache import WalkCache, CachedQuery
+                cache = WalkCache(self.options.cache_dir, self.options.cache_ttl)
+                query = CachedQuery(query, cache, self.options.hostname, self.options.snmp_port,
+                                    self.options.snmpcommunity)
+            self._snmp_query = query
+
+        return self._snmp_query
+
+    def _set_snmp(self, query):
+        self._snmp_backend = query
+        self._snmp_query = None
+
+    snmp = property(_get_snmp, _set_snmp)
+
+    def use_query(self, query):
+        """Send the SNMP requests of the check to ``query``, eg. shared by the checks of several services."""
+        self._snmp_query = query
+
+    def select_perfdata(self, items, label, unit='', aggregates=('sum', 'max', 'over')):
+        """
+        Return the perfdata to output for ``items``, list of (value, warning
+        threshold, perfdata) of each port, sensor...
+
+        All perfdata are returned, unless ``--perfdata top=N`` which keeps the
+        N items the most above their warning threshold, in their order, and
+        adds ``aggregates`` of all items: ``<label>_sum``, ``<label>_max`` of
+        values and ``<label>_over`` the number of items above warning.
+        """
+        if self.perfdata_top is None:
+            return [perfdata for value, warning, perfdata in items]
+
+        worst = sorted(xrange(len(items)), key=lambda i: items[i][0] - (items[i][1] or 0), reverse=True)
+        selected = [items[i][2] for i in sorted(worst[:self.perfdata_top])]
+
+        values = [value for value, warning, perfdata in items]
+        if 'sum' in aggregates:
+            selected.append('%s_sum=%d%s;;;0;' % (label, sum(values), unit))
+        if 'max' in aggregates:
+            selected.append('%s_max=%d%s;;;;' % (label, max(values) if values else 0, unit))
+        if 'over' in aggregates:
+            over = sum(1 for value, warning, perfdata in items if warning is not None and value > warning)
+            selected.append('%s_over=%d;;;0;%d' % (label, over, len(items)))
+        return selected
+
+    def host_key(self):
+        """Return the name of the SNMP agent in stored states and file names: the host, with its port if not 161."""
+        port = getattr(self.options, 'snmp_port', 161)
+        if port == 161:
+            return self.options.hostname
+        return '%s:%d' % (self.options.hostname, port)
+
+    def _state_store(self, path=None):
+        path = path or self.options.state_file
+        if path not in _state_stores:
+            from statestore import StateStore
+            _state_stores[path] = StateStore(path)
+            _state_stores[path].open()
+        return _state_stores[path]
+
+    def _retention_states(self):
+        try:
+            states = self.load_data()[-1]
+            if isinstance(states, dict):
+                return states
+        except (IOError, EOFError, IndexError, TypeError, ValueError):
+            pass
+        return {}
+
+    def load_state(self, key, default=None):
+        """Return the value saved by ``save_state(key, value)`` for this host on a previous run."""
+        if getattr(self.options, 'state_file', None):
+            return self._state_store().get(self.host_key(), type(self).__name__, key, default)
+        return self._retention_states().get(key, default)
+
+    def save_state(self, key, value):
+        """Save ``value`` for ``key`` of this host for the next runs."""
+        if getattr(self.options, 'state_file', None):
+            self._state_store().set(self.host_key(), type(self).__name__, key, value)
+        else:
+            states = self._retention_states()
+            states[key] = value
+            self.save_data([states], limit=1)
+
+    @contextmanager
+    def timed(self, phase):
+        """Context manager adding the time spent in its block to the timings of ``phase``."""
+        if self.timings is None:
+            self.timings = OrderedDict()
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0) + default_timer() - start
+
+    def _circuit_breaker(self):
+        """Return the circuit breaker of the host, None if disabled."""
+        if not getattr(self.options, 'circuit_breaker', 0):
+            return None
+        from circuit import CircuitBreaker
+        store = self._state_store(self.options.state_file or DEFAULT_STATE_FILE)
+        return CircuitBreaker(store, self.host_key(), self.options.circuit_breaker,
+                              self.options.circuit_backoff)
+
+    def run_check(self, check):
+        """Call ``check(self)``, SNMP errors are reported as unknown."""
+        self._check_start = default_timer()
+        breaker = self._circuit_breaker()
+        if breaker:
+            from circuit import REJECT, PROBE
+            decision = breaker.allow()
+            if decision == REJECT:
+                self.unknown('Host %s unreachable: %d consecutive SNMP timeouts, next try in %ds.' % (
+                    self.options.hostname, breaker.state[0], breaker.retry_in()))
+            elif decision == PROBE:
+                logger.debug('Circuit of %s half-open, this check is the probe.' % self.options.hostname)
+
+        try:
+            check(self)
+        except SNMPTimeout as e:
+            if breaker:
+                breaker.record(False)
+            self.unknown('SNMP Query Error: %s' % e)
+        except SNMPError as e:
+            self._record_response(breaker)
+            self.unknown('SNMP Query Error: %s' % e)
+        except SystemExit:
+            self._record_response(breaker)
+            raise
+
+    def _record_response(self, breaker):
+        """Close the circuit of the host if its agent answered during the check."""
+        if breaker and self._snmp_session and self._snmp_session.responses:
+            breaker.record(True)
+
+    def perfdata(self):
+        """Return the list of perfdata about the plugin run added to its output."""
+        perfdata = []
+        if self._snmp_session:
+            perfdata.append('pdus=%d;;;0;' % self._snmp_session.pdus)
+        if getattr(self.options, 'timings', False) and self._check_start is not None:
+            perfdata.extend('%s=%.4fs;;;0;' % timing for timing in self._timings())
+        return perfdata
+
+    def _timings(self):
+        """Return the list of (label, seconds) of the phases of the check."""
+        timings = []
+        spent = 0.0
+        session = self._snmp_session
+        if session:
+            timings.append(('setup_time', session.setup_time))
+            timings.append(('snmp_time', session.request_time))
+            timings.extend(('walk_%s' % name, seconds) for name, seconds in session.walk_times.iteritems())
+            spent += session.setup_time + session.request_time
+        for phase, seconds in (self.timings or {}).iteritems():
+            timings.append(('%s_time' % phase, seconds))
+            spent += seconds
+        total = default_timer() - self._check_start
+        timings.append(('processing_time', max(total - spent, 0)))
+        timings.append(('check_time', total))
+
+        logger.debug('-- Timings:')
+        for label, seconds in timings:
+            logger.debug('\t%-30s %8.1f ms' % (label, seconds * 1000))
+
+        return timings
+
+    def _output(self, message):
+        perfdata = ' '.join(self.perfdata())
+        if not perfdata:
+            return message
+        elif '|' in message:
+            return '%s %s' % (message.rstrip(), perfdata)
+        return '%s | %s' % (message.rstrip('\n'), perfdata)
+
+    def ok(self, message):
+        return super(NetworkPluginSNMP, self).ok(self._output(message))
+
+    def warning(self, message):
+        return super(NetworkPluginSNMP, self).warning(self._output(message))
+
+    def critical(self, message):
+        return super(NetworkPluginSNMP, self).critical(self._output(message))
+
+    def unknown(self, message):
+        return super(NetworkPluginSNMP, self).unknown(self._output(message))
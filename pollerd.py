@@ -0,0 +1,306 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Name          : pollerd.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Long-running daemon scheduling network checks for many hosts
+#                 and submitting their results as passive checks.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# Checks are described in a jobs file, one per line:
+#
+#   <host_name> <service_description> <interval> <plugin> <plugin arguments...>
+#
+# eg. sw-core-01 CPU 300 check_cisco_cpu -H 10.0.0.1 -C public -w 80 -c 90
+#
+# Blank lines and lines starting with '#' are ignored. Service descriptions
+# containing spaces must be quoted.
+#
+# Plugins are imported once by each worker process of the pool, each check is
+# then a call to the plugin main() function instead of a new Python process.
+# Workers keep the SNMP sessions of the last agents they checked open for their
+# next checks.
+#
+
+import os
+import sys
+import time
+import heapq
+import shlex
+import signal
+import logging
+import argparse
+import threading
+import traceback
+import multiprocessing
+from StringIO import StringIO
+
+from shared import __version__
+
+logger = logging.getLogger('pollerd')
+
+# Plugins that can be scheduled by the daemon
+PLUGINS = (
+    'check_cisco_config',
+    'check_cisco_cpu',
+    'check_cisco_hard',
+    'check_cisco_health',
+    'check_cisco_hsrp',
+    'check_cisco_temp',
+    'check_ibm_san_directors_crcs',
+)
+
+# Nagios states
+STATES = ('OK', 'WARNING', 'CRITICAL', 'UNKNOWN')
+
+# Return codes from the best to the worst state: OK, UNKNOWN, WARNING, CRITICAL
+SEVERITY = (0, 3, 1, 2)
+
+# Seconds past the check timeout after which a check without result is
+# considered lost (worker killed, eg. by the OOM killer) and run again
+LOST_CHECK_MARGIN = 30
+
+# SNMP sessions kept open by each worker for the next checks of the same agents
+SESSIONS_PER_WORKER = 256
+
+# Loaded plugin modules, filled in each worker process
+_modules = {}
+
+
+class CheckTimeout(Exception):
+    pass
+
+
+class Job(object):
+    """A check scheduled for a host / service."""
+    def __init__(self, host, service, interval, plugin, arguments):
+        self.host = host
+        self.service = service
+        self.interval = interval
+        self.plugin = plugin
+        self.arguments = arguments
+        self.running = False
+        self.dispatched = None
+
+    def __repr__(self):
+        return '<Job %s/%s (%s every %ds)>' % (self.host, self.service, self.plugin, self.interval)
+
+
+def load_jobs(filename):
+    """Parse the jobs file and return the list of jobs."""
+    jobs = []
+    with open(filename) as jobs_file:
+        for lineno, line in enumerate(jobs_file, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            fields = shlex.split(line)
+            if len(fields) < 4:
+                raise ValueError('%s:%d: expecting host, service, interval and plugin.' % (filename, lineno))
+
+            host, service, interval, plugin = fields[:4]
+            plugin = os.path.splitext(plugin)[0]
+            if plugin not in PLUGINS:
+                raise ValueError('%s:%d: unknown plugin %s.' % (filename, lineno, plugin))
+
+            jobs.append(Job(host, service, int(interval), plugin, fields[4:]))
+
+    return jobs
+
+
+def _raise_timeout(signum, frame):
+    raise CheckTimeout()
+
+
+def load_plugins(names=PLUGINS):
+    """Worker initializer: import plugin modules (all by default) once and keep SNMP sessions open."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    for name in names:
+        _modules[name] = __import__(name)
+
+    import netplugin
+    netplugin.use_session_cache(SESSIONS_PER_WORKER)
+
+
+def run_check(plugin, arguments, timeout):
+    """
+    Run a plugin in the current worker process.
+
+    Return a tuple (return code, output), see capture_check().
+    """
+    return capture_check(_modules[plugin].main, ['%s.py' % plugin] + list(arguments), timeout)
+
+
+def capture_check(function, argv, timeout=0):
+    """
+    Call ``function``, a plugin check, with ``argv`` as command line.
+
+    The plugin exits through SystemExit after writing its output on stdout, so
+    both are captured (stderr too, for argument errors). The check is stopped
+    after ``timeout`` seconds, if not 0, when SIGALRM is handled as in the
+    workers (see load_plugins()), the alarm of an enclosing check is left
+    alone otherwise. Return a tuple (return code, output).
+    """
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output = StringIO()
+    argv_saved, sys.argv = sys.argv, list(argv)
+    return_code = 3
+
+    if timeout:
+        signal.alarm(timeout)
+    try:
+        function()
+    except SystemExit as e:
+        if e.code is None:
+            return_code = 0
+        elif isinstance(e.code, int):
+            return_code = e.code
+    except CheckTimeout:
+        if not timeout:
+            raise
+        output.write('UNKNOWN - Check timed out after %d seconds !' % timeout)
+    except Exception:
+        output.write('UNKNOWN - Unexpected error !\n%s' % traceback.format_exc(limit=1))
+    finally:
+        if timeout:
+            signal.alarm(0)
+        sys.stdout, sys.stderr = stdout, stderr
+        sys.argv = argv_saved
+
+    if not 0 <= return_code <= 3:
+        return_code = 3
+
+    return return_code, output.getvalue().strip()
+
+
+def escape_output(output):
+    """Escape long output lines, an external command must fit one line."""
+    return output.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+class CommandFile(object):
+    """Write passive check results to the Nagios / Shinken external command file."""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def submit(self, job, return_code, output):
+        output = escape_output(output)
+        command = '[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n' % (
+            time.time(), job.host, job.service, return_code, output)
+
+        with self.lock:
+            with open(self.path, 'a') as command_file:
+                command_file.write(command)
+
+
+class Scheduler(object):
+    """Dispatch jobs to the worker pool at their interval."""
+    def __init__(self, jobs, command_file, workers, timeout):
+        self.command_file = command_file
+        self.timeout = timeout
+        self.pool = multiprocessing.Pool(workers, initializer=load_plugins)
+        self.queue = []
+
+        # Spread first runs over the interval to avoid bursts at startup
+        now = time.time()
+        for number, job in enumerate(jobs):
+            heapq.heappush(self.queue, (now + job.interval * float(number) / len(jobs), number, job))
+
+    def _done(self, job):
+        dispatched = job.dispatched
+
+        def callback(result):
+            # Runs in the result handler thread of the pool, which must not die
+            try:
+                return_code, output = result
+                logger.debug('%s: %s - %s', job, STATES[return_code], output.split('\n')[0])
+                self.command_file.submit(job, return_code, output)
+            except IOError as e:
+                logger.error('%s: cannot submit result: %s', job, e)
+            finally:
+                # Result of a check run again after being considered lost
+                if job.dispatched == dispatched:
+                    job.running = False
+        return callback
+
+    def run(self):
+        while self.queue:
+            next_run, number, job = self.queue[0]
+            delay = next_run - time.time()
+            if delay > 0:
+                time.sleep(min(delay, 1))
+                continue
+
+            heapq.heapreplace(self.queue, (next_run + job.interval, number, job))
+            if job.running:
+                if time.time() - job.dispatched < self.timeout + LOST_CHECK_MARGIN:
+                    logger.warning('%s: previous check still running, skipped.', job)
+                    continue
+                logger.warning('%s: no result of previous check after %ds, lost.', job,
+                               time.time() - job.dispatched)
+
+            job.running = True
+            job.dispatched = time.time()
+            self.pool.apply_async(run_check, (job.plugin, job.arguments, self.timeout), callback=self._done(job))
+
+    def stop(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Schedule network checks for many hosts and submit passive results.')
+    parser.add_argument('-f', dest='jobs', required=True,
+                        help='Jobs file describing checks to schedule.')
+    parser.add_argument('-e', dest='command_file', default='/var/lib/shinken/nagios.cmd',
+                        help='External command file (default: %(default)s).')
+    parser.add_argument('-w', dest='workers', type=int, default=multiprocessing.cpu_count() * 4,
+                        help='Number of worker processes (default: %(default)s).')
+    parser.add_argument('-t', dest='timeout', type=int, default=60,
+                        help='Timeout of a single check in seconds (default: %(default)s).')
+    parser.add_argument('-d', '--debug', action='store_true', dest='debug',
+                        help='Show debug information.')
+    parser.add_argument('--version', action='version', version='%(prog)s ' + __version__)
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if options.debug else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+
+    try:
+        jobs = load_jobs(options.jobs)
+    except (IOError, ValueError) as e:
+        parser.error(str(e))
+
+    logger.info('Scheduling %d checks using %d workers.', len(jobs), options.workers)
+    scheduler = Scheduler(jobs, CommandFile(options.command_file), options.workers, options.timeout)
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        logger.info('Stopping.')
+    finally:
+        scheduler.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Filename      : retention.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Fixed-size ring buffer file storing counters of the last runs.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# File layout (little endian):
+#
+#   header   magic 'NPRB', format version, capacity, count, head, number of
+#            ports, window
+#   ports    for each port, its key and its name (length prefixed strings)
+#   sums     one int64 per port: sum of increments over the last window records
+#   records  capacity slots of: timestamp (double) + sysUpTime of the device
+#            (int64) + one int64 counter per port
+#
+# Appending a record writes one slot, the sums and the header. The port table
+# is only rewritten when the set of ports (or a port name) changes. Missing
+# counters and unknown uptimes are stored as -1.
+#
+# Increments between records handle counter wraps and device reboots (see
+# counters.py). Files of older formats are converted when opened.
+#
+
+import os
+import fcntl
+import struct
+import logging
+
+from counters import counter_delta, rebooted
+
+logger = logging.getLogger('plugin')
+
+MAGIC = 'NPRB'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('<4sHIIIII')
+HEADER_V1 = struct.Struct('<4sHIIII')
+STRING_LENGTH = struct.Struct('<H')
+MISSING = -1
+
+
+def increment(previous, current, bits=32, reset=False):
+    """
+    Return the increase of a counter of ``bits`` bits between two records.
+
+    ``reset`` tells the device rebooted between the records. Ports missing
+    from one of the records do not contribute.
+    """
+    return counter_delta(previous, current, bits, reset) or 0
+
+
+def interval_reset(previous, current):
+    """Return True if the device rebooted between the records ``previous`` and ``current``."""
+    return rebooted(previous[2], current[2], current[0] - previous[0])
+
+
+class RingStore(object):
+    """
+    Ring buffer of the last ``capacity`` records of per-port counters.
+
+    A record is a tuple (timestamp, {port: counter}, uptime), uptime being
+    the sysUpTime of the device or None if unknown. Port names are kept in
+    ``names`` ({port: name}) and ``sums`` ({port: sum}) holds the sum of
+    counter increments over the last ``window`` records, counters being of
+    ``bits`` bits.
+    """
+    def __init__(self, path, capacity=50, bits=32):
+        self.path = path
+        self.capacity = capacity
+        self.bits = bits
+        self.count = 0
+        self.head = 0
+        self.window = 0
+        self.ports = []
+        self.names = {}
+        self.sums = {}
+        self._file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def _record(self):
+        return struct.Struct('<dq%dq' % len(self.ports))
+
+    @property
+    def _record_v2(self):
+        return struct.Struct('<d%dq' % len(self.ports))
+
+    @property
+    def _sums(self):
+        return struct.Struct('<%dq' % len(self.ports))
+
+    @property
+    def _sums_offset(self):
+        size = HEADER.size
+        for port in self.ports:
+            size += 2 * STRING_LENGTH.size + len(port) + len(self.names[port])
+        return size
+
+    @property
+    def _records_offset(self):
+        return self._sums_offset + self._sums.size
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def open(self):
+        """Open (or create) the store and lock it for this run."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        self._file = os.fdopen(fd, 'r+b')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+
+        header = self._file.read(HEADER.size)
+        if len(header) < HEADER_V1.size:
+            return
+
+        magic, version = struct.unpack('<4sH', header[:6])
+        if magic != MAGIC or version not in (1, 2, FORMAT_VERSION):
+            raise IOError('%s is not a ring buffer retention file.' % self.path)
+
+        if version == 1:
+            self._file.seek(0)
+            header = self._file.read(HEADER_V1.size)
+            magic, version, capacity, self.count, self.head, nbr_ports = HEADER_V1.unpack(header)
+        else:
+            magic, version, capacity, self.count, self.head, nbr_ports, self.window = HEADER.unpack(header)
+
+        self.ports = []
+        for i in xrange(nbr_ports):
+            port = self._read_string()
+            self.names[port] = self._read_string()
+            self.ports.append(port)
+
+        if version == 1:
+            # Records were following the port table, without sums. They are
+            # computed again by the next slide().
+            offset = self._sums_offset - HEADER.size + HEADER_V1.size
+            records = self.last(self.capacity, capacity, offset, self._record_v2)
+            self._rewrite(records)
+            return
+        elif version == 2:
+            # Records without uptime, sums are computed again by the next
+            # slide()
+            self.window = 0
+            records = self.last(self.capacity, capacity, record=self._record_v2)
+            self._rewrite(records)
+            return
+
+        self.sums = dict(zip(self.ports, self._sums.unpack(self._file.read(self._sums.size))))
+
+        if capacity != self.capacity:
+            # Keep the most recent records in a store of the new capacity
+            records = self.last(self.capacity, capacity)
+            self._rewrite(records)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _read_string(self):
+        length, = STRING_LENGTH.unpack(self._file.read(STRING_LENGTH.size))
+        return self._file.read(length)
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, self.capacity, self.count, self.head, len(self.ports),
+                                     self.window))
+
+    def _write_sums(self):
+        self._file.seek(self._sums_offset)
+        self._file.write(self._sums.pack(*[self.sums.get(port, 0) for port in self.ports]))
+
+    def _rewrite(self, records):
+        """Write the whole file with the current port table and ``records``."""
+        logger.debug('Rewriting retention file %s with %d ports.' % (self.path, len(self.ports)))
+        self.count = 0
+        self.head = 0
+        self._file.seek(0)
+        self._file.truncate()
+        self._write_header()
+        for port in self.ports:
+            for string in (port, self.names[port]):
+                self._file.write(STRING_LENGTH.pack(len(string)) + string)
+        self._write_sums()
+        self._file.write('\0' * self._record.size * self.capacity)
+
+        for timestamp, counters, uptime in records:
+            self._append(timestamp, counters, uptime)
+        self._write_header()
+        self._file.flush()
+
+    def _append(self, timestamp, counters, uptime=None):
+        values = [counters.get(port, MISSING) for port in self.ports]
+        self._file.seek(self._records_offset + self.head * self._record.size)
+        self._file.write(self._record.pack(timestamp, MISSING if uptime is None else uptime, *values))
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _update_ports(self, names):
+        """Add or rename ports from ``names``, rewrite the file if needed."""
+        new_ports = [port for port in names if port not in self.names or self.names[port] != names[port]]
+        if new_ports or not self.ports:
+            records = self.last(self.count)
+            self.names.update(names)
+
+            # Forget ports that are not in any retained record anymore
+            ports = set(names)
+            for record in records:
+                ports.update(record[1])
+            self.ports = sorted(ports)
+            self.names = dict((port, self.names[port]) for port in self.ports)
+
+            self._rewrite(records)
+
+    def append(self, timestamp, counters, names, uptime=None):
+        """
+        Add a record of ``counters`` ({port: counter}) taken at ``timestamp``.
+
+        ``names`` ({port: name}) updates the port table, the file is rewritten
+        only when ports are added or renamed.
+        """
+        self._update_ports(names)
+        self._append(timestamp, counters, uptime)
+        self._write_header()
+        self._file.flush()
+
+    def slide(self, timestamp, counters, names, window, uptime=None):
+        """
+        Append a record and update ``sums`` over the last ``window`` records.
+
+        Only the previous record and the interval leaving the window are read,
+        so the cost does not depend on the window size. Sums are computed from
+        all records of the window only when its size changed. ``uptime`` is the
+        sysUpTime of the device, used to detect reboots.
+        """
+        self._update_ports(names)
+
+        if window != self.window or not self.count:
+            self._append(timestamp, counters, uptime)
+            self.window = window
+            self.sums = {}
+            records = self.last(window)
+            for previous, current in zip(records, records[1:]):
+                reset = interval_reset(previous, current)
+                for port in self.ports:
+                    self.sums[port] = self.sums.get(port, 0) + increment(previous[1].get(port),
+                                                                         current[1].get(port), self.bits, reset)
+        else:
+            last = self.record(0)
+            reset = interval_reset(last, (timestamp, counters, uptime))
+            if self.count >= window:
+                # The oldest interval of the window is leaving it
+                leaving, following = self.record(window - 1), self.record(window - 2)
+                leaving_reset = interval_reset(leaving, following)
+                leaving, following = leaving[1], following[1]
+            else:
+                leaving = following = {}
+                leaving_reset = False
+
+            for port in self.ports:
+                self.sums[port] = self.sums.get(port, 0) \
+                    + increment(last[1].get(port), counters.get(port), self.bits, reset) \
+                    - increment(leaving.get(port), following.get(port), self.bits, leaving_reset)
+
+            self._append(timestamp, counters, uptime)
+
+        self._write_sums()
+        self._write_header()
+        self._file.flush()
+
+    def _unpack(self, record, data):
+        """Return the record tuple of the slot ``data`` packed with the struct ``record``."""
+        values = record.unpack(data)
+        if len(values) == len(self.ports) + 2:
+            uptime, counters = values[1], values[2:]
+        else:
+            # Record of format version 2 or older, without uptime
+            uptime, counters = MISSING, values[1:]
+        counters = dict((port, value) for port, value in zip(self.ports, counters) if value != MISSING)
+        return values[0], counters, None if uptime == MISSING else uptime
+
+    def record(self, age):
+        """Return the record appended ``age`` runs ago (0 is the last one)."""
+        record = self._record
+        slot = (self.head - 1 - age) % self.capacity
+        self._file.seek(self._records_offset + slot * record.size)
+        return self._unpack(record, self._file.read(record.size))
+
+    def last(self, number, capacity=None, offset=None, record=None):
+        """
+        Return the last ``number`` records, oldest first.
+
+        ``capacity``, ``offset`` and ``record`` (struct of a slot) allow to
+        read records of files of older formats.
+        """
+        capacity = capacity or self.capacity
+        number = min(number, self.count)
+        record = record or self._record
+        offset = offset or self._records_offset
+        head = self.head % capacity
+
+        records = []
+        for i in xrange(number):
+            slot = (head - number + i) % capacity
+            self._file.seek(offset + slot * record.size)
+            records.append(self._unpack(record, self._file.read(record.size)))
+
+        return records
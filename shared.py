@@ -18,4 +18,60 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #===============================================================================
 
-__version__ = '1.2.82'
\ No newline at end of file
+from heapq import heappush, heappop
+
+__version__ = '1.2.82'
+
+# SNMPv2-MIB::sysUpTime, walked as a column of one row with the columns of a
+# table to get it in the same requests instead of a GET of its own
+UPTIME_COLUMN = '1.3.6.1.2.1.1.3'
+
+def join_columns(rows, names):
+    """
+    Join the columns ``names`` of a table indexed by one integer as they are walked.
+
+    ``rows`` is the stream of (name, row) of ``plugin.snmp.walk_columns()``.
+    Yield (index, {name: row}) as soon as a row has a value in every column.
+    Rows that a column walked past without a value are forgotten, so only the
+    rows waiting for a slower column are kept in memory, not the whole table.
+    """
+    pending = {}
+    indexes = []
+    # Last index walked of each column, infinite once the column ended
+    progress = dict((name, 0) for name in names)
+    for name, row in rows:
+        if name not in progress:
+            continue
+        elif row is None:
+            progress[name] = float('inf')
+        else:
+            progress[name] = row.index
+            values = pending.get(row.index)
+            if values is None:
+                values = pending[row.index] = {}
+                heappush(indexes, row.index)
+            values[name] = row
+            if len(values) == len(names):
+                del pending[row.index]
+                yield row.index, values
+
+        while indexes:
+            values = pending.get(indexes[0])
+            if values is not None and all(name in values or progress[name] < indexes[0] for name in names):
+                break
+            pending.pop(heappop(indexes), None)
+
+
+def column_rows(plugin, oid, indexes):
+    """
+    Return the rows of column ``oid`` whose index is in ``indexes``, indexed by index.
+
+    Useful to get the names of a few entries of a large table (eg.
+    entPhysicalName of CPUs or sensors): up to ``--sparse-rows`` rows are
+    fetched with GETs of several rows each, more rows by walking the column
+    and dropping the other rows as they are walked.
+    """
+    if len(indexes) <= plugin.options.sparse_rows:
+        return plugin.snmp.get_rows(oid, indexes)
+    return dict((row.index, row) for name, row in plugin.snmp.walk_columns({'rows': oid})
+                if row is not None and row.index in indexes)
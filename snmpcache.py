@@ -0,0 +1,204 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Filename      : snmpcache.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Short-lived on-disk cache of SNMP walks shared between plugins.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# Plugins checking the same device within a few seconds all walk the same name
+# tables (entPhysicalName is the largest table on a chassis). The cache stores
+# each walked column in its own file keyed by (host, port, community, OID). A
+# lock file per entry makes concurrent plugins wait for the first one to finish
+# its walk and then reuse the result instead of walking the device again.
+#
+# Run this module with a cache directory as argument to show hit/miss counts.
+#
+
+import os
+import sys
+import time
+import fcntl
+import errno
+import hashlib
+import logging
+import cPickle as pickle
+
+logger = logging.getLogger('plugin')
+
+# Columns worth sharing between plugins: names do not change between checks
+SHARED_OIDS = (
+    '1.3.6.1.2.1.47.1.1.1.1.7',     # ENTITY-MIB::entPhysicalName
+    '1.3.6.1.2.1.2.2.1.2',          # IF-MIB::ifDescr
+)
+
+STATS_FILE = 'stats'
+
+# Part of the entry keys, changed with the format of the cached rows so that
+# entries of previous versions are not read
+CACHE_VERSION = 2
+
+
+class WalkCache(object):
+    """Cache of walked columns stored in ``directory`` for ``ttl`` seconds."""
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, host, port, community, oid):
+        key = hashlib.sha1('%d|%s|%d|%s|%s' % (CACHE_VERSION, host, port, community, oid)).hexdigest()
+        return os.path.join(self.directory, key)
+
+    def fetch(self, host, port, community, oid, walk):
+        """
+        Return the cached rows of ``oid`` or call ``walk()`` and cache its result.
+
+        The entry lock is held while walking so that other plugins waiting for
+        the same entry get the fresh rows once it is released.
+        """
+        path = self._path(host, port, community, oid)
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path, 'rb') as entry:
+                    timestamp, rows = pickle.load(entry)
+                if time.time() - timestamp < self.ttl:
+                    logger.debug('Cache hit for %s on %s.' % (oid, host))
+                    self.hits += 1
+                    return rows
+            except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+                pass
+
+            logger.debug('Cache miss for %s on %s.' % (oid, host))
+            self.misses += 1
+            rows = walk()
+
+            temp_path = '%s.%d' % (path, os.getpid())
+            with open(temp_path, 'wb') as entry:
+                pickle.dump((time.time(), rows), entry, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_path, path)
+
+            return rows
+
+    def save_stats(self):
+        """Add hits and misses of this run to the counters of the cache directory."""
+        if not self.hits and not self.misses:
+            return
+
+        path = os.path.join(self.directory, STATS_FILE)
+        with open(path, 'a+b') as stats_file:
+            fcntl.flock(stats_file, fcntl.LOCK_EX)
+            stats_file.seek(0)
+            try:
+                hits, misses = pickle.load(stats_file)
+            except (EOFError, ValueError, pickle.UnpicklingError):
+                hits, misses = 0, 0
+
+            stats_file.seek(0)
+            stats_file.truncate()
+            pickle.dump((hits + self.hits, misses + self.misses), stats_file)
+
+        self.hits = self.misses = 0
+
+
+def load_stats(directory):
+    """Return the tuple (hits, misses) counted in the cache directory."""
+    try:
+        with open(os.path.join(directory, STATS_FILE), 'rb') as stats_file:
+            return pickle.load(stats_file)
+    except (IOError, EOFError):
+        return 0, 0
+
+
+class CachedQuery(object):
+    """Wrap a plugin SNMP query object to read shared columns from a ``WalkCache``."""
+    def __init__(self, query, cache, host, port, community):
+        self.query = query
+        self.cache = cache
+        self.host = host
+        self.port = port
+        self.community = community
+
+    def get(self, oids):
+        return self.query.get(oids)
+
+    def _fetch(self, name, oid):
+        walk = lambda: self.query.getnext({name: oid}).get(name, [])
+        return self.cache.fetch(self.host, self.port, self.community, oid, walk)
+
+    def get_rows(self, oid, indexes):
+        """Rows of a shared column come from its cached walk, others are asked to the agent."""
+        if oid.strip('.') not in SHARED_OIDS:
+            return self.query.get_rows(oid, indexes)
+
+        rows = dict((row.index, row) for row in self._fetch('rows', oid) if row.index in indexes)
+        self.cache.save_stats()
+        return rows
+
+    def getnext(self, oids):
+        results = {}
+        uncached = {}
+        for name, oid in oids.iteritems():
+            if oid.strip('.') not in SHARED_OIDS:
+                uncached[name] = oid
+                continue
+
+            rows = self._fetch(name, oid)
+            if rows:
+                results[name] = rows
+
+        if uncached:
+            results.update(self.query.getnext(uncached))
+
+        self.cache.save_stats()
+        return results
+
+    def walk_columns(self, oids):
+        """Stream the rows of ``oids`` like Session.walk_columns(), shared columns coming from the cache."""
+        uncached = {}
+        try:
+            for name, oid in oids.iteritems():
+                if oid.strip('.') not in SHARED_OIDS:
+                    uncached[name] = oid
+                    continue
+
+                for row in self._fetch(name, oid):
+                    yield name, row
+                yield name, None
+
+            if uncached:
+                for name, row in self.query.walk_columns(uncached):
+                    yield name, row
+        finally:
+            self.cache.save_stats()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.stderr.write('Usage: %s <cache directory>\n' % os.path.basename(sys.argv[0]))
+        sys.exit(3)
+
+    hits, misses = load_stats(sys.argv[1])
+    total = hits + misses
+    print 'Hits: %d, misses: %d, hit ratio: %.1f%%' % (hits, misses, 100.0 * hits / total if total else 0)
@@ -0,0 +1,578 @@
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Filename      : snmpclient.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Minimal SNMP v1/v2c client able to walk tables with GETBULK.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# Messages are encoded with the pysnmp protocol API (already required by
+# monitoring.nagios) and sent on a plain UDP socket, so that the number of PDUs
+# sent is known and walks can use GETBULK on SNMPv2c agents.
+#
+# Results have the same interface as the ones returned by the query object of
+# NagiosPluginSNMP: get() returns a dict of results and getnext() a dict of
+# lists of results, each result having oid, index, value and pretty().
+# get_rows() fetches a few rows of a large column with GETs instead of a walk.
+# walk_columns() streams the rows of getnext() as responses arrive, so that
+# plugins keep only the rows they need of large tables.
+#
+
+import errno
+import socket
+import random
+import select
+import logging
+from timeit import default_timer
+from collections import OrderedDict, deque
+
+from pyasn1.type import univ
+from pyasn1.codec.ber import encoder, decoder
+from pyasn1.error import PyAsn1Error
+from pysnmp.proto import api, rfc1902, rfc1905
+
+logger = logging.getLogger('plugin')
+
+# Protocol modules by SNMP version
+PROTOCOLS = {
+    '1': api.protoModules[api.protoVersion1],
+    '2c': api.protoModules[api.protoVersion2c],
+}
+
+# Values marking the end of a walk or a missing GET value
+EXCEPTION_VALUES = (rfc1905.EndOfMibView, rfc1905.NoSuchObject, rfc1905.NoSuchInstance, univ.Null)
+
+# Error status of responses that would not fit in a message
+TOO_BIG = 1
+
+# SNMPv1 error status returned at the end of the MIB
+NO_SUCH_NAME = 2
+
+# Rows asked per GET of get_rows()
+GET_ROWS = 25
+
+
+class SNMPError(Exception):
+    """Raised on timeout or SNMP error returned by the agent."""
+    pass
+
+
+class SNMPTimeout(SNMPError):
+    """Raised when the agent did not answer a request."""
+    pass
+
+
+class Varbind(object):
+    """
+    One value of a SNMP response.
+
+    Rows of a walk are kept compact as tables have tens of thousands of them:
+    no ASN.1 object is kept, the OID is split into the OID of the column
+    (``root``, the same string for all rows of a column) and the integer
+    sub-identifiers of the row index (``suffix``). ``text`` is the pretty
+    printed value when it differs from the value (named integers, binary
+    strings).
+    """
+    __slots__ = ('root', 'suffix', 'value', 'text')
+
+    def __init__(self, root, suffix, value):
+        self.root = root
+        self.suffix = suffix
+        self.value = convert(value)
+        self.text = pretty_text(value, self.value)
+
+    @property
+    def oid(self):
+        return '%s.%s' % (self.root, '.'.join(str(sub_id) for sub_id in self.suffix))
+
+    @property
+    def index(self):
+        return self.suffix[-1]
+
+    def pretty(self):
+        if self.text is not None:
+            return self.text
+        elif isinstance(self.value, str):
+            return self.value
+        return str(self.value)
+
+    def __getstate__(self):
+        return self.root, self.suffix, self.value, self.text
+
+    def __setstate__(self, state):
+        self.root, self.suffix, self.value, self.text = state
+
+    def __repr__(self):
+        return '<Varbind %s = %r>' % (self.oid, self.value)
+
+
+def split_oid(oid):
+    """Return the tuple (parent OID, (last sub-identifier,)) of ``oid``, a value of a GET."""
+    sub_ids = tuple(oid)
+    return '.'.join(str(sub_id) for sub_id in sub_ids[:-1]), sub_ids[-1:]
+
+
+def convert(value):
+    """Convert an ASN.1 value to its Python equivalent."""
+    if isinstance(value, univ.Integer):
+        return long(value) if isinstance(value, rfc1902.Counter64) else int(value)
+    elif isinstance(value, rfc1902.IpAddress) or isinstance(value, univ.ObjectIdentifier):
+        return value.prettyPrint()
+    elif isinstance(value, univ.OctetString):
+        return str(value)
+    return value
+
+
+# Characters of strings printed as is by prettyPrint(), others are hexified
+PRINTABLE = ''.join(chr(char) for char in xrange(32, 127))
+
+
+def pretty_text(value, converted):
+    """Return prettyPrint() of the ASN.1 ``value`` if it differs from its ``converted`` value, else None."""
+    if type(value) in (univ.OctetString, rfc1902.OctetString):
+        if converted.translate(None, PRINTABLE):
+            return '0x' + converted.encode('hex')
+        return None
+    elif isinstance(value, univ.Integer) and not value.namedValues:
+        return None
+
+    text = value.prettyPrint()
+    if text == (converted if isinstance(converted, str) else str(converted)):
+        return None
+    return text
+
+
+class Session(object):
+    """
+    SNMP session to one agent.
+
+    Walks use GETBULK with ``max_repetitions`` rows per PDU on SNMPv2c agents,
+    and GETNEXT on SNMPv1 agents or when ``max_repetitions`` is 0. Up to
+    ``max_columns`` columns of getnext() are walked together, each PDU asking
+    for the next rows of all of them. The number of PDUs sent (retries
+    included) is counted in ``pdus``, responses received in ``responses``.
+
+    Seconds spent resolving the agent address are kept in ``setup_time``, waiting
+    for responses in ``request_time`` and walking each column of getnext() in
+    ``walk_times`` ({name: seconds}).
+    """
+    def __init__(self, hostname, community='public', version='2c', port=161, timeout=1.0, retries=5,
+                 max_repetitions=25, max_columns=8):
+        self.hostname = hostname
+        self.community = community
+        self.version = version
+        self.port = port
+        self.address = (hostname, port)
+        self.timeout = timeout
+        self.retries = retries
+        self.max_repetitions = max_repetitions
+        self.max_columns = max(max_columns, 1)
+        self.pdus = 0
+        self.responses = 0
+        self.setup_time = 0.0
+        self.request_time = 0.0
+        self.walk_times = OrderedDict()
+        self.proto = PROTOCOLS[version]
+        self._socket = None
+        self._resolved = False
+
+    @property
+    def bulk(self):
+        return self.version != '1' and self.max_repetitions > 0
+
+    def close(self):
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+
+    def reuse(self, timeout=1.0, retries=5, max_repetitions=25, max_columns=8):
+        """
+        Prepare the session for a new check with these options.
+
+        The socket is kept, counters and timings start again from zero and the
+        agent address is resolved again on the next request.
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.max_repetitions = max_repetitions
+        self.max_columns = max(max_columns, 1)
+        self.pdus = 0
+        self.responses = 0
+        self.setup_time = 0.0
+        self.request_time = 0.0
+        self.walk_times = OrderedDict()
+        self.address = (self.hostname, self.port)
+        self._resolved = False
+        if self._socket:
+            self._socket.settimeout(timeout)
+
+    def _resolve(self):
+        """Return the (address, port) of the agent, resolving its name on first call."""
+        if not self._resolved:
+            start = default_timer()
+            try:
+                address = socket.getaddrinfo(self.address[0], self.address[1], socket.AF_INET, socket.SOCK_DGRAM)
+            except socket.gaierror as e:
+                raise SNMPError('Cannot resolve %s: %s' % (self.hostname, e))
+            finally:
+                self.setup_time += default_timer() - start
+            self.address = address[0][4]
+            self._resolved = True
+        return self.address
+
+    def _connect(self):
+        if not self._socket:
+            self._resolve()
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.settimeout(self.timeout)
+        return self._socket
+
+    def _message(self, pdu):
+        message = self.proto.Message()
+        self.proto.apiMessage.setDefaults(message)
+        self.proto.apiMessage.setCommunity(message, self.community)
+        self.proto.apiMessage.setPDU(message, pdu)
+        return encoder.encode(message)
+
+    def _request(self, pdu):
+        """Send ``pdu`` and return the matching response PDU."""
+        request_id = random.randint(1, 0x7fffffff)
+        self.proto.apiPDU.setRequestID(pdu, request_id)
+        data = self._message(pdu)
+        sock = self._connect()
+
+        start = default_timer()
+        try:
+            return self._send(sock, data, request_id)
+        finally:
+            self.request_time += default_timer() - start
+
+    def _send(self, sock, data, request_id):
+        """Send ``data`` (retrying on timeout) until the response to ``request_id`` is received."""
+        for attempt in xrange(self.retries + 1):
+            self.pdus += 1
+            sock.sendto(data, self.address)
+            try:
+                while True:
+                    response, address = sock.recvfrom(65535)
+                    try:
+                        message, _ = decoder.decode(response, asn1Spec=self.proto.Message())
+                    except PyAsn1Error:
+                        logger.debug('Ignoring malformed response from %s.' % (address,))
+                        continue
+
+                    response_pdu = self.proto.apiMessage.getPDU(message)
+                    if self.proto.apiPDU.getRequestID(response_pdu) == request_id:
+                        self.responses += 1
+                        return response_pdu
+            except socket.timeout:
+                logger.debug('Timeout waiting for %s (attempt %d).' % (self.hostname, attempt + 1))
+            except socket.error as e:
+                raise SNMPError('Cannot query %s: %s' % (self.hostname, e))
+
+        raise SNMPTimeout('No SNMP response received from %s before timeout.' % self.hostname)
+
+    def _check_error(self, pdu):
+        status = self.proto.apiPDU.getErrorStatus(pdu)
+        if status:
+            raise SNMPError('%s returned error %s.' % (self.hostname, status.prettyPrint()))
+
+    def _get_pdu(self, names, oids):
+        pdu = self.proto.GetRequestPDU()
+        self.proto.apiPDU.setDefaults(pdu)
+        self.proto.apiPDU.setVarBinds(pdu, [(oids[name], self.proto.Null('')) for name in names])
+        return pdu
+
+    def _get_results(self, names, response):
+        self._check_error(response)
+
+        results = {}
+        for name, (oid, value) in zip(names, self.proto.apiPDU.getVarBinds(response)):
+            if not isinstance(value, EXCEPTION_VALUES):
+                root, suffix = split_oid(oid)
+                results[name] = Varbind(root, suffix, value)
+        return results
+
+    def get(self, oids):
+        """GET all values of the dict ``oids``, return a dict of ``Varbind``."""
+        names = oids.keys()
+        response = self._request(self._get_pdu(names, oids))
+        return self._get_results(names, response)
+
+    def get_rows(self, oid, indexes):
+        """
+        GET the rows ``indexes`` of column ``oid``, return a dict of ``Varbind`` by index.
+
+        Rows are asked ``GET_ROWS`` at a time, rows missing on the agent are
+        not in the result. Requests whose response would be too big for the
+        agent are split in two, rows unknown to SNMPv1 agents (noSuchName) are
+        removed from the request sent again.
+        """
+        root = univ.ObjectIdentifier(oid)
+        root_str = str(root)
+        indexes = sorted(indexes)
+        requests = [indexes[start:start + GET_ROWS] for start in xrange(0, len(indexes), GET_ROWS)]
+
+        rows = {}
+        while requests:
+            batch = requests.pop()
+            pdu = self.proto.GetRequestPDU()
+            self.proto.apiPDU.setDefaults(pdu)
+            self.proto.apiPDU.setVarBinds(pdu, [(root + (index,), self.proto.Null('')) for index in batch])
+            response = self._request(pdu)
+
+            status = self.proto.apiPDU.getErrorStatus(response)
+            position = int(self.proto.apiPDU.getErrorIndex(response)) - 1
+            if status == TOO_BIG and len(batch) > 1:
+                requests.extend([batch[:len(batch) // 2], batch[len(batch) // 2:]])
+                continue
+            elif status == NO_SUCH_NAME and 0 <= position < len(batch):
+                del batch[position]
+                if batch:
+                    requests.append(batch)
+                continue
+
+            self._check_error(response)
+            for index, (_, value) in zip(batch, self.proto.apiPDU.getVarBinds(response)):
+                if not isinstance(value, EXCEPTION_VALUES):
+                    rows[index] = Varbind(root_str, (index,), value)
+
+        logger.debug('Got %d of %d rows of %s.' % (len(rows), len(indexes), oid))
+        return rows
+
+    def walk(self, oid):
+        """Generator of ``Varbind`` of all rows below ``oid``."""
+        for name, varbind in self.walk_columns({oid: oid}):
+            if varbind is not None:
+                yield varbind
+
+    def walk_columns(self, oids):
+        """
+        Generator of (name, ``Varbind``) of the rows of all columns of the dict ``oids``.
+
+        Columns are walked together, ``max_columns`` at most, each request
+        holding one varbind per column still being walked. A walk takes as many
+        PDUs as its longest column instead of the sum of the columns. Rows of a
+        column are yielded in order as responses arrive, rows of different
+        columns are interleaved. (name, None) is yielded at the end of each
+        column.
+        """
+        waiting = deque(oids.iteritems())
+        # Columns being walked: [name, root OID, last OID, start time, root
+        # OID string, root OID length]
+        columns = []
+
+        while waiting or columns:
+            while waiting and len(columns) < self.max_columns:
+                name, oid = waiting.popleft()
+                root = univ.ObjectIdentifier(oid)
+                columns.append([name, root, root, default_timer(), str(root), len(root)])
+
+            if self.bulk:
+                pdu = self.proto.GetBulkRequestPDU()
+                self.proto.apiBulkPDU.setDefaults(pdu)
+                self.proto.apiBulkPDU.setMaxRepetitions(pdu, self.max_repetitions)
+                self.proto.apiBulkPDU.setNonRepeaters(pdu, 0)
+                api_pdu = self.proto.apiBulkPDU
+            else:
+                pdu = self.proto.GetNextRequestPDU()
+                self.proto.apiPDU.setDefaults(pdu)
+                api_pdu = self.proto.apiPDU
+            api_pdu.setVarBinds(pdu, [(column[2], self.proto.Null('')) for column in columns])
+
+            response = self._request(pdu)
+            finished = set()
+            if self.version == '1' and self.proto.apiPDU.getErrorStatus(response) == NO_SUCH_NAME:
+                # End of the MIB reached by the column at the error index
+                index = int(self.proto.apiPDU.getErrorIndex(response)) - 1
+                finished.update([index] if 0 <= index < len(columns) else xrange(len(columns)))
+            else:
+                self._check_error(response)
+                rows = api_pdu.getVarBindTable(pdu, response)
+                if not rows:
+                    finished.update(xrange(len(columns)))
+
+                for row in rows:
+                    for index, (next_oid, value) in enumerate(row[:len(columns)]):
+                        if index in finished:
+                            continue
+                        column = columns[index]
+                        if isinstance(value, EXCEPTION_VALUES) or not column[1].isPrefixOf(next_oid) \
+                                or next_oid <= column[2]:
+                            finished.add(index)
+                            continue
+                        column[2] = next_oid
+                        yield column[0], Varbind(column[4], tuple(next_oid)[column[5]:], value)
+
+            for index in sorted(finished, reverse=True):
+                name, root, last, start = columns.pop(index)[:4]
+                self.walk_times[name] = self.walk_times.get(name, 0) + default_timer() - start
+                yield name, None
+
+    def getnext(self, oids):
+        """
+        Walk all columns of the dict ``oids``, return a dict of lists of ``Varbind``.
+
+        Columns returning no row are not in the result.
+        """
+        results = {}
+        for name, varbind in self.walk_columns(oids):
+            if varbind is not None:
+                results.setdefault(name, []).append(varbind)
+        for name, oid in oids.iteritems():
+            logger.debug('Walked %d rows for %s (%s).' % (len(results.get(name, [])), name, oid))
+        return results
+
+
+class SessionCache(object):
+    """
+    Sessions kept open for the next checks of a process, up to ``size``.
+
+    Sessions are keyed by (hostname, port, version, community), the least
+    recently used one is closed when the cache is full.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.sessions = OrderedDict()
+
+    def get(self, hostname, community='public', version='2c', port=161, **options):
+        """Return the session of the agent, ready for a new check with ``options`` (see Session)."""
+        key = (hostname, port, version, community)
+        session = self.sessions.pop(key, None)
+        if session is None:
+            session = Session(hostname, community=community, version=version, port=port, **options)
+        else:
+            session.reuse(**options)
+        self.sessions[key] = session
+
+        while len(self.sessions) > self.size:
+            self.sessions.popitem(last=False)[1].close()
+        return session
+
+
+def get_many(sessions, oids, deadline=None, window=256):
+    """
+    GET the values of the dict ``oids`` from the agents of all ``sessions``.
+
+    Requests are sent on one socket without waiting for the responses, with at
+    most ``window`` requests in flight. Responses are matched to requests by
+    request ID and source address, requests are sent again after the timeout
+    of their session up to its retries. Agents that did not answer within
+    ``deadline`` seconds are given up.
+
+    Return the list of results of each session: a dict of ``Varbind`` as
+    returned by Session.get() or the SNMPError raised for this agent.
+    """
+    names = oids.keys()
+    results = [None] * len(sessions)
+    waiting = deque(xrange(len(sessions)))
+    # Requests in flight by request ID: [session number, message, attempts, sent at]
+    pending = {}
+    end = default_timer() + deadline if deadline else None
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(0)
+
+    def send(request_id):
+        request = pending[request_id]
+        session = sessions[request[0]]
+        session.pdus += 1
+        request[2] += 1
+        request[3] = default_timer()
+        try:
+            sock.sendto(request[1], session.address)
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.ENOBUFS):
+                del pending[request_id]
+                results[request[0]] = SNMPError('Cannot query %s: %s' % (session.hostname, e))
+
+    try:
+        while waiting or pending:
+            now = default_timer()
+            if end and now >= end:
+                break
+
+            while waiting and len(pending) < window:
+                number = waiting.popleft()
+                session = sessions[number]
+                try:
+                    session._resolve()
+                except SNMPError as e:
+                    results[number] = e
+                    continue
+
+                request_id = random.randint(1, 0x7fffffff)
+                while request_id in pending:
+                    request_id = random.randint(1, 0x7fffffff)
+                pdu = session._get_pdu(names, oids)
+                session.proto.apiPDU.setRequestID(pdu, request_id)
+                pending[request_id] = [number, session._message(pdu), 0, 0]
+                send(request_id)
+
+            # Send again or give up requests without response
+            next_timeout = end
+            for request_id, (number, message, attempts, sent) in pending.items():
+                session = sessions[number]
+                if now - sent < session.timeout:
+                    expires = sent + session.timeout
+                elif attempts > session.retries:
+                    del pending[request_id]
+                    results[number] = SNMPTimeout('No SNMP response received from %s before timeout.' %
+                                                  session.hostname)
+                    continue
+                else:
+                    logger.debug('Timeout waiting for %s (attempt %d).' % (session.hostname, attempts))
+                    send(request_id)
+                    expires = now + session.timeout
+                next_timeout = min(next_timeout or expires, expires)
+
+            if not pending:
+                continue
+
+            readable, _, _ = select.select([sock], [], [], max(next_timeout - default_timer(), 0))
+            while readable:
+                try:
+                    response, address = sock.recvfrom(65535)
+                except socket.error as e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        break
+                    raise
+
+                try:
+                    proto = api.protoModules[api.decodeMessageVersion(response)]
+                    message, _ = decoder.decode(response, asn1Spec=proto.Message())
+                except (PyAsn1Error, KeyError):
+                    logger.debug('Ignoring malformed response from %s.' % (address,))
+                    continue
+
+                response_pdu = proto.apiMessage.getPDU(message)
+                request = pending.get(int(proto.apiPDU.getRequestID(response_pdu)))
+                if not request or sessions[request[0]].address != address:
+                    continue
+
+                del pending[int(proto.apiPDU.getRequestID(response_pdu))]
+                sessions[request[0]].responses += 1
+                try:
+                    results[request[0]] = sessions[request[0]]._get_results(names, response_pdu)
+                except SNMPError as e:
+                    results[request[0]] = e
+    finally:
+        sock.close()
+
+    for number in list(waiting) + [request[0] for request in pending.itervalues()]:
+        results[number] = SNMPTimeout('No SNMP response received from %s before deadline.' %
+                                      sessions[number].hostname)
+
+    return results
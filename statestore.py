@@ -0,0 +1,295 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Filename      : statestore.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Memory-mapped store of the state of the plugins of all hosts.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+# A single file holds the state of every (host, plugin, key) in fixed-size
+# slots, instead of one pickle file per host and plugin. An entry lives in the
+# first slot of its probe sequence (hash of the key, then the following slots)
+# that is free or holds the same key, so a plugin only reads and writes its own
+# slots whatever the number of hosts.
+#
+# File layout (little endian):
+#
+#   header   magic 'NPSS', format version, number of slots, slot size
+#   slots    for each slot: hash of the key (0 if free), key length, value
+#            length, write timestamp (double), key, value (marshal)
+#
+# Writers of concurrent processes lock the slots they use with POSIX record
+# locks, and hold a shared lock on the header that compact() takes exclusively
+# to rewrite the file. Slots are never freed while the store is in use, run
+# this module with --compact from time to time to drop the state of hosts that
+# are not checked anymore:
+#
+#   $ ./statestore.py --compact --max-age 604800 /var/tmp/netplugins.state
+#
+
+import os
+import sys
+import mmap
+import zlib
+import fcntl
+import struct
+import marshal
+import logging
+import argparse
+from time import time
+
+logger = logging.getLogger('plugin')
+
+MAGIC = 'NPSS'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHII')
+SLOT_HEADER = struct.Struct('<IHHd')
+
+# Slots probed before giving up, the store is then too small
+MAX_PROBES = 64
+
+
+class StoreFull(IOError):
+    """No free slot for a new entry near its hash, the store needs more slots."""
+    pass
+
+
+class StateStore(object):
+    """
+    Store of ``slots`` entries of at most ``slot_size`` bytes in file ``path``.
+
+    The geometry of an existing file is kept, the arguments only apply to new
+    files. Values are any object marshal can serialize.
+    """
+    def __init__(self, path, slots=65536, slot_size=256):
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self._fd = None
+        self._map = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        """Map the store in memory, creating it if needed."""
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER.size, 0)
+        try:
+            header = os.read(self._fd, HEADER.size)
+            if len(header) < HEADER.size:
+                logger.debug('Creating state store %s with %d slots.' % (self.path, self.slots))
+                os.ftruncate(self._fd, HEADER.size + self.slots * self.slot_size)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, HEADER.pack(MAGIC, FORMAT_VERSION, self.slots, self.slot_size))
+            else:
+                magic, version, self.slots, self.slot_size = HEADER.unpack(header)
+                if magic != MAGIC or version != FORMAT_VERSION:
+                    raise IOError('%s is not a state store file.' % self.path)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER.size, 0)
+
+        self._map = mmap.mmap(self._fd, HEADER.size + self.slots * self.slot_size, mmap.MAP_SHARED)
+
+    def close(self):
+        if self._map:
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @staticmethod
+    def _key(host, plugin, key):
+        return '%s\0%s\0%s' % (host, plugin, key)
+
+    def _offset(self, slot):
+        return HEADER.size + slot * self.slot_size
+
+    def _lock(self, slot, operation):
+        fcntl.lockf(self._fd, operation, self.slot_size, self._offset(slot))
+
+    def _find(self, key):
+        """
+        Return the slot holding ``key`` or the free slot where to add it.
+
+        The slot is returned locked, the caller must unlock it.
+        """
+        key_hash = zlib.crc32(key) & 0xffffffff or 1
+        for probe in xrange(min(MAX_PROBES, self.slots)):
+            slot = (key_hash + probe) % self.slots
+            self._lock(slot, fcntl.LOCK_EX)
+            offset = self._offset(slot)
+            slot_hash, key_length = SLOT_HEADER.unpack_from(self._map, offset)[:2]
+            if not slot_hash:
+                return slot
+            elif slot_hash == key_hash:
+                start = offset + SLOT_HEADER.size
+                if self._map[start:start + key_length] == key:
+                    return slot
+            self._lock(slot, fcntl.LOCK_UN)
+
+        raise StoreFull('No free slot for %r in %s, make a new store with more slots.' % (key, self.path))
+
+    def _read(self, slot):
+        """Return the tuple (key, value, timestamp) of ``slot``, None if free."""
+        offset = self._offset(slot)
+        slot_hash, key_length, value_length, timestamp = SLOT_HEADER.unpack_from(self._map, offset)
+        if not slot_hash:
+            return None
+        start = offset + SLOT_HEADER.size
+        key = self._map[start:start + key_length]
+        value = marshal.loads(self._map[start + key_length:start + key_length + value_length])
+        return key, value, timestamp
+
+    def _write(self, slot, key, data, timestamp):
+        if SLOT_HEADER.size + len(key) + len(data) > self.slot_size:
+            raise ValueError('State of %r is too large for slots of %d bytes.' % (key, self.slot_size))
+        offset = self._offset(slot)
+        start = offset + SLOT_HEADER.size
+        self._map[start:start + len(key) + len(data)] = key + data
+        SLOT_HEADER.pack_into(self._map, offset, zlib.crc32(key) & 0xffffffff or 1, len(key), len(data), timestamp)
+
+    def _shared(self, operation):
+        fcntl.lockf(self._fd, operation, HEADER.size, 0)
+
+    def get(self, host, plugin, key, default=None):
+        """Return the value stored for ``key`` of ``plugin`` on ``host``."""
+        key = self._key(host, plugin, key)
+        self._shared(fcntl.LOCK_SH)
+        try:
+            slot = self._find(key)
+            try:
+                entry = self._read(slot)
+            finally:
+                self._lock(slot, fcntl.LOCK_UN)
+        finally:
+            self._shared(fcntl.LOCK_UN)
+        return entry[1] if entry else default
+
+    def set(self, host, plugin, key, value):
+        """Store ``value`` for ``key`` of ``plugin`` on ``host``."""
+        key = self._key(host, plugin, key)
+        data = marshal.dumps(value)
+        self._shared(fcntl.LOCK_SH)
+        try:
+            slot = self._find(key)
+            try:
+                self._write(slot, key, data, time())
+            finally:
+                self._lock(slot, fcntl.LOCK_UN)
+        finally:
+            self._shared(fcntl.LOCK_UN)
+
+    def update(self, host, plugin, key, function):
+        """
+        Replace the value of ``key`` by ``function(value)`` (value is None if
+        missing) while its slot is locked, and return the new value.
+
+        Concurrent updates of a key are applied one after the other, eg. to
+        increment a counter or to let a single process claim a task. The slot
+        is only written when the value changed, a missing key stays missing
+        when ``function`` returns None.
+        """
+        key = self._key(host, plugin, key)
+        self._shared(fcntl.LOCK_SH)
+        try:
+            slot = self._find(key)
+            try:
+                entry = self._read(slot)
+                previous = entry[1] if entry else None
+                value = function(previous)
+                if value != previous:
+                    self._write(slot, key, marshal.dumps(value), time())
+            finally:
+                self._lock(slot, fcntl.LOCK_UN)
+        finally:
+            self._shared(fcntl.LOCK_UN)
+        return value
+
+    def entries(self):
+        """Return the list of (host, plugin, key, value, timestamp) of the store."""
+        entries = []
+        self._shared(fcntl.LOCK_SH)
+        try:
+            for slot in xrange(self.slots):
+                self._lock(slot, fcntl.LOCK_SH)
+                try:
+                    entry = self._read(slot)
+                finally:
+                    self._lock(slot, fcntl.LOCK_UN)
+                if entry:
+                    key, value, timestamp = entry
+                    entries.append(tuple(key.split('\0', 2)) + (value, timestamp))
+        finally:
+            self._shared(fcntl.LOCK_UN)
+        return entries
+
+    def compact(self, max_age):
+        """
+        Drop entries not written for ``max_age`` seconds and put the others
+        back at their best slot. Return the number of entries kept.
+        """
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER.size, 0)
+        try:
+            entries = []
+            limit = time() - max_age
+            for slot in xrange(self.slots):
+                offset = self._offset(slot)
+                slot_hash, key_length, value_length, timestamp = SLOT_HEADER.unpack_from(self._map, offset)
+                if slot_hash and timestamp >= limit:
+                    start = offset + SLOT_HEADER.size
+                    entries.append((self._map[start:start + key_length],
+                                    self._map[start + key_length:start + key_length + value_length], timestamp))
+
+            self._map[HEADER.size:] = '\0' * (self.slots * self.slot_size)
+            for key, data, timestamp in entries:
+                slot = self._find(key)
+                self._write(slot, key, data, timestamp)
+                self._lock(slot, fcntl.LOCK_UN)
+            self._map.flush()
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER.size, 0)
+        return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show or compact the state store of the plugins.')
+    parser.add_argument('path', help='State store file.')
+    parser.add_argument('--compact', action='store_true', help='Drop old entries.')
+    parser.add_argument('--max-age', type=int, default=7 * 86400,
+                        help='Age in seconds of the entries dropped by --compact (default: %(default)s).')
+    options = parser.parse_args()
+
+    if not os.path.exists(options.path):
+        parser.error('%s does not exist.' % options.path)
+
+    with StateStore(options.path) as store:
+        if options.compact:
+            kept = store.compact(options.max_age)
+            print 'Kept %d entries of %d slots.' % (kept, store.slots)
+        else:
+            for host, plugin, key, value, timestamp in sorted(store.entries()):
+                print '%s %s %s %r (%ds ago)' % (host, plugin, key, value, time() - timestamp)
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python2.7
+# -*- coding: UTF-8 -*-
+#===============================================================================
+# Name          : test_statestore.py
+# Author        : Vincent BESANCON <besancon.vincent@gmail.com>
+# Description   : Tests of the state store shared by all hosts and plugins.
+#-------------------------------------------------------------------------------
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#===============================================================================
+#
+#   $ python2.7 -m unittest discover -s tests
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import statestore
+from statestore import StateStore
+
+# Processes updating the store together and updates by each of them
+PROCESSES = 8
+UPDATES = 200
+
+# Keys updated by all processes, more than the slots of the store near their
+# hash so that their probe sequences overlap
+KEYS = 6
+
+
+def increment(value):
+    return (value or 0) + 1
+
+
+def update_keys(path, number):
+    """Increment the shared keys and the key of process ``number`` in the store ``path``."""
+    with StateStore(path) as store:
+        for i in xrange(UPDATES):
+            for key in xrange(KEYS):
+                store.update('host%d' % key, 'Test', 'counter', increment)
+            store.update('process%d' % number, 'Test', 'counter', increment)
+
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.state')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_concurrent_update(self):
+        # Created small before the workers open it, they keep its geometry
+        with StateStore(self.path, slots=32, slot_size=64):
+            pass
+
+        processes = [multiprocessing.Process(target=update_keys, args=(self.path, number))
+                     for number in xrange(PROCESSES)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        with StateStore(self.path) as store:
+            for key in xrange(KEYS):
+                self.assertEqual(store.get('host%d' % key, 'Test', 'counter'), PROCESSES * UPDATES)
+            for number in xrange(PROCESSES):
+                self.assertEqual(store.get('process%d' % number, 'Test', 'counter'), UPDATES)
+            self.assertEqual(len(store.entries()), KEYS + PROCESSES)
+
+    def test_update_unchanged(self):
+        with StateStore(self.path, slots=16, slot_size=64) as store:
+            self.assertIsNone(store.update('host', 'Test', 'missing', lambda value: value))
+            self.assertEqual(store.entries(), [])
+
+            store.set('host', 'Test', 'key', 1)
+            timestamp = store.entries()[0][4]
+            self.assertEqual(store.update('host', 'Test', 'key', lambda value: value), 1)
+            self.assertEqual(store.entries()[0][4], timestamp)
+
+    def test_compact_keeps_live_slots(self):
+        real_time = statestore.time
+        with StateStore(self.path, slots=8, slot_size=64) as store:
+            # Old entries first, so that live ones are found after them in the
+            # probe sequences of the 8 slots
+            statestore.time = lambda: real_time() - 3600
+            try:
+                for host in xrange(4):
+                    store.set('old%d' % host, 'Test', 'key', host)
+            finally:
+                statestore.time = real_time
+            for host in xrange(4):
+                store.set('live%d' % host, 'Test', 'key', {'value': host})
+
+            self.assertEqual(store.compact(600), 4)
+
+            for host in xrange(4):
+                self.assertEqual(store.get('live%d' % host, 'Test', 'key'), {'value': host})
+                self.assertIsNone(store.get('old%d' % host, 'Test', 'key'))
+            self.assertEqual(sorted(entry[0] for entry in store.entries()), ['live%d' % host for host in xrange(4)])
+
+            # Slots of dropped entries are free again
+            for host in xrange(4):
+                store.set('new%d' % host, 'Test', 'key', host)
+            self.assertEqual(len(store.entries()), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()